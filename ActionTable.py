@@ -0,0 +1,105 @@
+import torch as T
+
+from Config import AgentConfig
+from typing import Sequence, Tuple, Union
+
+
+class ActionTable:
+    """Precomputed (n_actions, 2) table of (wheel_angle, acceleration) controls
+    for every discrete action, so indices map to controls with one gather.
+    Action a = acceleration_index * n_wheel_angles + wheel_angle_index."""
+
+    def __init__(
+        self,
+        wheel_angles: Sequence[float],
+        accelerations: Sequence[float],
+        dtype: T.dtype = T.float64,
+        device: str = "cpu",
+    ):
+        self.wheel_angles = T.as_tensor(wheel_angles, dtype=dtype, device=device)
+        self.accelerations = T.as_tensor(accelerations, dtype=dtype, device=device)
+
+        for name, values in (
+            ("Wheel angles", self.wheel_angles),
+            ("Accelerations", self.accelerations),
+        ):
+            if values.dim() != 1 or values.numel() == 0:
+                raise ValueError(f"{name} must be a non-empty 1D sequence")
+            if T.any(values[1:] <= values[:-1]):
+                raise ValueError(f"{name} must be strictly increasing, got {values.tolist()}")
+
+        self.n_wheel_angles = self.wheel_angles.numel()
+        self.n_accelerations = self.accelerations.numel()
+        self.n_actions = self.n_wheel_angles * self.n_accelerations
+
+        self.table = T.stack(
+            (
+                self.wheel_angles.repeat(self.n_accelerations),
+                self.accelerations.repeat_interleave(self.n_wheel_angles),
+            ),
+            dim=1,
+        )
+
+    @staticmethod
+    def GetGrid(n_values: int, exponent: float = 1.0) -> T.Tensor:
+        """n_values evenly spaced over [-1, 1] and warped by sign(x) * |x| **
+        exponent, so exponents above 1 give finer steps near 0."""
+        grid = T.linspace(-1.0, 1.0, n_values, dtype=T.float64)
+
+        if n_values == 1:
+            grid = T.zeros((1,), dtype=T.float64)
+
+        return T.sign(grid) * T.abs(grid) ** exponent
+
+    @staticmethod
+    def FromConfig(
+        agent_config: AgentConfig, dtype: T.dtype = T.float64, device: str = "cpu"
+    ) -> "ActionTable":
+        return ActionTable(
+            ActionTable.GetGrid(
+                agent_config.n_wheel_angles, agent_config.wheel_angle_exponent
+            ),
+            ActionTable.GetGrid(
+                agent_config.n_accelerations, agent_config.acceleration_exponent
+            ),
+            dtype=dtype,
+            device=device,
+        )
+
+    def Validate(self, control_range: Tuple[float, float]):
+        low, high = control_range
+
+        if T.any(self.table < low) or T.any(self.table > high):
+            raise ValueError(
+                f"Action table controls span [{float(self.table.min())}, "
+                f"{float(self.table.max())}], outside the environment's control "
+                f"range [{low}, {high}]"
+            )
+
+    def GetIndices(
+        self, action_indices: Union[int, T.Tensor]
+    ) -> Tuple[Union[int, T.Tensor], Union[int, T.Tensor]]:
+        """Returns the (acceleration_index, wheel_angle_index) of actions."""
+        return (
+            action_indices // self.n_wheel_angles,
+            action_indices % self.n_wheel_angles,
+        )
+
+    def GetNearest(self, wheel_angles: T.Tensor, accelerations: T.Tensor) -> T.Tensor:
+        """Discretizes continuous controls to the actions with the nearest wheel
+        angle and acceleration."""
+        wheel_angle_indices = T.argmin(
+            T.abs(wheel_angles[..., None] - self.wheel_angles), dim=-1
+        )
+        acceleration_indices = T.argmin(
+            T.abs(accelerations[..., None] - self.accelerations), dim=-1
+        )
+
+        return acceleration_indices * self.n_wheel_angles + wheel_angle_indices
+
+    def __call__(self, action_indices: Union[int, T.Tensor]) -> Tuple[T.Tensor, T.Tensor]:
+        """Maps an action index or a tensor of them to wheel angles and
+        accelerations of the same shape."""
+        controls = self.table[action_indices]
+
+        return controls[..., 0], controls[..., 1]
@@ -1,40 +1,271 @@
+import random
 import torch as T
+import torch.nn.functional as F
 
-from Config import Config
+from Config import AgentConfig, Config, TrainingConfig
+from ActionTable import ActionTable
+from Checkpoint import Checkpoint
+from Demonstrations import (
+    FillReplayMemory,
+    LoadDemonstrations,
+    PrepareDemonstrations,
+    PretrainBehaviorCloning,
+)
 from Environment import Environment
-from ReplayMemory import ReplayMemory
-from NNetworks.TestDQN import TestDQN
-
-from copy import deepcopy
+from ReplayMemory import CompactReplayMemory, ReplayMemory
+from Seeding import (
+    EXPLORATION_STREAM,
+    MEMORY_STREAM,
+    NETWORK_STREAM,
+    PRETRAIN_STREAM,
+    DeriveSeed,
+    MakeGenerator,
+)
+from ObservationPipeline import ObservationPipeline
+from NNetworks import NETWORKS
+from NNetworks.TargetComputer import TargetComputer
+from typing import Callable, Optional
 
 
 class Agent:
     def __init__(
         self, agent_config: Config, training_config: Config, environment: Environment
     ) -> None:
-        self.agent_config = agent_config
-        self.training_config = training_config
+        self.agent_config = AgentConfig.coerce(agent_config)
+        self.training_config = TrainingConfig.coerce(training_config)
+
+        self.observation_pipeline = ObservationPipeline(
+            environment.car.n_rays + 1,
+            n_frames=self.agent_config.n_frames,
+            action_repeat=self.agent_config.action_repeat,
+            normalize=self.agent_config.normalize_observations,
+            dtype=environment.dtype,
+            device=environment.device,
+        )
+
+        self.state_space = self.observation_pipeline.output_size
 
-        self.state_space = self.agent_config.n_rays + 1
-        self.n_actions = (
-            self.agent_config.n_accelerations * self.agent_config.n_wheel_angles
+        self.action_table = ActionTable.FromConfig(
+            self.agent_config, dtype=environment.dtype, device=environment.device
         )
+        self.action_table.Validate(environment.control_range)
+        self.n_actions = self.action_table.n_actions
 
-        self.Q_online = TestDQN(self.state_space, self.n_actions)
-        self.Q_target = deepcopy(self.Q_online)
+        network = NETWORKS[self.agent_config.network]
+        seed = self.training_config.seed
+
+        # Seeded networks are initialized from their own stream, leaving the
+        # global torch generator untouched.
+        with T.random.fork_rng(devices=[], enabled=seed is not None):
+            if seed is not None:
+                T.manual_seed(DeriveSeed(seed, NETWORK_STREAM))
+
+            self.Q_online = network(self.state_space, self.n_actions)
+            self.Q_target = network(self.state_space, self.n_actions)
+
+        self.target_computer = TargetComputer(
+            self.Q_online,
+            self.Q_target,
+            gamma=self.training_config.gamma**self.agent_config.n_step,
+            double_dqn=self.agent_config.double_dqn,
+        )
+        self.target_computer.SyncTarget()
+
+        self.optimizer = T.optim.AdamW(
+            self.Q_online.parameters(),
+            lr=self.training_config.learning_rate,
+            amsgrad=True,
+        )
+        self.n_steps = 0
+        self.n_updates = 0
+        self.n_episodes = 0
+
+        self.rng = random.Random(DeriveSeed(seed, EXPLORATION_STREAM))
 
-        self.memory = ReplayMemory(self.agent_config.memory_capacity)
         self.environment = environment
+        self.memory = self.build_memory()
+
+    def build_memory(self) -> ReplayMemory:
+        storage = self.agent_config.replay_storage
+        seed = DeriveSeed(self.training_config.seed, MEMORY_STREAM)
+
+        if storage == "full":
+            return ReplayMemory(
+                self.agent_config.memory_capacity,
+                n_step=self.agent_config.n_step,
+                gamma=self.training_config.gamma,
+                seed=seed,
+            )
+
+        # uint8 observations are quantized over the clipped normalized range,
+        # or the raw ranges of the depths and the speed.
+        if self.agent_config.normalize_observations:
+            clip = self.observation_pipeline.normalizer.clip
+            low = T.full((self.state_space,), -clip)
+            high = T.full((self.state_space,), clip)
+        else:
+            max_speed = float(self.environment.car.max_speed)
+            low = T.tensor([0.0] * self.environment.car.n_rays + [-max_speed])
+            high = T.tensor([1.0] * self.environment.car.n_rays + [max_speed])
+            low = low.repeat(self.agent_config.n_frames)
+            high = high.repeat(self.agent_config.n_frames)
+
+        return CompactReplayMemory(
+            self.agent_config.memory_capacity,
+            n_step=self.agent_config.n_step,
+            gamma=self.training_config.gamma,
+            observation_dtype=storage,
+            observation_low=low,
+            observation_high=high,
+            action_dtype=T.uint8 if self.n_actions <= 256 else T.int16,
+            seed=seed,
+        )
 
     def network_to_index(self, network_index):
-        acc = network_index // self.agent_config.n_accelerations
-        angle = network_index % self.agent_config.n_wheel_angles
-        return acc, angle
+        return self.action_table.GetIndices(network_index)
+
+    def index_to_action(self, action_index):
+        return self.action_table(action_index)
+
+    def get_epsilon(self):
+        progress = min(self.n_steps / self.training_config.epsilon_decay, 1.0)
+
+        return self.training_config.epsilon_start + progress * (
+            self.training_config.epsilon_end - self.training_config.epsilon_start
+        )
+
+    def choose_action(self, q_value):
+        if self.rng.random() < self.get_epsilon():
+            return self.rng.randrange(self.n_actions)
+
+        return int(T.argmax(q_value))
+
+    def update_target(self):
+        tau = self.training_config.target_update_tau
+
+        if tau < 1.0:
+            self.target_computer.SyncTarget(tau)
+        elif self.n_updates % self.training_config.target_update_period == 0:
+            self.target_computer.SyncTarget()
+
+    def learn_batch(self):
+        batch_size = self.training_config.batch_size
+
+        if len(self.memory) < batch_size:
+            return None
+
+        batch = self.memory.sample(batch_size)
+        network_dtype = self.target_computer.online_parameters[0].dtype
+
+        q_values = T.gather(
+            self.Q_online(batch.state.to(network_dtype)), 1, batch.action[:, None]
+        )[:, 0]
+        targets = self.target_computer(
+            batch.reward.to(network_dtype),
+            batch.next_state.to(network_dtype),
+            batch.done,
+        )
+
+        loss = F.smooth_l1_loss(q_values, targets)
+
+        self.optimizer.zero_grad()
+        loss.backward()
+        T.nn.utils.clip_grad_value_(self.Q_online.parameters(), 100)
+        self.optimizer.step()
+
+        self.n_updates += 1
+        self.update_target()
+
+        return loss.item()
+
+    def save_checkpoint(self):
+        Checkpoint.save(
+            self.training_config.checkpoint_dir,
+            self,
+            save_memory=self.training_config.checkpoint_memory,
+        )
+
+    def load_demonstrations(self, directory: str):
+        """Pre-fills the replay memory with the recorded episodes in directory
+        and warm starts the network on them for pretrain_epochs epochs."""
+        transitions = PrepareDemonstrations(
+            LoadDemonstrations(directory, self.environment.config),
+            self.action_table,
+            self.observation_pipeline,
+            dtype=self.environment.dtype,
+            device=self.environment.device,
+        )
+        FillReplayMemory(self.memory, transitions)
+
+        if self.training_config.pretrain_epochs > 0:
+            PretrainBehaviorCloning(
+                self,
+                transitions,
+                self.training_config.pretrain_epochs,
+                batch_size=max(self.training_config.batch_size, 1024),
+                generator=MakeGenerator(
+                    DeriveSeed(self.training_config.seed, PRETRAIN_STREAM)
+                ),
+            )
+
+    def reset_environment(self):
+        observation, _ = self.environment.Reset()
+        self.n_episodes += 1
+
+        return self.observation_pipeline.Reset(observation).clone()
+
+    def train(self, episode_callback: Optional[Callable[["Agent", float], bool]] = None):
+        """Trains for training_config.n_steps steps, resuming from the checkpoint
+        if one exists. episode_callback is called with the return of every
+        finished episode and can stop training early by returning True.
+        Episodes that hit the environment's time limit are truncated, not
+        terminal, so their targets keep bootstrapping."""
+        checkpoint_dir = self.training_config.checkpoint_dir
+        checkpoint_period = self.training_config.checkpoint_period
+        network_dtype = self.target_computer.online_parameters[0].dtype
+
+        if checkpoint_dir is not None and Checkpoint.exists(checkpoint_dir):
+            Checkpoint.load(checkpoint_dir, self)
+        elif self.training_config.demonstrations_dir is not None:
+            self.load_demonstrations(self.training_config.demonstrations_dir)
+
+        state = self.reset_environment()
+        episode_reward = 0.0
+
+        while self.n_steps < self.training_config.n_steps:
+            with T.no_grad():
+                q_value = self.Q_online(state.to(network_dtype)[None])[0]
+
+            action_index = self.choose_action(q_value)
+            wheel_angle, acceleration = self.index_to_action(action_index)
+
+            next_state, reward, crashed = self.observation_pipeline.Step(
+                self.environment, wheel_angle, acceleration
+            )
+
+            self.memory.push(state, action_index, next_state, reward, bool(crashed))
+            truncated = self.environment.IsTruncated() and not crashed
+            self.n_steps += 1
+            episode_reward += float(reward)
+
+            self.learn_batch()
+
+            if checkpoint_dir is not None and self.n_steps % checkpoint_period == 0:
+                self.save_checkpoint()
 
-    def index_to_action(self, grid_index): ...
+            if crashed or truncated:
+                if truncated:
+                    self.memory.truncate()
 
-    def choose_action(self, q_value): ...
+                if episode_callback is not None and episode_callback(
+                    self, episode_reward
+                ):
+                    break
 
-    def learn_batch(self): ...
+                state = self.reset_environment()
+                episode_reward = 0.0
+            else:
+                state = next_state.clone()
 
-    def train(self): ...
+        if checkpoint_dir is not None:
+            self.save_checkpoint()
@@ -0,0 +1,512 @@
+import time
+import argparse
+import torch as T
+
+from Reward import Reward
+from Cars.RaceCar import RaceCar
+from Config import EnvironmentConfig
+from Environment import Environment
+from ObservationPipeline import ObservationPipeline
+from ReplayMemory import CompactReplayMemory, ReplayMemory
+from LinAlg import LinAlg
+from Track import Track
+from TrackIndex import TrackIndex
+from TrackSDF import TrackSDF
+from VectorEnvironment import SubprocessVectorEnvironment, VectorEnvironment
+from typing import Dict, List, Tuple
+
+
+def GetSteeringSchedule(
+    n_episodes: int, n_controls: int, seed: int, dtype: T.dtype
+) -> T.Tensor:
+    generator = T.Generator().manual_seed(seed)
+
+    return 0.6 * (2 * T.rand((n_episodes, n_controls), generator=generator) - 1).to(
+        dtype
+    )
+
+
+def RunCrashEpisodes(
+    track_name: str,
+    dt: float,
+    continuous_collision: bool,
+    steering_schedule: T.Tensor,
+    control_period: float,
+    max_time: float,
+    dtype: T.dtype = T.float64,
+) -> Tuple[List[Tuple[float, T.Tensor]], float, int]:
+    car = RaceCar(dtype, "cpu", continuous_collision=continuous_collision)
+    env = Environment(car, track_name, dtype, "cpu", Reward(1, 10, 100), render=False)
+
+    n_spawns = env.track.points.size(0)
+    acceleration = T.as_tensor(1.0, dtype=dtype)
+    steps_per_control = round(control_period / dt)
+
+    crashes = []
+    n_steps = 0
+    start_time = time.perf_counter()
+
+    for episode, steering in enumerate(steering_schedule):
+        env.Reset(start_index=episode * n_spawns // steering_schedule.size(0))
+        crash = (max_time, None)
+
+        for step in range(round(max_time / dt)):
+            wheel_angle = steering[min(step // steps_per_control, steering.size(0) - 1)]
+            _, _, crashed = env.Step(wheel_angle, acceleration, dt)
+            n_steps += 1
+
+            if crashed:
+                crash = ((step + 1) * dt, car.car_position.clone())
+                break
+
+        crashes.append(crash)
+
+    return crashes, time.perf_counter() - start_time, n_steps
+
+
+def BenchmarkContinuousCollision(
+    track_names: List[str],
+    n_episodes: int = 24,
+    control_period: float = 0.25,
+    max_time: float = 10.0,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """Compares crash detection at coarse dts, with and without swept collision,
+    against a fine dt reference. A crash counts as missed if it is detected more
+    than a couple of steps after the reference, i.e. the car tunneled through."""
+    configs = [
+        ("reference dt=1/240", 1 / 240, False),
+        ("discrete dt=1/60", 1 / 60, False),
+        ("discrete dt=1/15", 1 / 15, False),
+        ("discrete dt=1/8", 1 / 8, False),
+        ("continuous dt=1/15", 1 / 15, True),
+        ("continuous dt=1/8", 1 / 8, True),
+        ("discrete dt=1/4", 1 / 4, False),
+        ("continuous dt=1/4", 1 / 4, True),
+    ]
+
+    steering_schedule = GetSteeringSchedule(
+        n_episodes, round(max_time / control_period), seed, T.float64
+    )
+
+    results = {}
+    reference_crashes = {}
+
+    for name, dt, continuous_collision in configs:
+        n_missed = 0
+        total_time = 0.0
+        total_steps = 0
+        simulated_time = 0.0
+
+        for track_name in track_names:
+            crashes, wall_time, n_steps = RunCrashEpisodes(
+                track_name,
+                dt,
+                continuous_collision,
+                steering_schedule,
+                control_period,
+                max_time,
+            )
+
+            total_time += wall_time
+            total_steps += n_steps
+            simulated_time += sum(crash_time for crash_time, _ in crashes)
+
+            if track_name not in reference_crashes:
+                reference_crashes[track_name] = crashes
+                continue
+
+            for (crash_time, _), (reference_time, reference_position) in zip(
+                crashes, reference_crashes[track_name]
+            ):
+                if reference_position is None:
+                    continue
+
+                if crash_time - reference_time > 2 * dt + 0.1:
+                    n_missed += 1
+
+        results[name] = {
+            "missed_crashes": n_missed,
+            "simulated_seconds_per_second": simulated_time / total_time,
+            "steps_per_second": total_steps / total_time,
+        }
+
+    return results
+
+
+def BenchmarkVectorEnvironments(
+    track_names: List[str],
+    n_envs_list: Tuple[int, ...] = (1, 4, 16, 64),
+    n_steps: int = 100,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """Compares environment steps per second of the in-process vector
+    environment and the shared memory subprocess one, on the first track. The
+    synchronization cost is measured with steps where every env is masked out."""
+    config = EnvironmentConfig(track_name=track_names[0], random_spawn=True)
+    generator = T.Generator().manual_seed(seed)
+    results = {}
+
+    for n_envs in n_envs_list:
+        wheel_angles = 0.6 * (2 * T.rand((n_steps, n_envs), generator=generator) - 1)
+        accelerations = T.rand((n_steps, n_envs), generator=generator)
+
+        for name, vector_environment in (
+            (
+                f"in-process n_envs={n_envs}",
+                VectorEnvironment.FromConfig(config, n_envs=n_envs),
+            ),
+            (
+                f"subprocess n_envs={n_envs}",
+                SubprocessVectorEnvironment(config, n_envs=n_envs),
+            ),
+        ):
+            vector_environment.Reset()
+            start_time = time.perf_counter()
+
+            for step in range(n_steps):
+                vector_environment.Step(
+                    wheel_angles[step].to(config.torch_dtype),
+                    accelerations[step].to(config.torch_dtype),
+                )
+
+            wall_time = time.perf_counter() - start_time
+            results[name] = {"steps_per_second": n_envs * n_steps / wall_time}
+
+            if isinstance(vector_environment, SubprocessVectorEnvironment):
+                env_mask = T.zeros((n_envs,), dtype=T.bool)
+                start_time = time.perf_counter()
+
+                for step in range(n_steps):
+                    vector_environment.Step(
+                        wheel_angles[step].to(config.torch_dtype),
+                        accelerations[step].to(config.torch_dtype),
+                        env_mask,
+                    )
+
+                results[name]["sync_us_per_step"] = (
+                    1e6 * (time.perf_counter() - start_time) / n_steps
+                )
+                results[name]["n_workers"] = vector_environment.n_workers
+
+                vector_environment.Close()
+
+    return results
+
+
+def BenchmarkReplayMemory(
+    track_names: List[str],
+    capacity: int = 8192,
+    n_envs: int = 8,
+    n_frames_list: Tuple[int, ...] = (1, 4),
+    batch_size: int = 64,
+    n_samples: int = 200,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """Compares bytes per transition, push and sample times of the full and the
+    compact replay memories on observations of random driving on the first
+    track, pushing 1.25 * capacity transitions. max_error is the largest
+    quantization error of an observation component."""
+    config = EnvironmentConfig(track_name=track_names[0], random_spawn=True)
+    vector_environment = VectorEnvironment.FromConfig(config, n_envs=n_envs)
+    max_speed = float(vector_environment.environments[0].car.max_speed)
+    generator = T.Generator().manual_seed(seed)
+    n_steps = 5 * capacity // (4 * n_envs)
+
+    observations, _ = vector_environment.Reset()
+    steps = [observations.clone()]
+
+    for _ in range(n_steps):
+        observations, rewards, crashed = vector_environment.Step(
+            (0.6 * (2 * T.rand((n_envs,), generator=generator) - 1)).to(
+                config.torch_dtype
+            ),
+            T.rand((n_envs,), generator=generator).to(config.torch_dtype),
+        )
+        steps.append((observations.clone(), rewards.clone(), crashed.clone()))
+
+    results = {}
+
+    for n_frames in n_frames_list:
+        pipeline = ObservationPipeline(
+            vector_environment.observation_size,
+            n_envs=n_envs,
+            n_frames=n_frames,
+            normalize=False,
+            dtype=config.torch_dtype,
+        )
+        low = T.tensor([0.0] * config.n_rays + [-max_speed]).repeat(n_frames)
+        high = T.tensor([1.0] * config.n_rays + [max_speed]).repeat(n_frames)
+
+        transitions = []
+        states = pipeline.Reset(steps[0]).clone()
+
+        for observations, rewards, crashed in steps[1:]:
+            next_states = pipeline.Process(observations).clone()
+            actions = T.randint(15, (n_envs,), generator=generator)
+            transitions.append((states, actions, next_states, rewards, crashed))
+
+            states = next_states.clone()
+
+            if T.any(crashed):
+                states = pipeline.Reset(observations, env_mask=crashed).clone()
+
+        for storage in ("full", "float16", "uint8"):
+            if storage == "full":
+                memory = ReplayMemory(capacity)
+            else:
+                memory = CompactReplayMemory(
+                    capacity,
+                    observation_dtype=storage,
+                    observation_low=low,
+                    observation_high=high,
+                )
+
+            start_time = time.perf_counter()
+
+            for transition in transitions:
+                memory.push_batch(*transition)
+
+            push_time = (time.perf_counter() - start_time) / len(transitions)
+            start_time = time.perf_counter()
+
+            for _ in range(n_samples):
+                memory.sample(batch_size)
+
+            sample_time = (time.perf_counter() - start_time) / n_samples
+
+            if storage == "full":
+                n_bytes = sum(
+                    values.numel() * values.element_size()
+                    for values in memory.storage.values()
+                )
+                max_error = 0.0
+            else:
+                n_bytes = memory.get_nbytes()
+                all_states = T.cat([transition[0] for transition in transitions])
+                max_error = float(
+                    T.max(
+                        T.abs(
+                            memory.Dequantize(memory.Quantize(all_states)) - all_states
+                        )
+                    )
+                )
+
+            results[f"{storage} n_frames={n_frames}"] = {
+                "bytes_per_transition": n_bytes / capacity,
+                "push_us": 1e6 * push_time,
+                "sample_us": 1e6 * sample_time,
+                "max_error": max_error,
+                "size": len(memory),
+            }
+
+    return results
+
+
+def BenchmarkRayCasting(
+    track_names: List[str],
+    n_rays_list: Tuple[int, ...] = (11, 33, 99),
+    ray_ranges: Tuple[float, ...] = (25.0, 50.0, 100.0),
+    track_copies: Tuple[int, ...] = (1, 4, 16),
+    cell_size: float = 10.0,
+    n_poses: int = 100,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """Times casting rays against every track line and through the track
+    index, from random spawns with random headings. Tracks are grown with
+    copies of their lines shifted beyond the ray range, which the exact path
+    pays for and the index does not. Also counts mismatching depths."""
+    generator = T.Generator().manual_seed(seed)
+    results = {}
+
+    for track_name in track_names:
+        track = Track.Load(track_name, T.float64)
+        points = track.track_lines[..., 0]
+        extent = float(T.max(points) - T.min(points))
+
+        for n_copies in track_copies:
+            shifts = (extent + 2 * max(ray_ranges)) * T.arange(
+                n_copies, dtype=T.float64
+            )
+            track_lines = track.track_lines[None].repeat(n_copies, 1, 1, 1)
+            track_lines[:, :, 0, 0] += shifts[:, None]
+            track_lines = track_lines.flatten(0, 1)
+
+            track_index = TrackIndex(track_lines, cell_size)
+            poses = T.randint(track.points.size(0), (n_poses,), generator=generator)
+            headings = 2 * T.pi * T.rand((n_poses,), generator=generator)
+
+            for n_rays in n_rays_list:
+                for ray_range in ray_ranges:
+                    angles = T.linspace(
+                        -3 * T.pi / 4, 3 * T.pi / 4, n_rays, dtype=T.float64
+                    )
+                    ranges = T.full((n_rays,), ray_range, dtype=T.float64)
+                    sample_fractions = track_index.GetSampleFractions(ranges)
+
+                    all_ray_lines = [
+                        T.stack(
+                            (
+                                track.points[pose][None].repeat(n_rays, 1),
+                                ranges[:, None]
+                                * T.stack(
+                                    (T.cos(angles + heading), T.sin(angles + heading)),
+                                    dim=1,
+                                ),
+                            ),
+                            dim=-1,
+                        )
+                        for pose, heading in zip(poses, headings)
+                    ]
+
+                    start_time = time.perf_counter()
+                    exact_depths = [
+                        LinAlg.get_truncated_depth(ray_lines, track_lines)
+                        for ray_lines in all_ray_lines
+                    ]
+                    exact_time = (time.perf_counter() - start_time) / n_poses
+
+                    start_time = time.perf_counter()
+                    index_depths = [
+                        track_index.GetDepths(ray_lines, sample_fractions)
+                        for ray_lines in all_ray_lines
+                    ]
+                    index_time = (time.perf_counter() - start_time) / n_poses
+
+                    results[
+                        f"{track_name} lines={track_lines.size(0)} rays={n_rays} "
+                        f"range={ray_range:g}"
+                    ] = {
+                        "exact_us": 1e6 * exact_time,
+                        "index_us": 1e6 * index_time,
+                        "mismatches": sum(
+                            not T.equal(exact, index)
+                            for exact, index in zip(exact_depths, index_depths)
+                        ),
+                    }
+
+    return results
+
+
+def BenchmarkDistanceField(
+    track_names: List[str],
+    resolutions: Tuple[float, ...] = (1.0, 0.5, 0.25),
+    n_poses: int = 1000,
+    gate_span: float = 0.5,
+    heading_std: float = 0.5,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """Times crash checks and ray casting of the exact path and through the
+    track distance field, from random points on the middle gate_span of the
+    gates with headings around the track direction. Counts crash mismatches
+    and exact fallbacks, and measures the sphere traced depth errors, in
+    track units, of the poses that did not crash."""
+    generator = T.Generator().manual_seed(seed)
+    results = {}
+
+    for track_name in track_names:
+        track = Track.Load(track_name, T.float64)
+        car = RaceCar(T.float64, "cpu")
+
+        gates = T.randint(track.points.size(0), (n_poses,), generator=generator)
+        fractions = 0.5 + gate_span * (
+            T.rand((n_poses, 1), generator=generator, dtype=T.float64) - 0.5
+        )
+        positions = track.left_rails[gates] + fractions * (
+            track.right_rails[gates] - track.left_rails[gates]
+        )
+        angles = T.atan2(
+            track.track_lines[gates, 1, 1], track.track_lines[gates, 0, 1]
+        ) + heading_std * T.randn((n_poses,), generator=generator, dtype=T.float64)
+
+        def CastPoses() -> Tuple[T.Tensor, T.Tensor, float, float, float]:
+            crashes, depths = [], []
+            n_fallbacks = 0
+            crash_time = ray_time = 0.0
+
+            for position, angle in zip(positions, angles):
+                car.car_position = position.clone()
+                car.car_angle = angle.clone()
+                car.UpdateCarRotationMatrix()
+                car.UpdateGlobalCarLines()
+                car.UpdateGlobalRayLines()
+
+                start_time = time.perf_counter()
+                crashes.append(bool(car.Crashed(track.track_lines)))
+                crash_time += time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                depths.append(car.See(track.track_lines))
+                ray_time += time.perf_counter() - start_time
+
+                # Poses the field cannot prove clear run the exact check too.
+                n_fallbacks += car.track_sdf is None or not car.track_sdf.IsClear(
+                    car.global_car_lines[..., 0], car.edge_lengths
+                )
+
+            return (
+                T.as_tensor(crashes),
+                T.stack(depths),
+                crash_time / n_poses,
+                ray_time / n_poses,
+                n_fallbacks / n_poses,
+            )
+
+        car.SetTrackSDF(None)
+        exact_crashes, exact_depths, exact_crash_time, exact_ray_time, _ = CastPoses()
+
+        for resolution in resolutions:
+            start_time = time.perf_counter()
+            track_sdf = TrackSDF(track, resolution)
+            build_time = time.perf_counter() - start_time
+
+            car.SetTrackSDF(track_sdf, trace_rays=True)
+            (
+                sdf_crashes,
+                sdf_depths,
+                sdf_crash_time,
+                sdf_ray_time,
+                fallback_rate,
+            ) = CastPoses()
+
+            errors = (car.ray_ranges * T.abs(sdf_depths - exact_depths))[
+                ~exact_crashes
+            ]
+
+            results[f"{track_name} resolution={resolution:g}"] = {
+                "build_s": build_time,
+                "exact_crash_us": 1e6 * exact_crash_time,
+                "sdf_crash_us": 1e6 * sdf_crash_time,
+                "crash_mismatches": int(T.sum(exact_crashes != sdf_crashes)),
+                "fallback_rate": fallback_rate,
+                "exact_ray_us": 1e6 * exact_ray_time,
+                "sdf_ray_us": 1e6 * sdf_ray_time,
+                "mean_ray_error": float(T.mean(errors)),
+                "p99_ray_error": float(T.quantile(errors.flatten(), 0.99)),
+            }
+
+    return results
+
+
+BENCHMARKS = {
+    "collision": BenchmarkContinuousCollision,
+    "rays": BenchmarkRayCasting,
+    "replay": BenchmarkReplayMemory,
+    "sdf": BenchmarkDistanceField,
+    "vector": BenchmarkVectorEnvironments,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulation benchmarks.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--tracks", nargs="*", default=None)
+    args = parser.parse_args()
+
+    results = BENCHMARKS[args.benchmark](args.tracks or Track.GetNames())
+
+    for name, metrics in results.items():
+        print(
+            f"{name:24s} "
+            + "  ".join(f"{key}={value:.4g}" for key, value in metrics.items())
+        )
@@ -1,9 +1,16 @@
+import math
+import numpy as np
 import torch as T
-from LinAlg import LinAlg
 from typing import Optional
 
 
 class Camera:
+    """Follows the car with smoothed position, angle and zoom, kept as Python
+    floats. Global points map to screen pixels through one affine transform,
+    local = matrix @ global + offset, which Transform applies to NumPy point
+    buffers. version only changes when the transform does, so callers can
+    keep transformed static points until it does."""
+
     def __init__(
         self,
         x_res: int,
@@ -28,16 +35,32 @@ class Camera:
         self.dtype = dtype
         self.device = device
 
-        self.position = T.as_tensor([0.0, 0.0], dtype=self.dtype, device=self.device)
-        self.angle = T.as_tensor(0.0, dtype=self.dtype, device=self.device)
+        self.position = [0.0, 0.0]
+        self.angle = 0.0
+
+        self.local_screen_center = np.array([self.x_res / 2, self.y_res * 4 / 5])
+
+        self.matrix = np.eye(2)
+        self.offset = np.zeros(2)
+        self.version = 0
+
+        self.UpdateTransform()
 
-        self.local_screen_center = T.as_tensor(
-            [self.x_res / 2, self.y_res * 4 / 5], dtype=dtype, device=device
+    def UpdateTransform(self):
+        cos_angle, sin_angle = math.cos(self.angle), math.sin(self.angle)
+
+        # Scaled inverse rotation, followed by the shift to the screen center.
+        matrix = self.pixel_density * np.array(
+            [[cos_angle, sin_angle], [-sin_angle, cos_angle]]
         )
+        offset = self.local_screen_center - matrix @ np.array(self.position)
 
-    def UpdateRotationMatrix(self):
-        self.rotation_matrix = LinAlg.get_rotation_matrix(self.angle)
-        self.inv_rotation_matrix = self.rotation_matrix.transpose(1, 0)
+        if not (
+            np.array_equal(matrix, self.matrix) and np.array_equal(offset, self.offset)
+        ):
+            self.matrix = matrix
+            self.offset = offset
+            self.version += 1
 
     def Update(
         self,
@@ -45,10 +68,13 @@ class Camera:
         new_angle: T.Tensor,
         new_pixel_density: Optional[float] = None,
     ):
-        self.position = (
-            self.position_mu * self.position + (1 - self.position_mu) * new_position
-        )
-        self.angle = self.angle_mu * self.angle + (1 - self.angle_mu) * new_angle
+        new_x, new_y = new_position.tolist()
+
+        self.position = [
+            self.position_mu * self.position[0] + (1 - self.position_mu) * new_x,
+            self.position_mu * self.position[1] + (1 - self.position_mu) * new_y,
+        ]
+        self.angle = self.angle_mu * self.angle + (1 - self.angle_mu) * float(new_angle)
 
         if new_pixel_density is not None:
             self.pixel_density = (
@@ -56,15 +82,31 @@ class Camera:
                 + (1 - self.pixel_density_mu) * new_pixel_density
             )
 
-        self.UpdateRotationMatrix()
+        self.UpdateTransform()
+
+    def Transform(self, points: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """Maps (n, 2) global points to pixels in the preallocated out."""
+        np.matmul(points, self.matrix.T, out=out)
+        out += self.offset
+
+        return out
 
     def GlobalToLocalSpace(self, positions: T.Tensor) -> T.Tensor:
-        return (
-            self.inv_rotation_matrix @ (positions - self.position[None])[..., None]
-        )[..., 0] * self.pixel_density + self.local_screen_center[None]
+        dtype, device = positions.dtype, positions.device
+
+        matrix = T.as_tensor(self.matrix, dtype=dtype, device=device)
+        offset = T.as_tensor(self.offset, dtype=dtype, device=device)
+
+        return positions @ matrix.T + offset
 
     def LocalToGlobalSpace(self, local_positions: T.Tensor) -> T.Tensor:
-        return (
-            self.rotation_matrix
-            @ (local_positions - self.local_screen_center[None])[..., None]
-        )[..., 0] / self.pixel_density + self.position[None]
+        inverse_matrix = T.as_tensor(
+            np.linalg.inv(self.matrix),
+            dtype=local_positions.dtype,
+            device=local_positions.device,
+        )
+        offset = T.as_tensor(
+            self.offset, dtype=local_positions.dtype, device=local_positions.device
+        )
+
+        return (local_positions - offset) @ inverse_matrix.T
@@ -1,6 +1,9 @@
 import torch as T
 from LinAlg import LinAlg
 from Cars.Skin import Skin
+from TrackIndex import TrackIndex
+from TrackSDF import TrackSDF
+from typing import List, Optional, Sequence, Tuple
 
 
 class Car:
@@ -20,6 +23,9 @@ class Car:
         skin: Skin,
         dtype: T.dtype = T.float64,
         device: str = "cpu",
+        continuous_collision: bool = False,
+        ray_angles: Optional[Sequence[float]] = None,
+        ray_ranges: Optional[Sequence[float]] = None,
     ):
 
         self.car_length = car_length
@@ -36,12 +42,31 @@ class Car:
         self.max_wheel_angle = max_wheel_angle
         self.max_acceleration = max_acceleration
 
+        # Rays default to n_rays evenly spread over the fov, all of ray_range.
+        if ray_angles is None:
+            ray_angles, _ = Car.GetRayLayout("uniform", n_rays, fov, ray_range)
+        if ray_ranges is None:
+            ray_ranges = [ray_range] * len(ray_angles)
+
+        if len(ray_ranges) != len(ray_angles):
+            raise ValueError(
+                f"Got {len(ray_ranges)} ray ranges for {len(ray_angles)} ray angles"
+            )
+
         self.fov = fov
-        self.n_rays = n_rays
+        self.n_rays = len(ray_angles)
         self.ray_range = ray_range
+        self.ray_angles = T.as_tensor(ray_angles, dtype=dtype, device=device)
+        self.ray_ranges = T.as_tensor(ray_ranges, dtype=dtype, device=device)
+
+        self.track_index: Optional[TrackIndex] = None
+        self.track_sdf: Optional[TrackSDF] = None
+        self.trace_rays = False
 
         self.skin = skin
 
+        self.continuous_collision = continuous_collision
+
         self.dtype = dtype
         self.device = device
 
@@ -63,22 +88,83 @@ class Car:
             device=self.device,
         )
 
-    def SetLocalRayDirections(self):
-        angles = T.linspace(
-            -self.fov / 2,
-            self.fov / 2,
-            self.n_rays,
-            dtype=self.dtype,
-            device=self.device,
-        )
+    @staticmethod
+    def GetRayLayout(
+        layout: str,
+        n_rays: int,
+        fov: float,
+        ray_range: float,
+        forward_density: float = 2.0,
+        forward_range_scale: float = 2.0,
+    ) -> Tuple[List[float], List[float]]:
+        """Ray angles and ranges of a layout: "uniform" spreads the rays evenly
+        over the fov, "forward" packs them towards the front with ranges
+        growing to forward_range_scale * ray_range straight ahead, and
+        "two_layer" adds a forward layer of n_rays // 2 long rays over a third
+        of the fov to the uniform rest."""
+        spread = T.linspace(-1.0, 1.0, n_rays, dtype=T.float64)
+
+        if n_rays == 1:
+            spread = T.zeros((1,), dtype=T.float64)
+
+        if layout == "uniform":
+            angles = T.linspace(-fov / 2, fov / 2, n_rays, dtype=T.float64)
+
+            if n_rays == 1:
+                angles = spread
+            ranges = T.full((n_rays,), ray_range, dtype=T.float64)
+
+        elif layout == "forward":
+            angles = T.sign(spread) * T.abs(spread) ** forward_density * fov / 2
+            ranges = ray_range * (1 + (forward_range_scale - 1) * (1 - T.abs(spread)))
+
+        elif layout == "two_layer":
+            n_far = n_rays // 2
+            near_angles, near_ranges = Car.GetRayLayout(
+                "uniform", n_rays - n_far, fov, ray_range
+            )
+            far_angles, far_ranges = Car.GetRayLayout(
+                "uniform", n_far, fov / 3, forward_range_scale * ray_range
+            )
+
+            return near_angles + far_angles, near_ranges + far_ranges
+
+        else:
+            raise ValueError(f"Unknown ray layout '{layout}'")
 
-        cos_angles = T.cos(angles)
-        sin_angles = T.sin(angles)
+        return angles.tolist(), ranges.tolist()
 
-        self.local_ray_directions = self.ray_range * T.concat(
-            (cos_angles[:, None], sin_angles[:, None]), dim=1
+    def SetLocalRayDirections(self):
+        self.local_ray_directions = self.ray_ranges[:, None] * T.stack(
+            (T.cos(self.ray_angles), T.sin(self.ray_angles)), dim=1
         )
 
+    def SetTrackIndex(self, track_index: Optional[TrackIndex]):
+        """Casts the rays through track_index, which has to index the track
+        lines passed to Step, instead of against every line."""
+        self.track_index = track_index
+
+        if track_index is not None:
+            self.ray_sample_fractions = track_index.GetSampleFractions(self.ray_ranges)
+
+    def SetTrackSDF(self, track_sdf: Optional[TrackSDF], trace_rays: bool = False):
+        """Checks crashes through the distance field of the track lines passed
+        to Step. Only the car corners are sampled, and cars the field cannot
+        prove clear of the rails fall back to the exact check, so crashes
+        match it. With trace_rays the rays are sphere traced through the field
+        too, which gives approximate depths."""
+        self.track_sdf = track_sdf
+        self.trace_rays = trace_rays and track_sdf is not None
+
+        if track_sdf is not None:
+            self.edge_lengths = T.sqrt(
+                T.sum(
+                    (T.roll(self.local_car_points, -1, 0) - self.local_car_points)
+                    ** 2,
+                    dim=-1,
+                )
+            ).tolist()
+
     def UpdateCarRotationMatrix(self):
         self.car_rotaion_matrix = LinAlg.get_rotation_matrix(self.car_angle)
 
@@ -98,14 +184,19 @@ class Car:
             dim=-1,
         )
 
-    def Update(self, track_lines: T.Tensor):
+    def Update(self, track_lines: T.Tensor, see: bool = True):
         self.UpdateCarRotationMatrix()
         self.UpdateGlobalCarLines()
-        self.UpdateGlobalRayLines()
 
-        self.vision = self.See(track_lines.clone())
+        if see:
+            self.UpdateVision(track_lines)
+
         self.crashed = self.Crashed(track_lines.clone())
 
+    def UpdateVision(self, track_lines: T.Tensor):
+        self.UpdateGlobalRayLines()
+        self.vision = self.See(track_lines.clone())
+
     def GetCenterOfRotation(self, wheel_angle: T.Tensor) -> T.Tensor:
         tan_wheel_angle = T.tan(wheel_angle)
 
@@ -141,9 +232,50 @@ class Car:
         self.car_angle += angle_delta
 
     def Crashed(self, track_lines: T.Tensor) -> T.Tensor:
+        if self.track_sdf is not None and self.track_sdf.IsClear(
+            self.global_car_lines[..., 0], self.edge_lengths
+        ):
+            return T.zeros((), dtype=T.bool, device=self.device)
+
         return LinAlg.intersecting(self.global_car_lines, track_lines)
 
+    def GetNearbyLines(
+        self, track_lines: T.Tensor, previous_car_points: T.Tensor
+    ) -> T.Tensor:
+        swept_points = T.concat(
+            (previous_car_points, self.global_car_lines[..., 0]), dim=0
+        )
+        center = T.mean(swept_points, dim=0)
+        radius = T.max(T.sqrt(T.sum((swept_points - center[None]) ** 2, dim=-1)))
+
+        return track_lines[LinAlg.get_distance_to_lines(center, track_lines) <= radius]
+
+    def SweptCrashed(
+        self, previous_car_points: T.Tensor, track_lines: T.Tensor
+    ) -> T.Tensor:
+        # Rails crossed between two steps have to cut one of the corner paths,
+        # since both the previous and the current body edges are checked.
+        swept_lines = T.concat(
+            (
+                previous_car_points[..., None],
+                (self.global_car_lines[..., 0] - previous_car_points)[..., None],
+            ),
+            dim=-1,
+        )
+
+        return LinAlg.intersecting(
+            swept_lines, self.GetNearbyLines(track_lines, previous_car_points)
+        )
+
     def See(self, track_lines: T.Tensor) -> T.Tensor:
+        if self.trace_rays:
+            return self.track_sdf.TraceRays(self.global_ray_lines, self.ray_ranges)
+
+        if self.track_index is not None:
+            return self.track_index.GetDepths(
+                self.global_ray_lines, self.ray_sample_fractions
+            )
+
         return LinAlg.get_truncated_depth(self.global_ray_lines, track_lines)
 
     def Reset(self, position: T.Tensor, car_angle: T.Tensor, track_lines: T.Tensor):
@@ -160,7 +292,11 @@ class Car:
         acceleration: T.Tensor,
         track_lines: T.Tensor,
         dt: float,
+        see: bool = True,
     ):
+        if self.continuous_collision:
+            previous_car_points = self.global_car_lines[..., 0].clone()
+
         self.car_speed += acceleration * self.max_acceleration * dt
 
         if self.car_speed > self.max_speed:
@@ -179,7 +315,10 @@ class Car:
                 center_of_roation, wheel_angle * self.max_wheel_angle, dt
             )
 
-        self.Update(track_lines)
+        self.Update(track_lines, see)
+
+        if self.continuous_collision and not self.crashed:
+            self.crashed = self.SweptCrashed(previous_car_points, track_lines)
 
     def GetObservation(self) -> T.Tensor:
         return T.concat((self.vision, self.car_speed[None]), dim=0)
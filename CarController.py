@@ -1,123 +1,120 @@
+import numpy as np
 import torch as T
 import pygame as pg
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
 
-class CarController:
-    def __init__(self, dtype: T.dtype, device: str):
-        self.right = T.as_tensor(1.0, dtype=dtype, device=device)
-        self.left = T.as_tensor(-1.0, dtype=dtype, device=device)
+# Bits of the key state, one per action.
+ACCELERATE, TURN_LEFT, DECELERATE, TURN_RIGHT, QUIT = (1 << bit for bit in range(5))
 
-        self.zero = T.as_tensor(0.0, dtype=dtype, device=device)
+KEY_BINDS = {
+    "w": ACCELERATE,
+    "a": TURN_LEFT,
+    "s": DECELERATE,
+    "d": TURN_RIGHT,
+    "q": QUIT,
+    "ESCAPE": QUIT,
+}
 
-        self.forward = T.as_tensor(1.0, dtype=dtype, device=device)
-        self.back = T.as_tensor(-1.0, dtype=dtype, device=device)
 
-        self.acceleration = T.as_tensor(0.0, dtype=dtype, device=device)
-        self.wheel_angle = T.as_tensor(0.0, dtype=dtype, device=device)
+class CarController:
+    """Keeps a bitmask of the held actions, updated only on key events through
+    a keycode table, and smooths the controls in plain floats. The key state
+    of every frame can be recorded, and a recording replayed instead of the
+    keyboard, which reproduces the controls exactly."""
+
+    def __init__(
+        self,
+        dtype: T.dtype,
+        device: str,
+        record: bool = False,
+        replay: Optional[np.ndarray] = None,
+    ):
+        self.dtype = dtype
+        self.device = device
+
+        self.acceleration = 0.0
+        self.wheel_angle = 0.0
         self.quit = False
 
         self.acceleration_mu = 0.9
         self.wheel_angle_mu = 0.9
 
-        self.key_binds = {
-            "w": {"state": False, "bind": self.Accelerate},
-            "a": {"state": False, "bind": self.TurnLeft},
-            "s": {"state": False, "bind": self.Decelerate},
-            "d": {"state": False, "bind": self.TurnRight},
-            "q": {"state": False, "bind": self.Quit},
-            "ESCAPE": {"state": False, "bind": self.Quit},
+        self.key_table: Dict[int, int] = {
+            getattr(pg, f"K_{key}"): action
+            for key, action in KEY_BINDS.items()
+            if hasattr(pg, f"K_{key}")
         }
+        self.key_state = 0
 
-        self.negative_keybinds = {
-            ("w", "s"): {"state": False, "bind": self.IdleAcceleration},
-            ("a", "d"): {"state": False, "bind": self.IdleTurn},
-        }
+        self.recording: Optional[List[int]] = [] if record else None
+        self.replay = None if replay is None else replay.tolist()
+        self.replay_step = 0
 
-    def Quit(self):
-        self.quit = True
-
-    def Accelerate(self):
-        self.acceleration = (
-            self.acceleration_mu * self.acceleration
-            + (1 - self.acceleration_mu) * self.forward.clone()
-        )
-
-    def IdleAcceleration(self):
-        self.acceleration = self.zero.clone()
+    def CheckKeys(self):
+        for event in pg.event.get((pg.KEYDOWN, pg.KEYUP)):
+            action = self.key_table.get(event.key, 0)
+
+            if event.type == pg.KEYDOWN:
+                self.key_state |= action
+            else:
+                self.key_state &= ~action
+
+    def Smooth(self, value: float, mu: float, target: float) -> float:
+        return mu * value + (1 - mu) * target
+
+    def Update(self, key_state: int):
+        """Moves the controls towards the held directions, or back to 0 when
+        neither direction of an axis is held."""
+        if key_state & (ACCELERATE | DECELERATE):
+            if key_state & ACCELERATE:
+                self.acceleration = self.Smooth(self.acceleration, self.acceleration_mu, 1.0)
+            if key_state & DECELERATE:
+                self.acceleration = self.Smooth(self.acceleration, self.acceleration_mu, -1.0)
+        else:
+            self.acceleration = 0.0
+
+        if key_state & (TURN_LEFT | TURN_RIGHT):
+            if key_state & TURN_LEFT:
+                self.wheel_angle = self.Smooth(self.wheel_angle, self.wheel_angle_mu, -1.0)
+            if key_state & TURN_RIGHT:
+                self.wheel_angle = self.Smooth(self.wheel_angle, self.wheel_angle_mu, 1.0)
+        else:
+            self.wheel_angle = 0.0
+
+        self.quit = bool(key_state & QUIT)
+
+    def GetKeyState(self) -> int:
+        self.CheckKeys()
 
-    def Decelerate(self):
-        self.acceleration = (
-            self.acceleration_mu * self.acceleration
-            + (1 - self.acceleration_mu) * self.back.clone()
-        )
+        if self.replay is None:
+            return self.key_state
 
-    def TurnRight(self):
-        self.wheel_angle = (
-            self.wheel_angle_mu * self.wheel_angle
-            + (1 - self.wheel_angle_mu) * self.right.clone()
-        )
+        # Replays quit when the recording runs out, or on the quit keys.
+        if self.replay_step >= len(self.replay):
+            return QUIT
 
-    def IdleTurn(self):
-        self.wheel_angle = self.zero.clone()
+        key_state = self.replay[self.replay_step] | (self.key_state & QUIT)
+        self.replay_step += 1
 
-    def TurnLeft(self):
-        self.wheel_angle = (
-            self.wheel_angle_mu * self.wheel_angle
-            + (1 - self.wheel_angle_mu) * self.left.clone()
-        )
+        return key_state
 
-    def CheckKeys(self):
-        for keys in self.negative_keybinds.keys():
-            self.negative_keybinds[keys]["state"] = True
+    def GetActions(self) -> Tuple[T.Tensor, T.Tensor, bool]:
+        key_state = self.GetKeyState()
 
-        self.quit = False
+        if self.recording is not None:
+            self.recording.append(key_state)
 
-        for event in pg.event.get(pg.KEYDOWN):
-            for key in self.key_binds.keys():
-                try:
-                    if event.key == getattr(pg, f"K_{key}"):
-                        self.key_binds[key]["state"] = True
-
-                except AttributeError:
-                    continue
-
-        for event in pg.event.get(pg.KEYUP):
-            for key in self.key_binds.keys():
-                try:
-                    if event.key == getattr(pg, f"K_{key}"):
-                        self.key_binds[key]["state"] = False
-
-                        for keys in self.negative_keybinds.keys():
-                            if key in keys:
-                                self.negative_keybinds[keys]["state"] = False
-                                break
-
-                except AttributeError:
-                    continue
-
-        for keys in self.negative_keybinds.keys():
-            if self.negative_keybinds[keys]["state"] == False:
-                for key in keys:
-                    try:
-                        if self.key_binds[key]["state"] == True:
-                            self.negative_keybinds[keys]["state"] = True
-                            break
-
-                    except KeyError:
-                        continue
-
-    def Update(self):
-        for key in self.key_binds.keys():
-            if self.key_binds[key]["state"] == True:
-                self.key_binds[key]["bind"]()
-
-        for keys in self.negative_keybinds.keys():
-            if self.negative_keybinds[keys]["state"] == False:
-                self.negative_keybinds[keys]["bind"]()
+        self.Update(key_state)
 
-    def GetActions(self) -> Tuple[T.Tensor, T.Tensor, bool]:
-        self.CheckKeys()
-        self.Update()
+        return (
+            T.as_tensor(self.wheel_angle, dtype=self.dtype, device=self.device),
+            T.as_tensor(self.acceleration, dtype=self.dtype, device=self.device),
+            self.quit,
+        )
 
-        return self.wheel_angle.clone(), self.acceleration.clone(), self.quit
+    def SaveRecording(self, file_path: str, **arrays: np.ndarray):
+        """Saves the recorded key states, with any extra arrays, to an .npz."""
+        np.savez(
+            file_path, key_states=np.asarray(self.recording, dtype=np.uint8), **arrays
+        )
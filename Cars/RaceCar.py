@@ -5,7 +5,16 @@ from .Skin import Skin
 
 
 class RaceCar(Car):
-    def __init__(self, dtype: T.dtype, device: str):
+    def __init__(
+        self,
+        dtype: T.dtype,
+        device: str,
+        continuous_collision: bool = False,
+        n_rays: int = 11,
+        ray_layout: str = "uniform",
+        forward_ray_density: float = 2.0,
+        forward_ray_range_scale: float = 2.0,
+    ):
         car_length = 4.0
         car_width = 2.0
         car_height = 2.0
@@ -18,7 +27,6 @@ class RaceCar(Car):
         max_acceleration = 40.0
 
         fov = 3 * T.pi / 2
-        n_rays = 11
         ray_range = 50.0
 
         car_color = (0, 200, 255)
@@ -28,6 +36,15 @@ class RaceCar(Car):
 
         car_skin = Skin(car_color, crashed_car_color, vision_lines_color, outline_color)
 
+        ray_angles, ray_ranges = Car.GetRayLayout(
+            ray_layout,
+            n_rays,
+            fov,
+            ray_range,
+            forward_density=forward_ray_density,
+            forward_range_scale=forward_ray_range_scale,
+        )
+
         super(RaceCar, self).__init__(
             car_length,
             car_width,
@@ -43,4 +60,7 @@ class RaceCar(Car):
             car_skin,
             dtype=dtype,
             device=device,
+            continuous_collision=continuous_collision,
+            ray_angles=ray_angles,
+            ray_ranges=ray_ranges,
         )
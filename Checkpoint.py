@@ -0,0 +1,128 @@
+import os
+import random
+import torch as T
+
+from Config import AgentConfig, EnvironmentConfig
+from NNetworks import NETWORKS
+from ObservationPipeline import ObservationPipeline
+from typing import Any, Dict, Optional, Tuple
+
+
+class Checkpoint:
+
+    @staticmethod
+    def save(directory: str, agent: Any, save_memory: bool = True):
+        """Saves everything needed to resume training. The replay memory is
+        saved incrementally into directory/memory, the rest is small and written
+        to a temporary file which replaces checkpoint.pt once complete."""
+        os.makedirs(directory, exist_ok=True)
+
+        if save_memory:
+            agent.memory.save(f"{directory}//memory")
+
+        agent.agent_config.save(f"{directory}//agent_config.json")
+        agent.training_config.save(f"{directory}//training_config.json")
+
+        if agent.environment.config is not None:
+            agent.environment.config.save(f"{directory}//environment_config.json")
+
+        T.save(
+            {
+                "Q_online": {
+                    name: value.clone()
+                    for name, value in agent.Q_online.state_dict().items()
+                },
+                "Q_target": {
+                    name: value.clone()
+                    for name, value in agent.Q_target.state_dict().items()
+                },
+                "optimizer": agent.optimizer.state_dict(),
+                "observation_pipeline": agent.observation_pipeline.state_dict(),
+                "n_steps": agent.n_steps,
+                "n_updates": agent.n_updates,
+                "n_episodes": agent.n_episodes,
+                "rng_states": {
+                    "python": random.getstate(),
+                    "torch": T.get_rng_state(),
+                    "exploration": agent.rng.getstate(),
+                    "environment": agent.environment.generator.get_state(),
+                },
+                "has_memory": save_memory,
+            },
+            f"{directory}//checkpoint.pt.tmp",
+        )
+        os.replace(f"{directory}//checkpoint.pt.tmp", f"{directory}//checkpoint.pt")
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(f"{directory}//checkpoint.pt")
+
+    @staticmethod
+    def load(directory: str, agent: Any) -> Dict[str, Any]:
+        checkpoint = T.load(f"{directory}//checkpoint.pt", weights_only=False)
+
+        # load_state_dict copies in place, keeping the stacked parameter storage
+        # of the target computer intact.
+        agent.Q_online.load_state_dict(checkpoint["Q_online"])
+        agent.Q_target.load_state_dict(checkpoint["Q_target"])
+        agent.optimizer.load_state_dict(checkpoint["optimizer"])
+        agent.observation_pipeline.load_state_dict(checkpoint["observation_pipeline"])
+
+        agent.n_steps = checkpoint["n_steps"]
+        agent.n_updates = checkpoint["n_updates"]
+        agent.n_episodes = checkpoint["n_episodes"]
+
+        rng_states = checkpoint["rng_states"]
+        random.setstate(rng_states["python"])
+        T.set_rng_state(rng_states["torch"])
+
+        # Checkpoints from before per-component streams only have the above.
+        if "exploration" in rng_states:
+            agent.rng.setstate(rng_states["exploration"])
+            agent.environment.generator.set_state(rng_states["environment"])
+
+        if checkpoint["has_memory"] and os.path.exists(f"{directory}//memory"):
+            agent.memory.load(f"{directory}//memory")
+
+        return checkpoint
+
+    @staticmethod
+    def load_environment_config(directory: str) -> Optional[EnvironmentConfig]:
+        """The environment config the checkpoint was trained in, or None for
+        checkpoints saved without one."""
+        file_path = f"{directory}//environment_config.json"
+
+        if not os.path.exists(file_path):
+            return None
+
+        return EnvironmentConfig.load(file_path)
+
+    @staticmethod
+    def load_policy(
+        directory: str, n_envs: int = 1, dtype: T.dtype = T.float64, device: str = "cpu"
+    ) -> Tuple[AgentConfig, T.nn.Module, ObservationPipeline]:
+        """Loads only what acting needs: the agent config, the online network
+        and an observation pipeline for n_envs environments with frozen
+        normalization statistics."""
+        agent_config = AgentConfig.load(f"{directory}//agent_config.json")
+        checkpoint = T.load(f"{directory}//checkpoint.pt", weights_only=False)
+        pipeline_state = checkpoint["observation_pipeline"]
+
+        observation_pipeline = ObservationPipeline(
+            pipeline_state["observation_size"],
+            n_envs=n_envs,
+            n_frames=pipeline_state["n_frames"],
+            dtype=dtype,
+            device=device,
+        )
+        observation_pipeline.load_state_dict(pipeline_state)
+        observation_pipeline.training = False
+
+        network = NETWORKS[agent_config.network](
+            observation_pipeline.output_size,
+            agent_config.n_accelerations * agent_config.n_wheel_angles,
+        )
+        network.load_state_dict(checkpoint["Q_online"])
+        network.eval()
+
+        return agent_config, network, observation_pipeline
@@ -1,7 +1,352 @@
+import os
+import json
+import tomllib
+import itertools
+import torch as T
+from typing import Any, Dict, List, Optional, Sequence
+
+
+DTYPES = {"float16": T.float16, "float32": T.float32, "float64": T.float64}
+
+
+class Field:
+    def __init__(
+        self,
+        type_: type,
+        default: Any,
+        choices: Optional[Sequence[Any]] = None,
+        minimum: Optional[float] = None,
+        optional: bool = False,
+        exclusive_minimum: bool = False,
+    ):
+        self.type = type_
+        self.default = default
+        self.choices = choices
+        self.minimum = minimum
+        self.optional = optional
+        # Exclusive minimums reject the minimum itself, e.g. 0 for time steps.
+        self.exclusive_minimum = exclusive_minimum
+
+    def parse(self, text: str) -> Any:
+        if self.optional and text.lower() in ("none", "null", ""):
+            return None
+
+        if self.type is bool:
+            if text.lower() in ("true", "1", "yes"):
+                return True
+            if text.lower() in ("false", "0", "no"):
+                return False
+
+            raise ValueError(f"'{text}' is not a bool")
+
+        return self.type(text)
+
+    def validate(self, name: str, value: Any) -> Any:
+        if value is None:
+            if self.optional:
+                return None
+
+            raise ValueError(f"Config field '{name}' can not be None")
+
+        if self.type is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+
+        if not isinstance(value, self.type) or (
+            self.type is int and isinstance(value, bool)
+        ):
+            raise TypeError(
+                f"Config field '{name}' expects {self.type.__name__}, "
+                f"got {type(value).__name__}: {value!r}"
+            )
+
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(
+                f"Config field '{name}' must be one of {list(self.choices)}, got {value!r}"
+            )
+
+        if self.minimum is not None and self.exclusive_minimum and value <= self.minimum:
+            raise ValueError(
+                f"Config field '{name}' must be above {self.minimum}, got {value!r}"
+            )
+
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(
+                f"Config field '{name}' must be at least {self.minimum}, got {value!r}"
+            )
+
+        return value
+
+
 class Config:
+    # Configs without a schema accept any field.
+    schema: Dict[str, Field] = {}
+
     def __init__(self, **kwargs) -> None:
-        for name, value in kwargs.items():
-            setattr(self, name, value)
+        if self.schema:
+            unknown_names = set(kwargs) - set(self.schema)
+
+            if unknown_names:
+                raise ValueError(
+                    f"Unknown {type(self).__name__} fields: {', '.join(sorted(unknown_names))}"
+                )
+
+            for name, field in self.schema.items():
+                setattr(
+                    self, name, field.validate(name, kwargs.get(name, field.default))
+                )
+
+        else:
+            for name, value in kwargs.items():
+                setattr(self, name, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    @classmethod
+    def coerce(cls, config: "Config") -> "Config":
+        if isinstance(config, cls):
+            return config
+
+        return cls(**config.to_dict())
+
+    def replace(self, **kwargs) -> "Config":
+        return type(self)(**{**self.to_dict(), **kwargs})
+
+    def override(self, overrides: Sequence[str]) -> "Config":
+        """Returns a copy with 'name=value' overrides applied, parsing the
+        values with the field types (or as JSON for configs without schema)."""
+        values = {}
+
+        for override in overrides:
+            name, separator, text = override.partition("=")
+
+            if separator == "":
+                raise ValueError(f"Override '{override}' is not of the form name=value")
+
+            if name in self.schema:
+                values[name] = self.schema[name].parse(text)
+            elif self.schema:
+                raise ValueError(f"Unknown {type(self).__name__} field: '{name}'")
+            else:
+                try:
+                    values[name] = json.loads(text)
+                except json.JSONDecodeError:
+                    values[name] = text
+
+        return self.replace(**values)
 
     def save(self, file_path: str):
-        raise NotImplementedError("Save function not implemented")
+        save_configs(file_path, {None: self})
+
+    @classmethod
+    def load(cls, file_path: str) -> "Config":
+        return cls(**read_config_file(file_path))
+
+
+class EnvironmentConfig(Config):
+    schema = {
+        "track_name": Field(str, "Track-2"),
+        "processed_track": Field(bool, False),
+        "dt": Field(float, 1 / 60, minimum=0.0, exclusive_minimum=True),
+        "frame_skip": Field(int, 1, minimum=1),
+        "dtype": Field(str, "float64", choices=list(DTYPES)),
+        "device": Field(str, "cpu"),
+        "backend": Field(str, "exact", choices=["exact", "sdf"]),
+        "sdf_resolution": Field(float, 0.5, minimum=0.01),
+        "sdf_rays": Field(bool, False),
+        "seed": Field(int, None, optional=True),
+        "continuous_collision": Field(bool, False),
+        "n_rays": Field(int, 11, minimum=1),
+        "ray_layout": Field(
+            str, "uniform", choices=["uniform", "forward", "two_layer"]
+        ),
+        "forward_ray_density": Field(float, 2.0, minimum=0.1),
+        "forward_ray_range_scale": Field(float, 2.0, minimum=0.1),
+        "ray_index_cell_size": Field(float, 10.0, minimum=0.1, optional=True),
+        "n_actors": Field(int, 1, minimum=1),
+        "random_spawn": Field(bool, False),
+        "max_episode_steps": Field(int, None, minimum=1, optional=True),
+        "render": Field(bool, False),
+        "visualize_vision": Field(bool, False),
+        "reward": Field(str, "distance", choices=["distance", "gate"]),
+        "gate_lookahead": Field(int, 2, minimum=1),
+        "gate_reward": Field(float, 10.0),
+        "distance_reward_density": Field(float, 1.0),
+        "time_penalty": Field(float, 10.0),
+        "crash_penalty": Field(float, 100.0),
+    }
+
+    @property
+    def torch_dtype(self) -> T.dtype:
+        return DTYPES[self.dtype]
+
+
+class AgentConfig(Config):
+    schema = {
+        "n_accelerations": Field(int, 3, minimum=1),
+        "n_wheel_angles": Field(int, 5, minimum=1),
+        "acceleration_exponent": Field(float, 1.0, minimum=0.1),
+        "wheel_angle_exponent": Field(float, 1.0, minimum=0.1),
+        "memory_capacity": Field(int, 100000, minimum=1),
+        "n_step": Field(int, 1, minimum=1),
+        "replay_storage": Field(str, "full", choices=["full", "float16", "uint8"]),
+        "network": Field(str, "test", choices=["test", "dueling"]),
+        "double_dqn": Field(bool, False),
+        "n_frames": Field(int, 1, minimum=1),
+        "action_repeat": Field(int, 1, minimum=1),
+        "normalize_observations": Field(bool, True),
+    }
+
+
+class TrainingConfig(Config):
+    schema = {
+        "n_steps": Field(int, 1000000, minimum=0),
+        "batch_size": Field(int, 128, minimum=1),
+        "learning_rate": Field(float, 1e-4, minimum=0.0),
+        "gamma": Field(float, 0.99, minimum=0.0),
+        "target_update_tau": Field(float, 1.0, minimum=0.0),
+        "target_update_period": Field(int, 1000, minimum=1),
+        "epsilon_start": Field(float, 1.0, minimum=0.0),
+        "epsilon_end": Field(float, 0.05, minimum=0.0),
+        "epsilon_decay": Field(int, 100000, minimum=1),
+        "checkpoint_dir": Field(str, None, optional=True),
+        "checkpoint_period": Field(int, 10000, minimum=1),
+        "checkpoint_memory": Field(bool, True),
+        "demonstrations_dir": Field(str, None, optional=True),
+        "pretrain_epochs": Field(int, 0, minimum=0),
+        "seed": Field(int, None, optional=True),
+    }
+
+
+CONFIG_SECTIONS = {
+    "environment": EnvironmentConfig,
+    "agent": AgentConfig,
+    "training": TrainingConfig,
+}
+
+
+def read_config_file(file_path: str) -> Dict[str, Any]:
+    extension = os.path.splitext(file_path)[1]
+
+    if extension == ".toml":
+        with open(file_path, "rb") as config_file:
+            return tomllib.load(config_file)
+
+    if extension == ".json":
+        with open(file_path) as config_file:
+            return json.load(config_file)
+
+    raise ValueError(f"Config file '{file_path}' is not a .toml or .json file")
+
+
+def format_toml_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(format_toml_value(item) for item in value) + "]"
+
+    raise TypeError(f"Can not write {type(value).__name__} to TOML: {value!r}")
+
+
+def save_configs(file_path: str, configs: Dict[Optional[str], Config]):
+    """Saves configs as sections (or top level for the None key) of one .toml or
+    .json file. None values are left out of TOML files and load as defaults."""
+    extension = os.path.splitext(file_path)[1]
+
+    if extension == ".json":
+        data = {}
+
+        for section, config in configs.items():
+            if section is None:
+                data.update(config.to_dict())
+            else:
+                data[section] = config.to_dict()
+
+        text = json.dumps(data, indent=4)
+
+    elif extension == ".toml":
+        lines = []
+
+        for section, config in configs.items():
+            if section is not None:
+                lines.append(f"\n[{section}]")
+
+            for name, value in config.to_dict().items():
+                if value is not None:
+                    lines.append(f"{name} = {format_toml_value(value)}")
+
+        text = "\n".join(lines).lstrip("\n") + "\n"
+
+    else:
+        raise ValueError(f"Config file '{file_path}' is not a .toml or .json file")
+
+    with open(f"{file_path}.tmp", "w") as config_file:
+        config_file.write(text)
+    os.replace(f"{file_path}.tmp", file_path)
+
+
+def load_configs(
+    file_path: Optional[str] = None, overrides: Sequence[str] = ()
+) -> Dict[str, Config]:
+    """Loads the environment, agent and training sections of a config file
+    (defaults if no file is given) and applies 'section.name=value' overrides."""
+    data = read_config_file(file_path) if file_path is not None else {}
+
+    configs = {
+        section: config_class(**data.get(section, {}))
+        for section, config_class in CONFIG_SECTIONS.items()
+    }
+
+    section_overrides = {section: [] for section in configs}
+
+    for override in overrides:
+        section, separator, section_override = override.partition(".")
+
+        if separator == "" or section not in configs:
+            raise ValueError(
+                f"Override '{override}' must start with one of: "
+                f"{', '.join(f'{section}.' for section in configs)}"
+            )
+
+        section_overrides[section].append(section_override)
+
+    return {
+        section: config.override(section_overrides[section])
+        for section, config in configs.items()
+    }
+
+
+def expand_sweep(
+    configs: Dict[str, Config], sweep: Dict[str, List[Any]]
+) -> List[Dict[str, Config]]:
+    """Expands {'section.name': [values, ...]} into the grid of all
+    combinations, each a full set of validated configs."""
+    names = list(sweep)
+    trials = []
+
+    for values in itertools.product(*(sweep[name] for name in names)):
+        section_values = {section: {} for section in configs}
+
+        for name, value in zip(names, values):
+            section, _, field_name = name.partition(".")
+
+            if section not in section_values:
+                raise ValueError(
+                    f"Sweep parameter '{name}' must start with one of: "
+                    f"{', '.join(f'{section}.' for section in configs)}"
+                )
+
+            section_values[section][field_name] = value
+
+        trials.append(
+            {
+                section: config.replace(**section_values[section])
+                for section, config in configs.items()
+            }
+        )
+
+    return trials
@@ -0,0 +1,237 @@
+import os
+import glob
+import numpy as np
+import torch as T
+import torch.nn.functional as F
+
+from ActionTable import ActionTable
+from Config import EnvironmentConfig
+from ObservationPipeline import ObservationPipeline
+from ReplayMemory import ReplayMemory, Transition
+from typing import Any, Dict, List, Optional
+
+
+# Environment settings that change the observations or the time step, which
+# demonstrations and the agents learning from them have to share.
+DEMONSTRATION_FIELDS = (
+    "n_rays",
+    "ray_layout",
+    "forward_ray_density",
+    "forward_ray_range_scale",
+    "frame_skip",
+    "dt",
+)
+
+
+def CheckDemonstrationConfig(
+    directory: str, config: EnvironmentConfig
+) -> Optional[EnvironmentConfig]:
+    """Returns the config saved with the demonstrations in directory, or None
+    if there is none, and raises if it differs from config in any of the
+    DEMONSTRATION_FIELDS."""
+    file_path = f"{directory}//environment_config.json"
+
+    if not os.path.exists(file_path):
+        return None
+
+    saved_config = EnvironmentConfig.load(file_path)
+    differences = [
+        f"{name}={getattr(saved_config, name)!r} (not {getattr(config, name)!r})"
+        for name in DEMONSTRATION_FIELDS
+        if getattr(saved_config, name) != getattr(config, name)
+    ]
+
+    if differences:
+        raise ValueError(
+            f"Demonstrations in '{directory}' were recorded with "
+            + ", ".join(differences)
+        )
+
+    return saved_config
+
+
+class DemonstrationRecorder:
+    """Records human driving as one compressed .npz per episode, holding the
+    raw observations (float16), the continuous controls, the rewards and
+    whether the episode ended with a crash. Controls are discretized when
+    loading, with the action table of the agent that uses them."""
+
+    def __init__(self, directory: str, config: EnvironmentConfig):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # Recordings of a directory are appended to and share one config.
+        if CheckDemonstrationConfig(directory, config) is None:
+            config.save(f"{directory}//environment_config.json")
+        self.n_episodes = len(glob.glob(f"{directory}//episode_*.npz"))
+
+        self.observations: List[np.ndarray] = []
+        self.controls: List[List[float]] = []
+        self.rewards: List[float] = []
+
+    def Reset(self, observation: T.Tensor):
+        self.observations = [observation.cpu().numpy()]
+        self.controls = []
+        self.rewards = []
+
+    def Step(
+        self,
+        wheel_angle: T.Tensor,
+        acceleration: T.Tensor,
+        observation: T.Tensor,
+        reward: T.Tensor,
+        crashed: T.Tensor,
+    ):
+        self.observations.append(observation.cpu().numpy())
+        self.controls.append([float(wheel_angle), float(acceleration)])
+        self.rewards.append(float(reward))
+
+        if crashed:
+            self.SaveEpisode(terminal=True)
+
+    def SaveEpisode(self, terminal: bool):
+        if len(self.controls) == 0:
+            return
+
+        np.savez_compressed(
+            f"{self.directory}//episode_{self.n_episodes:05d}.npz",
+            observations=np.asarray(self.observations, dtype=np.float16),
+            controls=np.asarray(self.controls, dtype=np.float32),
+            rewards=np.asarray(self.rewards, dtype=np.float32),
+            terminal=np.asarray(terminal),
+        )
+
+        self.n_episodes += 1
+        self.controls = []
+
+    def Close(self):
+        """Saves an unfinished episode as truncated."""
+        self.SaveEpisode(terminal=False)
+
+
+def LoadDemonstrations(
+    directory: str, config: Optional[EnvironmentConfig] = None
+) -> List[Dict[str, np.ndarray]]:
+    """Loads the recorded episodes, checking that they were recorded in an
+    environment like config, if given."""
+    if config is not None:
+        CheckDemonstrationConfig(directory, config)
+
+    episodes = []
+
+    for file_path in sorted(glob.glob(f"{directory}//episode_*.npz")):
+        with np.load(file_path) as episode:
+            episodes.append({name: episode[name] for name in episode.files})
+
+    return episodes
+
+
+def PrepareDemonstrations(
+    episodes: List[Dict[str, np.ndarray]],
+    action_table: ActionTable,
+    observation_pipeline: ObservationPipeline,
+    dtype: T.dtype = T.float64,
+    device: str = "cpu",
+) -> List[Transition]:
+    """Turns recorded episodes into batched transitions of the agent's states
+    and actions, one Transition per episode. Frames are grouped by the
+    pipeline's action_repeat, taking the action of the first frame and the
+    summed rewards, and the pipeline's normalizer is updated on the way."""
+    action_repeat = observation_pipeline.action_repeat
+    transitions = []
+
+    for episode in episodes:
+        observations = T.as_tensor(episode["observations"], device=device).to(dtype)
+        controls = T.as_tensor(episode["controls"], device=device).to(dtype)
+        rewards = T.as_tensor(episode["rewards"], device=device).to(dtype)
+        n_frames = controls.size(0)
+
+        starts = T.arange(0, n_frames, action_repeat, device=device)
+        ends = T.clamp(starts + action_repeat, max=n_frames)
+
+        states = [observation_pipeline.Reset(observations[:1]).clone()]
+
+        for end in ends.tolist():
+            states.append(observation_pipeline.Process(observations[end][None]).clone())
+
+        states = T.cat(states)
+        dones = T.zeros((starts.size(0),), dtype=T.bool, device=device)
+        dones[-1] = bool(episode["terminal"])
+
+        returns = T.cat((T.zeros((1,), dtype=dtype, device=device), T.cumsum(rewards, 0)))
+
+        transitions.append(
+            Transition(
+                states[:-1],
+                action_table.GetNearest(controls[starts, 0], controls[starts, 1]),
+                states[1:],
+                returns[ends] - returns[starts],
+                dones,
+            )
+        )
+
+    return transitions
+
+
+def FillReplayMemory(memory: ReplayMemory, transitions: List[Transition]) -> int:
+    """Pushes the prepared episodes one step at a time, as a single
+    environment would, and returns the number of steps pushed."""
+    n_steps = 0
+
+    for episode in transitions:
+        for step in range(episode.state.size(0)):
+            memory.push_batch(*(values[step : step + 1] for values in episode))
+
+        if not episode.done[-1]:
+            memory.truncate()
+
+        n_steps += episode.state.size(0)
+
+    return n_steps
+
+
+def PretrainBehaviorCloning(
+    agent: Any,
+    transitions: List[Transition],
+    n_epochs: int,
+    batch_size: int = 1024,
+    margin: float = 0.8,
+    generator: Optional[T.Generator] = None,
+) -> Optional[float]:
+    """Warm starts the online network on the demonstrated actions with the
+    large margin loss of DQfD, which pushes the Q-value of the demonstrated
+    action at least margin above the others, then syncs the target network.
+    Returns the mean loss of the last epoch."""
+    states = T.cat([episode.state for episode in transitions])
+    actions = T.cat([episode.action for episode in transitions])
+    network_dtype = agent.target_computer.online_parameters[0].dtype
+
+    mean_loss = None
+
+    for _ in range(n_epochs):
+        permutation = T.randperm(states.size(0), generator=generator)
+        losses = []
+
+        for batch in T.split(permutation, batch_size):
+            q_values = agent.Q_online(states[batch].to(network_dtype))
+            margins = margin * F.one_hot(actions[batch], agent.n_actions).logical_not().to(
+                q_values.dtype
+            )
+
+            loss = T.mean(
+                T.max(q_values + margins, dim=1)[0]
+                - T.gather(q_values, 1, actions[batch, None])[:, 0]
+            )
+
+            agent.optimizer.zero_grad()
+            loss.backward()
+            T.nn.utils.clip_grad_value_(agent.Q_online.parameters(), 100)
+            agent.optimizer.step()
+
+            losses.append(loss.item())
+
+        mean_loss = sum(losses) / len(losses)
+
+    agent.target_computer.SyncTarget()
+
+    return mean_loss
@@ -0,0 +1,149 @@
+import sys
+import argparse
+import torch as T
+
+from Agent import Agent
+from Config import load_configs
+from Environment import Environment
+from VectorEnvironment import SubprocessVectorEnvironment, VectorEnvironment
+from typing import Any, Dict, Optional
+
+
+def RunVectorEnvironment(
+    vector_environment: Any, n_steps: int, seed: int
+) -> Dict[str, T.Tensor]:
+    """Drives the environments from random spawns with random controls drawn
+    from seed and returns the stacked observations, rewards and crashes."""
+    generator = T.Generator().manual_seed(seed)
+    n_envs = vector_environment.n_envs
+    dtype = vector_environment.dtype
+
+    observations, _ = vector_environment.Reset()
+    trajectory = {"observations": [observations.clone()], "rewards": [], "crashed": []}
+
+    for _ in range(n_steps):
+        wheel_angles = (2 * T.rand((n_envs,), generator=generator) - 1).to(dtype)
+        accelerations = T.rand((n_envs,), generator=generator).to(dtype)
+
+        observations, rewards, crashed = vector_environment.Step(
+            wheel_angles, accelerations
+        )
+
+        trajectory["observations"].append(observations.clone())
+        trajectory["rewards"].append(rewards.clone())
+        trajectory["crashed"].append(crashed.clone())
+
+    return {name: T.stack(values) for name, values in trajectory.items()}
+
+
+def TrainAgent(configs: Dict[str, Any]) -> T.Tensor:
+    """Trains a fresh agent and returns its flattened online parameters."""
+    agent = Agent(
+        configs["agent"],
+        configs["training"],
+        Environment.FromConfig(configs["environment"]),
+    )
+    agent.train()
+
+    return T.cat(
+        [parameter.detach().flatten() for parameter in agent.Q_online.parameters()]
+    )
+
+
+def IsEqual(run_0: Dict[str, T.Tensor], run_1: Dict[str, T.Tensor]) -> bool:
+    return all(T.equal(run_0[name], run_1[name]) for name in run_0)
+
+
+def CheckDeterminism(
+    configs: Dict[str, Any],
+    seed: int,
+    n_envs: int = 4,
+    n_steps: int = 500,
+    n_workers: Optional[int] = 2,
+    n_train_steps: int = 500,
+) -> Dict[str, bool]:
+    """Checks that runs with the same seed are bit-identical: single and
+    batched environments run twice, subprocess environments against the
+    batched ones, and two short training runs. Also checks that another
+    seed changes the trajectories, so the seed is actually used."""
+    environment_config = configs["environment"].replace(
+        seed=seed, random_spawn=True, render=False, visualize_vision=False
+    )
+    results = {}
+
+    single_runs = [
+        RunVectorEnvironment(
+            VectorEnvironment([Environment.FromConfig(environment_config)]),
+            n_steps,
+            seed,
+        )
+        for _ in range(2)
+    ]
+    results["single"] = IsEqual(*single_runs)
+
+    batched_runs = [
+        RunVectorEnvironment(
+            VectorEnvironment.FromConfig(environment_config, n_envs), n_steps, seed
+        )
+        for _ in range(2)
+    ]
+    results["batched"] = IsEqual(*batched_runs)
+
+    subprocess_environment = SubprocessVectorEnvironment(
+        environment_config, n_envs=n_envs, n_workers=n_workers
+    )
+
+    try:
+        subprocess_run = RunVectorEnvironment(subprocess_environment, n_steps, seed)
+    finally:
+        subprocess_environment.Close()
+
+    results["subprocess"] = IsEqual(batched_runs[0], subprocess_run)
+
+    other_run = RunVectorEnvironment(
+        VectorEnvironment.FromConfig(environment_config.replace(seed=seed + 1), n_envs),
+        n_steps,
+        seed,
+    )
+    results["seed_changes_spawns"] = not IsEqual(batched_runs[0], other_run)
+
+    training_configs = {
+        "environment": environment_config,
+        "agent": configs["agent"],
+        "training": configs["training"].replace(
+            seed=seed, n_steps=n_train_steps, checkpoint_dir=None
+        ),
+    }
+    results["training"] = T.equal(
+        TrainAgent(training_configs), TrainAgent(training_configs)
+    )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that seeded runs reproduce bit for bit."
+    )
+    parser.add_argument("overrides", nargs="*", help="section.name=value overrides")
+    parser.add_argument("--config", default=None, help="training .toml/.json config")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--envs", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--train-steps", type=int, default=500)
+    args = parser.parse_args()
+
+    results = CheckDeterminism(
+        load_configs(args.config, args.overrides),
+        args.seed,
+        n_envs=args.envs,
+        n_steps=args.steps,
+        n_workers=args.workers,
+        n_train_steps=args.train_steps,
+    )
+
+    for name, passed in results.items():
+        print(f"{name:>20}: {'ok' if passed else 'MISMATCH'}")
+
+    sys.exit(0 if all(results.values()) else 1)
@@ -1,17 +1,26 @@
 import sys
+import numpy as np
 import pygame as pg
 
 import torch as T
 from Car import Car
 from Track import Track
 from Camera import Camera
-from Reward import Reward
+from Reward import GateReward, Reward
+from GateTracker import GateTracker
+from TrackIndex import TrackIndex
+from TrackSDF import TrackSDF
+from Seeding import ENVIRONMENT_STREAM, DeriveSeed, MakeGenerator
+from Config import EnvironmentConfig
+from Cars.RaceCar import RaceCar
 
-from typing import Tuple
-from random import randint
+from typing import Any, Dict, Optional, Tuple
 
 
 class Environment:
+    # Wheel angles and accelerations are fractions of the car's maxima.
+    control_range = (-1.0, 1.0)
+
     def __init__(
         self,
         car: Car,
@@ -22,10 +31,36 @@ class Environment:
         render: bool = True,
         random_spawn: bool = False,
         visualize_vision: bool = False,
+        processed_track: bool = False,
+        frame_skip: int = 1,
+        dt: float = 1 / 60,
+        gate_lookahead: int = 2,
+        ray_index_cell_size: Optional[float] = None,
+        backend: str = "exact",
+        sdf_resolution: float = 0.5,
+        sdf_rays: bool = False,
+        seed: Optional[int] = None,
+        max_episode_steps: Optional[int] = None,
     ):
         self.car = car
-        self.track = Track.Load(track_name, dtype=dtype, device=device)
+        self.track = Track.Load(
+            track_name, dtype=dtype, device=device, processed=processed_track
+        )
+
+        if ray_index_cell_size is not None:
+            self.car.SetTrackIndex(TrackIndex.Load(self.track, ray_index_cell_size))
+        if backend == "sdf":
+            self.car.SetTrackSDF(
+                TrackSDF.Load(self.track, sdf_resolution), trace_rays=sdf_rays
+            )
+        elif backend != "exact":
+            raise ValueError(f"Unknown backend '{backend}'")
         self.reward_function = reward_function
+        self.generator = MakeGenerator(seed)
+
+        # The config of environments built by FromConfig, saved with checkpoints.
+        self.config: Optional[EnvironmentConfig] = None
+        self.gate_tracker = GateTracker(self.track, n_lookahead=gate_lookahead)
 
         self.dtype = dtype
         self.device = device
@@ -33,6 +68,12 @@ class Environment:
         self.render = render
         self.random_spawn = random_spawn
         self.visualize_vision = visualize_vision
+        self.frame_skip = frame_skip
+        self.dt = dt
+
+        # Episodes are truncated after max_episode_steps steps, if given.
+        self.max_episode_steps = max_episode_steps
+        self.episode_steps = 0
 
         if self.render:
             pg.init()
@@ -48,11 +89,72 @@ class Environment:
 
             pg.mouse.set_visible(False)
 
-    def GetSpawn(self) -> tuple:
-        if self.random_spawn:
-            start_index = randint(0, self.track.points.size(0) - 1)
+            self.InitializeDrawBuffers()
+
+    @staticmethod
+    def FromConfig(config: EnvironmentConfig, env_index: int = 0) -> "Environment":
+        """Environment env_index of a config, which seeds it with its own
+        stream of config.seed."""
+        car = RaceCar(
+            config.torch_dtype,
+            config.device,
+            continuous_collision=config.continuous_collision,
+            n_rays=config.n_rays,
+            ray_layout=config.ray_layout,
+            forward_ray_density=config.forward_ray_density,
+            forward_ray_range_scale=config.forward_ray_range_scale,
+        )
+        if config.reward == "gate":
+            reward_function = GateReward(
+                config.gate_reward, config.time_penalty, config.crash_penalty
+            )
         else:
-            start_index = 0
+            reward_function = Reward(
+                config.distance_reward_density,
+                config.time_penalty,
+                config.crash_penalty,
+            )
+
+        environment = Environment(
+            car,
+            config.track_name,
+            config.torch_dtype,
+            config.device,
+            reward_function,
+            render=config.render,
+            random_spawn=config.random_spawn,
+            visualize_vision=config.visualize_vision,
+            processed_track=config.processed_track,
+            frame_skip=config.frame_skip,
+            dt=config.dt,
+            gate_lookahead=config.gate_lookahead,
+            ray_index_cell_size=config.ray_index_cell_size,
+            backend=config.backend,
+            sdf_resolution=config.sdf_resolution,
+            sdf_rays=config.sdf_rays,
+            seed=DeriveSeed(config.seed, ENVIRONMENT_STREAM, env_index),
+            max_episode_steps=config.max_episode_steps,
+        )
+        environment.config = config
+
+        return environment
+
+    def Seed(self, seed: int):
+        """Restarts the spawn stream from seed."""
+        self.generator.manual_seed(seed)
+
+    def GetStartIndex(self, start_index: Optional[int] = None) -> int:
+        if start_index is None and self.random_spawn:
+            return int(
+                T.randint(self.track.points.size(0), (), generator=self.generator)
+            )
+        elif start_index is None:
+            return 0
+
+        return start_index
+
+    def GetSpawn(self, start_index: Optional[int] = None) -> tuple:
+        start_index = self.GetStartIndex(start_index)
 
         start_position = self.track.points[start_index].clone()
         start_angle = T.atan2(
@@ -62,9 +164,12 @@ class Environment:
 
         return start_position, start_angle
 
-    def Reset(self) -> Tuple[T.Tensor, T.Tensor]:
-        spawn_position, spawn_angle = self.GetSpawn()
+    def Reset(self, start_index: Optional[int] = None) -> Tuple[T.Tensor, T.Tensor]:
+        start_index = self.GetStartIndex(start_index)
+        spawn_position, spawn_angle = self.GetSpawn(start_index)
         self.car.Reset(spawn_position, spawn_angle, self.track.track_lines)
+        self.gate_tracker.Reset(start_index)
+        self.episode_steps = 0
 
         if self.render:
             self.camera.pixel_density = 1.0
@@ -76,16 +181,77 @@ class Environment:
 
         return self.car.GetObservation(), self.car.Crashed(self.track.track_lines)
 
-    def DrawTrack(self):
-        self.screen.fill((0, 50, 0))
+    def IsTruncated(self) -> bool:
+        """Whether the episode has run into the time limit."""
+        return (
+            self.max_episode_steps is not None
+            and self.episode_steps >= self.max_episode_steps
+        )
 
-        local_left_rails = (
-            self.camera.GlobalToLocalSpace(self.track.left_rails).cpu().numpy()
+    def GetInfo(self) -> Dict[str, Any]:
+        """Gate progress, lap count and lap times of the current episode."""
+        return self.gate_tracker.GetInfo()
+
+    def InitializeDrawBuffers(self):
+        """Every drawn point lives in one global buffer, the static rails first,
+        then the car position, the ray ends and the car corners, which the
+        camera transforms to pixels in one op per frame."""
+        left_rails = self.track.left_rails.cpu().numpy()
+        right_rails = self.track.right_rails.cpu().numpy()
+        n_rails = left_rails.shape[0]
+
+        self.dynamic_start = 2 * n_rails
+        n_points = (
+            self.dynamic_start + 1 + self.car.n_rays + self.car.local_car_points.size(0)
         )
-        local_right_rails = (
-            self.camera.GlobalToLocalSpace(self.track.right_rails).cpu().numpy()
+
+        self.global_points = np.zeros((n_points, 2))
+        self.global_points[:n_rails] = left_rails
+        self.global_points[n_rails : self.dynamic_start] = right_rails
+
+        self.local_points = np.zeros_like(self.global_points)
+        self.local_left_rails = self.local_points[:n_rails]
+        self.local_right_rails = self.local_points[n_rails : self.dynamic_start]
+        self.local_car_position = self.local_points[self.dynamic_start]
+        self.local_ray_ends = self.local_points[
+            self.dynamic_start + 1 : self.dynamic_start + 1 + self.car.n_rays
+        ]
+        self.local_car_points = self.local_points[
+            self.dynamic_start + 1 + self.car.n_rays :
+        ]
+
+        # Camera version the rails were last transformed with.
+        self.rails_camera_version = None
+
+    def TransformDrawBuffers(self):
+        self.global_points[self.dynamic_start :] = (
+            T.cat(
+                (
+                    self.car.car_position[None],
+                    self.car.global_ray_lines[..., 0]
+                    + self.car.vision[:, None] * self.car.global_ray_lines[..., 1],
+                    self.car.global_car_lines[..., 0],
+                )
+            )
+            .cpu()
+            .numpy()
         )
 
+        # The rails only move on screen when the camera does.
+        start = self.dynamic_start
+
+        if self.camera.version != self.rails_camera_version:
+            self.rails_camera_version = self.camera.version
+            start = 0
+
+        self.camera.Transform(self.global_points[start:], out=self.local_points[start:])
+
+    def DrawTrack(self):
+        self.screen.fill((0, 50, 0))
+
+        local_left_rails = self.local_left_rails
+        local_right_rails = self.local_right_rails
+
         for i in range(local_left_rails.shape[0] - 1):
             pg.draw.polygon(
                 self.screen,
@@ -132,19 +298,6 @@ class Environment:
 
     def DrawCar(self):
         if self.visualize_vision:
-            local_car_position = (
-                self.camera.GlobalToLocalSpace(self.car.car_position[None])[0]
-                .cpu()
-                .numpy()
-            )
-            local_ray_lines = (
-                self.camera.GlobalToLocalSpace(
-                    self.car.global_ray_lines[..., 0]
-                    + self.car.vision[:, None] * self.car.global_ray_lines[..., 1]
-                )
-                .cpu()
-                .numpy()
-            )
             local_vision_indicator_radius = (
                 self.car.vision_indicator_radius * self.camera.pixel_density
             )
@@ -153,22 +306,16 @@ class Environment:
                 pg.draw.line(
                     self.screen,
                     self.car.skin.vision_lines_color,
-                    local_car_position,
-                    local_ray_lines[ray_index],
+                    self.local_car_position,
+                    self.local_ray_ends[ray_index],
                 )
                 pg.draw.circle(
                     self.screen,
                     color=(255, 255, 0),
-                    center=local_ray_lines[ray_index],
+                    center=self.local_ray_ends[ray_index],
                     radius=local_vision_indicator_radius,
                 )
 
-        local_car_points = (
-            self.camera.GlobalToLocalSpace(self.car.global_car_lines[..., 0])
-            .cpu()
-            .numpy()
-        )
-
         pg.draw.polygon(
             self.screen,
             (
@@ -176,13 +323,13 @@ class Environment:
                 if not self.car.crashed
                 else self.car.skin.crashed_car_color
             ),
-            local_car_points,
+            self.local_car_points,
         )
         pg.draw.lines(
             self.screen,
             self.car.skin.outline_color,
             True,
-            local_car_points,
+            self.local_car_points,
             width=round(self.car.edge_width * self.camera.pixel_density),
         )
 
@@ -191,15 +338,50 @@ class Environment:
         sys.exit()
 
     def Render(self):
+        self.TransformDrawBuffers()
         self.DrawTrack()
         self.DrawCar()
 
         pg.display.flip()
 
     def Step(
-        self, wheel_angle: T.Tensor, acceleration: T.Tensor, dt: float
+        self, wheel_angle: T.Tensor, acceleration: T.Tensor, dt: Optional[float] = None
     ) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
-        self.car.Step(wheel_angle, acceleration, self.track.track_lines, dt)
+        if dt is None:
+            dt = self.dt
+
+        # The physics and crash checks run for every skipped frame, but the rays
+        # are only cast for the observation returned after the last one.
+        reward = 0.0
+        self.episode_steps += 1
+
+        for frame in range(self.frame_skip):
+            is_last_frame = frame == self.frame_skip - 1
+            previous_position = self.car.car_position.clone()
+
+            self.car.Step(
+                wheel_angle,
+                acceleration,
+                self.track.track_lines,
+                dt,
+                see=is_last_frame,
+            )
+
+            self.gate_tracker.Update(previous_position, self.car.car_position, dt)
+
+            reward = reward + self.reward_function(
+                self.car.car_position,
+                self.track,
+                self.car.crashed,
+                dt,
+                self.gate_tracker,
+            )
+
+            if self.car.crashed:
+                if not is_last_frame:
+                    self.car.UpdateVision(self.track.track_lines)
+
+                break
 
         if self.render:
             self.camera.Update(
@@ -208,10 +390,6 @@ class Environment:
                 new_pixel_density=15.0,
             )
             self.Render()
-            self.clock.tick(1 / dt)
-
-        reward = self.reward_function(
-            self.car.car_position, self.track, self.car.crashed, dt
-        )
+            self.clock.tick(1 / (dt * self.frame_skip))
 
         return self.car.GetObservation(), reward, self.car.crashed
@@ -0,0 +1,560 @@
+import os
+import sys
+import time
+import struct
+import socket
+import asyncio
+import argparse
+import threading
+import statistics
+import multiprocessing as mp
+import numpy as np
+import torch as T
+
+from Config import EnvironmentConfig
+from VectorEnvironment import SubprocessVectorEnvironment, VectorEnvironment
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+# Every frame is a uint32 length followed by the message, which starts with a
+# uint8 message type and a uint32 request id. Everything is little-endian.
+FRAME_HEADER = struct.Struct("<I")
+MESSAGE_HEADER = struct.Struct("<BI")
+
+OPEN, RESET, STEP, CLOSE, OPENED, OBSERVATION, ERROR = range(7)
+
+# OPEN: uint32 n_envs.
+OPEN_BODY = struct.Struct("<I")
+# OPENED: uint32 n_envs, uint32 observation_size, uint8 float size in bytes.
+OPENED_BODY = struct.Struct("<IIB")
+# RESET: int32 start index per env, -1 for the default spawn.
+# STEP: float (n_envs, 2) wheel angles and accelerations.
+# OBSERVATION: float64 server latency in seconds, then float observations,
+# float rewards and uint8 crashed flags of the client's envs.
+OBSERVATION_HEADER = struct.Struct("<d")
+# ERROR: utf-8 message.
+
+FLOAT_TYPES = {4: np.dtype("<f4"), 8: np.dtype("<f8")}
+
+
+def EncodeMessage(message_type: int, request_id: int, *bodies: bytes) -> bytes:
+    message = MESSAGE_HEADER.pack(message_type, request_id) + b"".join(bodies)
+
+    return FRAME_HEADER.pack(len(message)) + message
+
+
+class EnvironmentServer:
+    """Hosts a vector environment whose envs are handed out to the clients in
+    slots. Step requests arriving within max_batch_delay of each other, or
+    from every connected client, are run as one masked vector step."""
+
+    def __init__(
+        self,
+        vector_environment: Any,
+        max_batch_delay: float = 0.001,
+        n_latencies: int = 100000,
+    ):
+        self.vector_environment = vector_environment
+        self.max_batch_delay = max_batch_delay
+
+        self.float_type = FLOAT_TYPES[
+            T.empty((), dtype=vector_environment.dtype).element_size()
+        ]
+        self.free_slots = list(range(vector_environment.n_envs))
+        self.client_slots: Dict[int, np.ndarray] = {}
+        self.pending_steps: Dict[int, tuple] = {}
+
+        # Latencies from receiving a request to its reply being ready.
+        self.latencies = deque(maxlen=n_latencies)
+        self.batch_sizes = deque(maxlen=n_latencies)
+
+        # Vector steps run on one thread, so the event loop keeps receiving
+        # requests for the next batch meanwhile.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.next_client_id = 0
+
+    async def Serve(self, socket_path: str, ready: Optional[threading.Event] = None):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        self.step_arrived = asyncio.Event()
+        self.environment_lock = asyncio.Lock()
+
+        server = await asyncio.start_unix_server(self.HandleClient, path=socket_path)
+        batcher = asyncio.create_task(self.RunBatches())
+
+        if ready is not None:
+            ready.set()
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.executor.shutdown()
+
+    async def RunInExecutor(self, function, *arguments):
+        async with self.environment_lock:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, function, *arguments
+            )
+
+    def EncodeObservation(
+        self, request_id: int, slots: np.ndarray, receive_time: float
+    ) -> bytes:
+        latency = time.perf_counter() - receive_time
+        self.latencies.append(latency)
+
+        return EncodeMessage(
+            OBSERVATION,
+            request_id,
+            OBSERVATION_HEADER.pack(latency),
+            self.vector_environment.observations.numpy()[slots]
+            .astype(self.float_type, copy=False)
+            .tobytes(),
+            self.vector_environment.rewards.numpy()[slots]
+            .astype(self.float_type, copy=False)
+            .tobytes(),
+            self.vector_environment.crashed.numpy()[slots].astype(np.uint8).tobytes(),
+        )
+
+    async def HandleClient(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client_id = self.next_client_id
+        self.next_client_id += 1
+
+        try:
+            while True:
+                (length,) = FRAME_HEADER.unpack(
+                    await reader.readexactly(FRAME_HEADER.size)
+                )
+                message = await reader.readexactly(length)
+                receive_time = time.perf_counter()
+
+                if length < MESSAGE_HEADER.size:
+                    writer.write(EncodeMessage(ERROR, 0, b"Message too short"))
+                    await writer.drain()
+                    continue
+
+                message_type, request_id = MESSAGE_HEADER.unpack_from(message)
+                body = memoryview(message)[MESSAGE_HEADER.size :]
+
+                if message_type == CLOSE:
+                    break
+
+                try:
+                    reply = await self.HandleMessage(
+                        client_id, message_type, request_id, body, receive_time
+                    )
+                except (ValueError, struct.error) as error:
+                    reply = EncodeMessage(ERROR, request_id, str(error).encode())
+
+                writer.write(reply)
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+
+        finally:
+            self.pending_steps.pop(client_id, None)
+            self.free_slots.extend(self.client_slots.pop(client_id, []))
+            writer.close()
+
+    async def HandleMessage(
+        self,
+        client_id: int,
+        message_type: int,
+        request_id: int,
+        body: memoryview,
+        receive_time: float,
+    ) -> bytes:
+        if message_type == OPEN:
+            if len(body) != OPEN_BODY.size:
+                raise ValueError(f"OPEN body must be {OPEN_BODY.size} bytes")
+
+            (n_envs,) = OPEN_BODY.unpack(body)
+
+            if client_id in self.client_slots:
+                raise ValueError("Client already opened its environments")
+            if n_envs > len(self.free_slots):
+                raise ValueError(
+                    f"Requested {n_envs} environments, only {len(self.free_slots)} are free"
+                )
+
+            self.client_slots[client_id] = np.array(self.free_slots[:n_envs])
+            del self.free_slots[:n_envs]
+
+            return EncodeMessage(
+                OPENED,
+                request_id,
+                OPENED_BODY.pack(
+                    n_envs,
+                    self.vector_environment.observation_size,
+                    self.float_type.itemsize,
+                ),
+            )
+
+        slots = self.client_slots.get(client_id)
+
+        if slots is None:
+            raise ValueError("Client has to open environments first")
+
+        if message_type == RESET:
+            start_indices = np.frombuffer(body, dtype="<i4")
+
+            if start_indices.size != slots.size:
+                raise ValueError(f"Expected {slots.size} start indices")
+
+            all_start_indices: List[Optional[int]] = [None] * self.vector_environment.n_envs
+            env_mask = T.zeros((self.vector_environment.n_envs,), dtype=T.bool)
+
+            for slot, start_index in zip(slots.tolist(), start_indices.tolist()):
+                all_start_indices[slot] = start_index if start_index >= 0 else None
+                env_mask[slot] = True
+
+            await self.RunInExecutor(
+                self.vector_environment.Reset, all_start_indices, env_mask
+            )
+            self.vector_environment.rewards[env_mask] = 0.0
+
+            return self.EncodeObservation(request_id, slots, receive_time)
+
+        if message_type == STEP:
+            actions = np.frombuffer(body, dtype=self.float_type)
+
+            if actions.size != 2 * slots.size:
+                raise ValueError(f"Expected {2 * slots.size} action values")
+
+            reply = asyncio.get_running_loop().create_future()
+            self.pending_steps[client_id] = (
+                request_id,
+                slots,
+                actions.reshape(slots.size, 2),
+                receive_time,
+                reply,
+            )
+            self.step_arrived.set()
+
+            return await reply
+
+        raise ValueError(f"Unknown message type {message_type}")
+
+    async def RunBatches(self):
+        loop = asyncio.get_running_loop()
+        n_envs = self.vector_environment.n_envs
+        dtype = self.vector_environment.dtype
+
+        while True:
+            await self.step_arrived.wait()
+            deadline = loop.time() + self.max_batch_delay
+
+            # Waits for the other clients' steps until the deadline.
+            while len(self.pending_steps) < len(self.client_slots):
+                self.step_arrived.clear()
+
+                try:
+                    await asyncio.wait_for(
+                        self.step_arrived.wait(), deadline - loop.time()
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            self.step_arrived.clear()
+            pending_steps, self.pending_steps = self.pending_steps, {}
+
+            if len(pending_steps) == 0:
+                continue
+
+            actions = T.zeros((n_envs, 2), dtype=dtype)
+            env_mask = T.zeros((n_envs,), dtype=T.bool)
+
+            for _, slots, client_actions, _, _ in pending_steps.values():
+                slot_indices = T.from_numpy(slots)
+                actions[slot_indices] = T.from_numpy(client_actions.copy()).to(dtype)
+                env_mask[slot_indices] = True
+
+            # A failed step is reported to every client of the batch, and the
+            # batcher keeps serving the next ones.
+            try:
+                await self.RunInExecutor(
+                    self.vector_environment.Step, actions[:, 0], actions[:, 1], env_mask
+                )
+            except Exception as error:
+                print(f"Vector step failed: {error!r}", file=sys.stderr)
+
+                for *_, reply in pending_steps.values():
+                    if not reply.done():
+                        reply.set_exception(ValueError(f"Step failed: {error!r}"))
+
+                continue
+
+            self.batch_sizes.append(len(pending_steps))
+
+            for request_id, slots, _, receive_time, reply in pending_steps.values():
+                if not reply.done():
+                    reply.set_result(
+                        self.EncodeObservation(request_id, slots, receive_time)
+                    )
+
+    def GetStats(self) -> Dict[str, float]:
+        if len(self.latencies) == 0:
+            return {}
+
+        latencies = np.array(self.latencies) * 1e6
+
+        return {
+            "n_requests": len(latencies),
+            "latency_p50_us": float(np.percentile(latencies, 50)),
+            "latency_p90_us": float(np.percentile(latencies, 90)),
+            "latency_p99_us": float(np.percentile(latencies, 99)),
+            "mean_batch_clients": (
+                statistics.fmean(self.batch_sizes) if self.batch_sizes else 0.0
+            ),
+        }
+
+
+class EnvironmentClient:
+    """Blocking client for policies in other processes, with the same Reset and
+    Step interface as the vector environments for its share of the envs."""
+
+    def __init__(self, socket_path: str, n_envs: int = 1):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.request_id = 0
+
+        self.n_envs, self.observation_size, float_size = OPENED_BODY.unpack(
+            self.Request(OPEN, OPEN_BODY.pack(n_envs))
+        )
+        self.float_type = FLOAT_TYPES[float_size]
+
+        # Server latency of the last request in seconds.
+        self.server_latency = 0.0
+
+    def Receive(self, n_bytes: int) -> bytearray:
+        data = bytearray(n_bytes)
+        view = memoryview(data)
+
+        while len(view) > 0:
+            n_received = self.socket.recv_into(view)
+
+            if n_received == 0:
+                raise ConnectionError("Environment server closed the connection")
+
+            view = view[n_received:]
+
+        return data
+
+    def Request(self, message_type: int, body: bytes = b"") -> memoryview:
+        self.request_id += 1
+        self.socket.sendall(EncodeMessage(message_type, self.request_id, body))
+
+        (length,) = FRAME_HEADER.unpack(self.Receive(FRAME_HEADER.size))
+        message = self.Receive(length)
+
+        reply_type, request_id = MESSAGE_HEADER.unpack_from(message)
+        body = memoryview(message)[MESSAGE_HEADER.size :]
+
+        if reply_type == ERROR:
+            raise RuntimeError(f"Environment server error: {bytes(body).decode()}")
+
+        return body
+
+    def DecodeObservation(self, body: memoryview) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        (self.server_latency,) = OBSERVATION_HEADER.unpack_from(body)
+
+        offset = OBSERVATION_HEADER.size
+        observation_count = self.n_envs * self.observation_size
+
+        observations = np.frombuffer(
+            body, dtype=self.float_type, count=observation_count, offset=offset
+        )
+        offset += observations.nbytes
+        rewards = np.frombuffer(
+            body, dtype=self.float_type, count=self.n_envs, offset=offset
+        )
+        offset += rewards.nbytes
+        crashed = np.frombuffer(body, dtype=np.uint8, count=self.n_envs, offset=offset)
+
+        return (
+            T.from_numpy(observations.reshape(self.n_envs, self.observation_size)),
+            T.from_numpy(rewards),
+            T.from_numpy(crashed.astype(bool)),
+        )
+
+    def Reset(
+        self, start_indices: Optional[Sequence[Optional[int]]] = None
+    ) -> Tuple[T.Tensor, T.Tensor]:
+        if start_indices is None:
+            start_indices = [None] * self.n_envs
+
+        body = self.Request(
+            RESET,
+            np.array(
+                [-1 if index is None else index for index in start_indices], dtype="<i4"
+            ).tobytes(),
+        )
+        observations, _, crashed = self.DecodeObservation(body)
+
+        return observations, crashed
+
+    def Step(
+        self, wheel_angles: T.Tensor, accelerations: T.Tensor
+    ) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        actions = np.stack(
+            (np.asarray(wheel_angles), np.asarray(accelerations)), axis=-1
+        ).astype(self.float_type)
+
+        return self.DecodeObservation(self.Request(STEP, actions.tobytes()))
+
+    def Close(self):
+        self.socket.sendall(EncodeMessage(CLOSE, self.request_id + 1))
+        self.socket.close()
+
+
+def BuildVectorEnvironment(
+    config: EnvironmentConfig, n_envs: int, subprocess: bool, n_workers: Optional[int]
+) -> Any:
+    config = config.replace(render=False, visualize_vision=False)
+
+    if subprocess:
+        return SubprocessVectorEnvironment(config, n_envs=n_envs, n_workers=n_workers)
+
+    return VectorEnvironment.FromConfig(config, n_envs=n_envs)
+
+
+def RunBenchmarkClient(
+    socket_path: str, n_envs: int, n_steps: int, seed: int
+) -> Dict[str, float]:
+    client = EnvironmentClient(socket_path, n_envs)
+    generator = T.Generator().manual_seed(seed)
+
+    client.Reset()
+    round_trips = []
+    server_latencies = []
+
+    for _ in range(n_steps):
+        wheel_angles = 0.6 * (2 * T.rand((n_envs,), generator=generator) - 1)
+        accelerations = T.rand((n_envs,), generator=generator)
+
+        start_time = time.perf_counter()
+        client.Step(wheel_angles, accelerations)
+        round_trips.append(time.perf_counter() - start_time)
+        server_latencies.append(client.server_latency)
+
+    client.Close()
+
+    return {
+        "round_trip_p50_us": 1e6 * statistics.median(round_trips),
+        "server_latency_p50_us": 1e6 * statistics.median(server_latencies),
+        "total_time": sum(round_trips),
+    }
+
+
+def Benchmark(
+    config: EnvironmentConfig,
+    n_clients: int,
+    envs_per_client: int,
+    n_steps: int,
+    subprocess: bool = False,
+    n_workers: Optional[int] = None,
+    max_batch_delay: float = 0.001,
+):
+    """Runs a server on a background thread and n_clients client processes on
+    a temporary Unix socket, and reports client and server side latencies."""
+    socket_path = f"/tmp/environment-server-{os.getpid()}.sock"
+    server = EnvironmentServer(
+        BuildVectorEnvironment(
+            config, n_clients * envs_per_client, subprocess, n_workers
+        ),
+        max_batch_delay=max_batch_delay,
+    )
+
+    ready = threading.Event()
+    loop = asyncio.new_event_loop()
+    server_thread = threading.Thread(
+        target=loop.run_until_complete,
+        args=(server.Serve(socket_path, ready),),
+        daemon=True,
+    )
+    server_thread.start()
+    ready.wait()
+
+    start_time = time.perf_counter()
+
+    with mp.get_context("spawn").Pool(n_clients) as pool:
+        client_results = pool.starmap(
+            RunBenchmarkClient,
+            [
+                (socket_path, envs_per_client, n_steps, seed)
+                for seed in range(n_clients)
+            ],
+        )
+
+    wall_time = time.perf_counter() - start_time
+
+    for client, result in enumerate(client_results):
+        print(
+            f"client {client}: "
+            + "  ".join(f"{key}={value:.4g}" for key, value in result.items())
+        )
+
+    print(
+        "server: "
+        + "  ".join(f"{key}={value:.4g}" for key, value in server.GetStats().items())
+        + f"  env_steps_per_second={n_clients * envs_per_client * n_steps / wall_time:.4g}"
+    )
+
+    if isinstance(server.vector_environment, SubprocessVectorEnvironment):
+        server.vector_environment.Close()
+
+    os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve environments over a Unix socket, or benchmark the server."
+    )
+    parser.add_argument("mode", choices=["serve", "benchmark"])
+    parser.add_argument("overrides", nargs="*", help="environment name=value overrides")
+    parser.add_argument("--config", default=None, help="environment .toml/.json config")
+    parser.add_argument("--socket", default="/tmp/environment-server.sock")
+    parser.add_argument("--n-envs", type=int, default=64)
+    parser.add_argument("--subprocess", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-batch-delay", type=float, default=0.001)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--envs-per-client", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.config is not None:
+        config = EnvironmentConfig.load(args.config)
+    else:
+        config = EnvironmentConfig()
+
+    config = config.override(args.overrides)
+
+    if args.mode == "benchmark":
+        Benchmark(
+            config,
+            args.clients,
+            args.envs_per_client,
+            args.steps,
+            subprocess=args.subprocess,
+            n_workers=args.workers,
+            max_batch_delay=args.max_batch_delay,
+        )
+        sys.exit()
+
+    server = EnvironmentServer(
+        BuildVectorEnvironment(config, args.n_envs, args.subprocess, args.workers),
+        max_batch_delay=args.max_batch_delay,
+    )
+
+    try:
+        asyncio.run(server.Serve(args.socket))
+    except KeyboardInterrupt:
+        print(server.GetStats(), file=sys.stderr)
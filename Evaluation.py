@@ -0,0 +1,240 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+import multiprocessing as mp
+import torch as T
+
+from ActionTable import ActionTable
+from Checkpoint import Checkpoint
+from Config import EnvironmentConfig
+from Environment import Environment
+from Track import Track
+from VectorEnvironment import VectorEnvironment
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+
+def InitializeWorker():
+    T.set_num_threads(1)
+    T.set_num_interop_threads(1)
+
+
+def EvaluateTrack(
+    checkpoint_dir: str,
+    config: EnvironmentConfig,
+    n_spawns: int,
+    n_laps: int,
+    max_time: float,
+) -> Dict[str, Any]:
+    """Runs one greedy episode per spawn, evenly spaced along the track and
+    starting at the goal line, in a vector environment. An episode ends when
+    the car crashes, completes n_laps or runs out of time."""
+    start_time = time.perf_counter()
+
+    agent_config, network, observation_pipeline = Checkpoint.load_policy(
+        checkpoint_dir, n_envs=n_spawns, dtype=config.torch_dtype, device=config.device
+    )
+    network_dtype = next(network.parameters()).dtype
+    action_table = ActionTable.FromConfig(
+        agent_config, dtype=config.torch_dtype, device=config.device
+    )
+
+    if config.n_rays + 1 != observation_pipeline.observation_size:
+        raise ValueError(
+            f"The policy observes {observation_pipeline.observation_size - 1} rays "
+            f"but the environment config has n_rays={config.n_rays}"
+        )
+
+    vector_environment = VectorEnvironment(
+        [Environment.FromConfig(config) for _ in range(n_spawns)], auto_reset=False
+    )
+    track = vector_environment.environments[0].track
+    n_gates = track.gate_lines.size(0)
+    step_time = config.dt * config.frame_skip
+
+    n_points = track.points.size(0)
+    start_indices = [spawn * n_points // n_spawns for spawn in range(n_spawns)]
+
+    observations, _ = vector_environment.Reset(start_indices)
+    states = observation_pipeline.Reset(observations)
+
+    environments = vector_environment.environments
+    episode_steps = [0] * n_spawns
+    active = T.ones((n_spawns,), dtype=T.bool)
+
+    lap_times = []
+    crashes = []
+    n_completed = 0
+    n_wrong_way = 0
+    n_steps = 0
+    max_steps = round(max_time / step_time)
+
+    while T.any(active):
+        with T.no_grad():
+            action_indices = T.argmax(network(states.to(network_dtype)), dim=1)
+
+        wheel_angles, accelerations = action_table(action_indices)
+
+        for _ in range(observation_pipeline.action_repeat):
+            env_indices = vector_environment.GetEnvIndices(active)
+
+            if len(env_indices) == 0:
+                break
+
+            observations, _, crashed = vector_environment.Step(
+                wheel_angles, accelerations, env_mask=active
+            )
+            n_steps += len(env_indices)
+
+            for env_index in env_indices:
+                info = environments[env_index].GetInfo()
+                episode_steps[env_index] += 1
+
+                if crashed[env_index]:
+                    position = environments[env_index].car.car_position
+                    crashes.append(
+                        {
+                            "spawn": start_indices[env_index],
+                            "position": [float(position[0]), float(position[1])],
+                            "track_fraction": ((info["next_gate"] - 1) % n_gates)
+                            / n_gates,
+                            "time": info["time"],
+                        }
+                    )
+
+                # Laps are counted from the spawn, which is not always the goal line.
+                elif info["gates_passed"] >= n_laps * n_gates:
+                    lap_times.append(info["time"] / n_laps)
+                    n_completed += 1
+
+                elif episode_steps[env_index] < max_steps:
+                    continue
+
+                n_wrong_way += info["wrong_way"]
+                active[env_index] = False
+
+        states = observation_pipeline.Process(observations)
+
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        "track_name": config.track_name,
+        "n_episodes": n_spawns,
+        "completion_rate": n_completed / n_spawns,
+        "crash_rate": len(crashes) / n_spawns,
+        "wrong_way_rate": n_wrong_way / n_spawns,
+        "lap_times": lap_times,
+        "mean_lap_time": statistics.fmean(lap_times) if lap_times else None,
+        "best_lap_time": min(lap_times, default=None),
+        "crashes": crashes,
+        "n_steps": n_steps,
+        "steps_per_second": n_steps / wall_time,
+        "wall_time": wall_time,
+    }
+
+
+def Evaluate(
+    checkpoint_dir: str,
+    config: EnvironmentConfig,
+    track_names: Optional[List[str]] = None,
+    n_spawns: int = 8,
+    n_laps: int = 1,
+    max_time: float = 120.0,
+    n_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    if track_names is None:
+        track_names = Track.GetNames()
+
+    config = config.replace(render=False, visualize_vision=False, random_spawn=False)
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        n_workers, mp_context=mp.get_context("spawn"), initializer=InitializeWorker
+    ) as executor:
+        track_results = list(
+            executor.map(
+                EvaluateTrack,
+                [checkpoint_dir] * len(track_names),
+                [config.replace(track_name=track_name) for track_name in track_names],
+                [n_spawns] * len(track_names),
+                [n_laps] * len(track_names),
+                [max_time] * len(track_names),
+            )
+        )
+
+    wall_time = time.perf_counter() - start_time
+    n_steps = sum(result["n_steps"] for result in track_results)
+
+    return {
+        "checkpoint_dir": checkpoint_dir,
+        "completion_rate": statistics.fmean(
+            result["completion_rate"] for result in track_results
+        ),
+        "n_steps": n_steps,
+        "steps_per_second": n_steps / wall_time,
+        "wall_time": wall_time,
+        "tracks": track_results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate a policy checkpoint greedily on every track."
+    )
+    parser.add_argument("checkpoint_dir")
+    parser.add_argument("overrides", nargs="*", help="environment name=value overrides")
+    parser.add_argument("--config", default=None, help="environment .toml/.json config")
+    parser.add_argument("--tracks", nargs="*", default=None)
+    parser.add_argument("--spawns", type=int, default=8)
+    parser.add_argument("--laps", type=int, default=1)
+    parser.add_argument("--max-time", type=float, default=120.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="write the full results as JSON")
+    args = parser.parse_args()
+
+    # The environment the checkpoint was trained in, unless --config replaces it.
+    if args.config is not None:
+        config = EnvironmentConfig.load(args.config)
+    else:
+        config = Checkpoint.load_environment_config(args.checkpoint_dir)
+
+        if config is None:
+            print(
+                "The checkpoint has no environment_config.json, evaluating in the "
+                "default environment",
+                file=sys.stderr,
+            )
+            config = EnvironmentConfig()
+
+    results = Evaluate(
+        args.checkpoint_dir,
+        config.override(args.overrides),
+        track_names=args.tracks,
+        n_spawns=args.spawns,
+        n_laps=args.laps,
+        max_time=args.max_time,
+        n_workers=args.workers,
+    )
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    for result in results["tracks"]:
+        mean_lap_time = result["mean_lap_time"]
+
+        print(
+            f"{result['track_name']:>10}: completed {result['completion_rate']:6.1%}, "
+            f"crashed {result['crash_rate']:6.1%}, mean lap "
+            + (f"{mean_lap_time:7.2f}s" if mean_lap_time is not None else "      -")
+            + f", {result['steps_per_second']:8.0f} steps/s"
+        )
+
+    print(
+        f"{'total':>10}: completed {results['completion_rate']:6.1%}, "
+        f"{results['n_steps']} steps in {results['wall_time']:.2f}s "
+        f"({results['steps_per_second']:.0f} steps/s)",
+        file=sys.stderr,
+    )
@@ -0,0 +1,112 @@
+import torch as T
+
+from Track import Track
+from typing import Any, Dict, List, Optional
+
+
+class GateTracker:
+    def __init__(self, track: Track, n_lookahead: int = 2):
+        self.gates = track.gate_lines.tolist()
+        self.n_gates = len(self.gates)
+        self.n_lookahead = n_lookahead
+
+        # Sign of the cross product between a gate and a forward motion through
+        # it, which depends on whether the track runs clockwise.
+        directions = T.roll(track.points, -1, 0) - track.points
+        self.gate_signs = T.sign(
+            track.gate_lines[:, 0, 1] * directions[:, 1]
+            - track.gate_lines[:, 1, 1] * directions[:, 0]
+        ).tolist()
+
+        self.Reset()
+
+    def Reset(self, start_index: int = 0):
+        self.next_gate = (start_index + 1) % self.n_gates
+        self.gates_passed = 0
+        self.max_gates_passed = 0
+        self.gates_delta = 0
+
+        self.time = 0.0
+        self.lap_start_time: Optional[float] = 0.0 if start_index == 0 else None
+        self.lap_times: List[float] = []
+        self.wrong_way = False
+
+    def Update(self, previous_position: T.Tensor, position: T.Tensor, dt: float) -> int:
+        """Tests the motion segment against the last passed gate and the next
+        n_lookahead gates only, and returns the signed number of gates passed.
+        With so few gates plain float math is much cheaper than tensor ops."""
+        px, py = previous_position.tolist()
+        qx, qy = position.tolist()
+        mx, my = qx - px, qy - py
+
+        crossings = []
+
+        for offset in range(-1, self.n_lookahead):
+            gate = (self.next_gate + offset) % self.n_gates
+            (ax, gx), (ay, gy) = self.gates[gate]
+
+            denominator = mx * gy - my * gx
+
+            if denominator == 0.0:
+                continue
+
+            # Solves previous_position + t * motion = gate start + u * gate.
+            t = ((ax - px) * gy - (ay - py) * gx) / denominator
+            u = ((ax - px) * my - (ay - py) * mx) / denominator
+
+            if 0.0 <= t < 1.0 and 0.0 <= u < 1.0:
+                is_forward = -denominator * self.gate_signs[gate] > 0.0
+                crossings.append((t, offset, gate, is_forward))
+
+        self.gates_delta = 0
+
+        for t, offset, gate, is_forward in sorted(crossings):
+            if is_forward and offset >= 0:
+                self.PassGates(gate, self.time + t * dt)
+
+            elif not is_forward and gate == (self.next_gate - 1) % self.n_gates:
+                self.next_gate = gate
+                self.gates_passed -= 1
+                self.gates_delta -= 1
+                self.wrong_way = True
+
+        self.time += dt
+
+        return self.gates_delta
+
+    def PassGates(self, gate: int, crossing_time: float):
+        n_passed = (gate - self.next_gate) % self.n_gates + 1
+
+        self.next_gate = (gate + 1) % self.n_gates
+        self.gates_passed += n_passed
+        self.gates_delta += n_passed
+        self.wrong_way = False
+
+        # Laps only count on new ground, so backing over the goal line and
+        # crossing it again does not complete one.
+        if self.gates_passed <= self.max_gates_passed:
+            return
+
+        self.max_gates_passed = self.gates_passed
+
+        if gate == 0:
+            if self.lap_start_time is not None:
+                self.lap_times.append(crossing_time - self.lap_start_time)
+
+            self.lap_start_time = crossing_time
+
+    def GetInfo(self) -> Dict[str, Any]:
+        return {
+            "next_gate": self.next_gate,
+            "gates_passed": self.gates_passed,
+            "laps": len(self.lap_times),
+            "lap_time": (
+                self.time - self.lap_start_time
+                if self.lap_start_time is not None
+                else None
+            ),
+            "last_lap_time": self.lap_times[-1] if self.lap_times else None,
+            "best_lap_time": min(self.lap_times, default=None),
+            "wrong_way": self.wrong_way,
+            "time": self.time,
+        }
@@ -0,0 +1,228 @@
+import numpy as np
+import torch as T
+
+from Car import Car
+from ActionTable import ActionTable
+from Cars.RaceCar import RaceCar
+from Config import AgentConfig, EnvironmentConfig
+from Environment import Environment
+from VectorEnvironment import SubprocessVectorEnvironment, VectorEnvironment
+from typing import Any, Dict, Optional, Tuple, Union
+
+# Gymnasium only provides the base classes and spaces, the wrappers follow its
+# API without it.
+try:
+    import gymnasium
+    from gymnasium import spaces
+except ImportError:
+    gymnasium = None
+    spaces = None
+
+
+def GetObservationBounds(car: Car) -> Tuple[np.ndarray, np.ndarray]:
+    """Ray depths are fractions of the ray ranges, the speed is signed."""
+    max_speed = float(car.max_speed)
+    dtype = T.empty((), dtype=car.dtype).numpy().dtype
+
+    low = np.array([0.0] * car.n_rays + [-max_speed], dtype=dtype)
+    high = np.array([1.0] * car.n_rays + [max_speed], dtype=dtype)
+
+    return low, high
+
+
+class GymEnvironment(gymnasium.Env if gymnasium is not None else object):
+    """Gymnasium style Env around an Environment, with the discrete actions of
+    an ActionTable. Crashes terminate episodes and the environment's time
+    limit truncates them. Observations are NumPy views of the car's
+    observation, and infos hold the gate progress of GetInfo."""
+
+    metadata = {"render_modes": []}
+
+    def __init__(self, environment: Environment, action_table: ActionTable):
+        self.environment = environment
+        self.action_table = action_table
+        self.action_table.Validate(environment.control_range)
+
+        self.observation_low, self.observation_high = GetObservationBounds(
+            environment.car
+        )
+
+        if spaces is not None:
+            self.observation_space = spaces.Box(
+                self.observation_low,
+                self.observation_high,
+                dtype=self.observation_low.dtype,
+            )
+            self.action_space = spaces.Discrete(action_table.n_actions)
+
+    @staticmethod
+    def FromConfig(
+        config: EnvironmentConfig, agent_config: AgentConfig, env_index: int = 0
+    ) -> "GymEnvironment":
+        return GymEnvironment(
+            Environment.FromConfig(config, env_index),
+            ActionTable.FromConfig(
+                agent_config, dtype=config.torch_dtype, device=config.device
+            ),
+        )
+
+    def GetInfo(self) -> Dict[str, Any]:
+        return {
+            **self.environment.GetInfo(),
+            "episode_steps": self.environment.episode_steps,
+        }
+
+    def reset(
+        self, *, seed: Optional[int] = None, options: Optional[Dict[str, Any]] = None
+    ) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Restarts the spawn stream from seed, if given, and spawns at
+        options["start_index"], if given."""
+        if seed is not None:
+            self.environment.Seed(seed)
+
+        start_index = None if options is None else options.get("start_index")
+        observation, _ = self.environment.Reset(start_index)
+
+        return observation.cpu().numpy(), self.GetInfo()
+
+    def step(
+        self, action: Union[int, np.integer]
+    ) -> Tuple[np.ndarray, float, bool, bool, Dict[str, Any]]:
+        wheel_angle, acceleration = self.action_table(int(action))
+        observation, reward, crashed = self.environment.Step(wheel_angle, acceleration)
+
+        terminated = bool(crashed)
+        truncated = self.environment.IsTruncated() and not terminated
+
+        return (
+            observation.cpu().numpy(),
+            float(reward),
+            terminated,
+            truncated,
+            self.GetInfo(),
+        )
+
+    def close(self):
+        pass
+
+
+class GymVectorEnvironment(
+    gymnasium.vector.VectorEnv if gymnasium is not None else object
+):
+    """Gymnasium style VectorEnv around a VectorEnvironment or a
+    SubprocessVectorEnvironment, which auto reset ended environments in the
+    same step. Their last observations are in infos["final_obs"], masked by
+    infos["_final_obs"]. The returned arrays are NumPy views of the vector
+    environment's buffers, made once, so steps convert nothing. They are
+    overwritten by the next step unless copy is set."""
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": (
+            gymnasium.vector.AutoresetMode.SAME_STEP
+            if hasattr(getattr(gymnasium, "vector", None), "AutoresetMode")
+            else "SameStep"
+        ),
+    }
+
+    def __init__(
+        self,
+        vector_environment: Union[VectorEnvironment, SubprocessVectorEnvironment],
+        action_table: ActionTable,
+        observation_bounds: Tuple[np.ndarray, np.ndarray],
+        copy: bool = True,
+    ):
+        if not vector_environment.auto_reset:
+            raise ValueError("GymVectorEnvironment needs an auto resetting vector")
+
+        self.vector_environment = vector_environment
+        self.action_table = action_table
+        self.num_envs = vector_environment.n_envs
+        self.copy = copy
+
+        self.observations = vector_environment.observations.numpy()
+        self.final_observations = vector_environment.final_observations.numpy()
+        self.rewards = vector_environment.rewards.numpy()
+        self.terminated = vector_environment.crashed.numpy()
+        self.truncated = vector_environment.truncated.numpy()
+        self.ended = np.zeros((self.num_envs,), dtype=bool)
+
+        self.observation_low, self.observation_high = observation_bounds
+
+        if spaces is not None:
+            self.single_observation_space = spaces.Box(
+                self.observation_low,
+                self.observation_high,
+                dtype=self.observation_low.dtype,
+            )
+            self.single_action_space = spaces.Discrete(action_table.n_actions)
+            self.observation_space = gymnasium.vector.utils.batch_space(
+                self.single_observation_space, self.num_envs
+            )
+            self.action_space = gymnasium.vector.utils.batch_space(
+                self.single_action_space, self.num_envs
+            )
+
+    @staticmethod
+    def FromConfig(
+        config: EnvironmentConfig,
+        agent_config: AgentConfig,
+        n_envs: Optional[int] = None,
+        subprocess: bool = False,
+        n_workers: Optional[int] = None,
+        copy: bool = True,
+    ) -> "GymVectorEnvironment":
+        """Simulates on the cpu, which the buffers have to live on."""
+        config = config.replace(render=False, visualize_vision=False, device="cpu")
+
+        if subprocess:
+            vector_environment = SubprocessVectorEnvironment(
+                config, n_envs=n_envs, n_workers=n_workers
+            )
+        else:
+            vector_environment = VectorEnvironment.FromConfig(config, n_envs=n_envs)
+
+        return GymVectorEnvironment(
+            vector_environment,
+            ActionTable.FromConfig(agent_config, dtype=config.torch_dtype),
+            GetObservationBounds(
+                RaceCar(config.torch_dtype, "cpu", n_rays=config.n_rays)
+            ),
+            copy=copy,
+        )
+
+    def Output(self, array: np.ndarray) -> np.ndarray:
+        return array.copy() if self.copy else array
+
+    def reset(
+        self, *, seed: Optional[int] = None, options: Optional[Dict[str, Any]] = None
+    ) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Resets every environment, restarting their spawn streams from the
+        root seed if given, at options["start_indices"] if given."""
+        start_indices = None if options is None else options.get("start_indices")
+        self.vector_environment.Reset(start_indices, seed=seed)
+
+        return self.Output(self.observations), {}
+
+    def step(
+        self, actions: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+        wheel_angles, accelerations = self.action_table(T.as_tensor(actions))
+        self.vector_environment.Step(wheel_angles, accelerations)
+
+        np.logical_or(self.terminated, self.truncated, out=self.ended)
+
+        return (
+            self.Output(self.observations),
+            self.Output(self.rewards),
+            self.Output(self.terminated),
+            self.Output(self.truncated),
+            {
+                "final_obs": self.Output(self.final_observations),
+                "_final_obs": self.Output(self.ended),
+            },
+        )
+
+    def close(self, **kwargs: Any):
+        if isinstance(self.vector_environment, SubprocessVectorEnvironment):
+            self.vector_environment.Close()
@@ -88,6 +88,36 @@ class LinAlg:
 
         return depths
 
+    @staticmethod
+    def get_truncated_depth_candidates(
+        lines_0: T.Tensor, candidate_lines: T.Tensor, valid_mask: T.Tensor
+    ) -> T.Tensor:
+        """get_truncated_depth against (n, k, 2, 2) candidate lines per line of
+        lines_0, of which only the valid_mask ones count. Solves the 2x2
+        systems elementwise in the same order as safe_inverse and the matmul,
+        which gives the same depths with far fewer ops."""
+        a_0 = lines_0[:, None, :, 0]
+        d_0 = lines_0[:, None, :, 1]
+        d_1 = candidate_lines[..., 1]
+        rhs = candidate_lines[..., 0] + d_1 - a_0
+
+        determinant = d_0[..., 0] * d_1[..., 1] - d_1[..., 0] * d_0[..., 1]
+
+        ts_0 = (d_1[..., 1] / determinant) * rhs[..., 0] + (
+            -d_1[..., 0] / determinant
+        ) * rhs[..., 1]
+        ts_1 = (-d_0[..., 1] / determinant) * rhs[..., 0] + (
+            d_0[..., 0] / determinant
+        ) * rhs[..., 1]
+
+        intersecting_mask = (
+            valid_mask & (ts_0 >= 0.0) & (ts_0 < 1.0) & (ts_1 >= 0.0) & (ts_1 < 1.0)
+        )
+
+        depths = T.min(T.where(intersecting_mask, ts_0, 1.0), dim=-1)[0]
+
+        return depths
+
     @staticmethod
     def get_intersection_points(lines_0: T.Tensor, lines_1: T.Tensor) -> T.Tensor:
         lines_0, lines_1 = LinAlg.get_lines_mesh(lines_0, lines_1)
@@ -0,0 +1,24 @@
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class DuelingDQN(nn.Module):
+    def __init__(self, n_observations, n_actions) -> None:
+        super(DuelingDQN, self).__init__()
+        self.fc1 = nn.Linear(n_observations, 128)
+        self.fc2 = nn.Linear(128, 128)
+
+        self.value_fc = nn.Linear(128, 64)
+        self.value = nn.Linear(64, 1)
+
+        self.advantage_fc = nn.Linear(128, 64)
+        self.advantage = nn.Linear(64, n_actions)
+
+    def forward(self, x):
+        x = F.relu(self.fc1(x))
+        x = F.relu(self.fc2(x))
+
+        value = self.value(F.relu(self.value_fc(x)))
+        advantage = self.advantage(F.relu(self.advantage_fc(x)))
+
+        return value + advantage - advantage.mean(dim=-1, keepdim=True)
@@ -0,0 +1,79 @@
+import torch as T
+import torch.nn as nn
+
+from copy import deepcopy
+from torch.func import functional_call, vmap
+
+
+class TargetComputer:
+    """Computes one-step (double) DQN targets and keeps the target network in
+    sync with the online network.
+
+    The parameters of both networks are stored as the two halves of stacked
+    tensors, so the optimizer and target syncs update them in place and double
+    DQN can evaluate both networks on next_state in one vmapped forward pass.
+    """
+
+    def __init__(
+        self,
+        online_network: nn.Module,
+        target_network: nn.Module,
+        gamma: float,
+        double_dqn: bool = False,
+    ):
+        self.online_network = online_network
+        self.target_network = target_network
+
+        self.gamma = gamma
+        self.double_dqn = double_dqn
+
+        self.online_parameters = list(online_network.parameters())
+        self.target_parameters = list(target_network.parameters())
+
+        self.stacked_parameters = {}
+
+        for (name, online_parameter), target_parameter in zip(
+            online_network.named_parameters(), self.target_parameters
+        ):
+            stacked_parameter = T.stack(
+                (online_parameter.detach(), target_parameter.detach())
+            )
+
+            online_parameter.data = stacked_parameter[0]
+            target_parameter.data = stacked_parameter[1]
+
+            self.stacked_parameters[name] = stacked_parameter
+
+        for target_parameter in self.target_parameters:
+            target_parameter.requires_grad_(False)
+
+        self.base_network = deepcopy(online_network).to("meta")
+        self.stacked_forward = vmap(
+            lambda parameters, x: functional_call(self.base_network, parameters, (x,)),
+            in_dims=(0, None),
+        )
+
+    @T.no_grad()
+    def SyncTarget(self, tau: float = 1.0):
+        if tau >= 1.0:
+            T._foreach_copy_(self.target_parameters, self.online_parameters)
+        else:
+            T._foreach_lerp_(self.target_parameters, self.online_parameters, tau)
+
+    @T.no_grad()
+    def GetNextValues(self, next_states: T.Tensor) -> T.Tensor:
+        if not self.double_dqn:
+            return T.amax(self.target_network(next_states), dim=-1)
+
+        online_q_values, target_q_values = self.stacked_forward(
+            self.stacked_parameters, next_states
+        )
+        next_actions = T.argmax(online_q_values, dim=-1, keepdim=True)
+
+        return T.gather(target_q_values, -1, next_actions)[..., 0]
+
+    @T.no_grad()
+    def __call__(
+        self, rewards: T.Tensor, next_states: T.Tensor, dones: T.Tensor
+    ) -> T.Tensor:
+        return rewards + self.gamma * (~dones) * self.GetNextValues(next_states)
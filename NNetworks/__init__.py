@@ -0,0 +1,4 @@
+from .TestDQN import TestDQN
+from .DuelingDQN import DuelingDQN
+
+NETWORKS = {"test": TestDQN, "dueling": DuelingDQN}
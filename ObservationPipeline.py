@@ -0,0 +1,207 @@
+import torch as T
+from typing import Any, Dict, Optional, Tuple
+
+
+class RunningNormalizer:
+    def __init__(
+        self,
+        size: int,
+        epsilon: float = 1e-8,
+        clip: float = 10.0,
+        dtype: T.dtype = T.float64,
+        device: str = "cpu",
+    ):
+        self.size = size
+        self.epsilon = epsilon
+        self.clip = clip
+
+        self.dtype = dtype
+        self.device = device
+
+        self.count = T.zeros((), dtype=dtype, device=device)
+        self.mean = T.zeros((size,), dtype=dtype, device=device)
+        self.m2 = T.zeros((size,), dtype=dtype, device=device)
+        self.std = T.ones((size,), dtype=dtype, device=device)
+
+    def Update(self, observations: T.Tensor):
+        """Merges the statistics of a (batch, size) tensor into the running ones
+        (Chan et al.'s parallel form of Welford's algorithm)."""
+        batch_count = observations.size(0)
+        batch_mean = T.mean(observations, dim=0)
+        batch_m2 = T.sum((observations - batch_mean[None]) ** 2, dim=0)
+
+        total_count = self.count + batch_count
+        delta = batch_mean - self.mean
+
+        self.mean.add_(delta * (batch_count / total_count))
+        self.m2.add_(batch_m2 + delta**2 * (self.count * batch_count / total_count))
+        self.count.copy_(total_count)
+
+        T.sqrt(self.m2 / T.clamp(self.count, min=1.0) + self.epsilon, out=self.std)
+
+    def Normalize(self, observations: T.Tensor, out: Optional[T.Tensor] = None):
+        out = T.sub(observations, self.mean, out=out)
+        out.div_(self.std)
+
+        return out.clamp_(-self.clip, self.clip)
+
+    def state_dict(self) -> Dict[str, T.Tensor]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    def load_state_dict(self, state_dict: Dict[str, T.Tensor]):
+        self.count.copy_(state_dict["count"])
+        self.mean.copy_(state_dict["mean"])
+        self.m2.copy_(state_dict["m2"])
+
+        T.sqrt(self.m2 / T.clamp(self.count, min=1.0) + self.epsilon, out=self.std)
+
+
+class FrameStack:
+    def __init__(
+        self,
+        n_envs: int,
+        n_frames: int,
+        size: int,
+        dtype: T.dtype = T.float64,
+        device: str = "cpu",
+    ):
+        self.n_envs = n_envs
+        self.n_frames = n_frames
+        self.size = size
+
+        self.frames = T.zeros((n_envs, n_frames, size), dtype=dtype, device=device)
+        self.stacked = T.zeros((n_envs, n_frames, size), dtype=dtype, device=device)
+        self.head = 0
+
+        # Oldest-to-newest frame order for every possible ring buffer head.
+        self.orders = T.stack(
+            [
+                T.remainder(T.arange(1, n_frames + 1, device=device) + head, n_frames)
+                for head in range(n_frames)
+            ]
+        )
+
+    def Reset(self, observations: T.Tensor, env_mask: Optional[T.Tensor] = None):
+        if env_mask is None:
+            self.frames.copy_(observations[:, None].expand_as(self.frames))
+        else:
+            self.frames[env_mask] = observations[env_mask][:, None]
+
+    def Push(self, observations: T.Tensor) -> T.Tensor:
+        self.head = (self.head + 1) % self.n_frames
+        self.frames[:, self.head] = observations
+
+        return self.Get()
+
+    def Get(self) -> T.Tensor:
+        """Returns the stacked frames in a reused buffer, clone it to keep it."""
+        T.index_select(self.frames, 1, self.orders[self.head], out=self.stacked)
+
+        return self.stacked.view(self.n_envs, self.n_frames * self.size)
+
+
+class ObservationPipeline:
+    def __init__(
+        self,
+        observation_size: int,
+        n_envs: int = 1,
+        n_frames: int = 1,
+        action_repeat: int = 1,
+        normalize: bool = True,
+        clip: float = 10.0,
+        dtype: T.dtype = T.float64,
+        device: str = "cpu",
+    ):
+        self.observation_size = observation_size
+        self.output_size = observation_size * n_frames
+
+        self.n_envs = n_envs
+        self.n_frames = n_frames
+        self.action_repeat = action_repeat
+        self.normalize = normalize
+        self.training = True
+
+        self.normalizer = RunningNormalizer(
+            observation_size, clip=clip, dtype=dtype, device=device
+        )
+        self.frame_stack = FrameStack(
+            n_envs, n_frames, observation_size, dtype=dtype, device=device
+        )
+        self.normalized = T.zeros(
+            (n_envs, observation_size), dtype=dtype, device=device
+        )
+
+    def Prepare(
+        self, observations: T.Tensor, env_mask: Optional[T.Tensor] = None
+    ) -> T.Tensor:
+        """Normalizes the observations of every environment, updating the
+        statistics with those of env_mask only, if given, as the others were
+        already counted."""
+        observations = observations.view(self.n_envs, self.observation_size)
+
+        if not self.normalize:
+            return observations
+
+        if self.training:
+            if env_mask is None:
+                self.normalizer.Update(observations)
+            elif T.any(env_mask):
+                self.normalizer.Update(observations[env_mask])
+
+        return self.normalizer.Normalize(observations, out=self.normalized)
+
+    def Output(self, observations: T.Tensor, is_batched: bool) -> T.Tensor:
+        return observations if is_batched else observations[0]
+
+    def Reset(
+        self, observations: T.Tensor, env_mask: Optional[T.Tensor] = None
+    ) -> T.Tensor:
+        is_batched = observations.dim() == 2
+
+        self.frame_stack.Reset(self.Prepare(observations, env_mask), env_mask)
+
+        return self.Output(self.frame_stack.Get(), is_batched)
+
+    def Process(self, observations: T.Tensor) -> T.Tensor:
+        is_batched = observations.dim() == 2
+
+        return self.Output(self.frame_stack.Push(self.Prepare(observations)), is_batched)
+
+    def Step(self, environment: Any, *actions) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        """Repeats the actions on the environment ``action_repeat`` times, summing
+        the rewards until the episode ends, and returns the processed observation."""
+        observation, reward_sum, done = environment.Step(*actions)
+
+        for _ in range(self.action_repeat - 1):
+            if T.all(done):
+                break
+
+            observation, reward, crashed = environment.Step(*actions)
+            reward_sum = reward_sum + reward * ~done
+            done = done | crashed
+
+        return self.Process(observation), reward_sum, done
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "observation_size": self.observation_size,
+            "n_frames": self.n_frames,
+            "action_repeat": self.action_repeat,
+            "normalize": self.normalize,
+            "normalizer": self.normalizer.state_dict(),
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        if (
+            state_dict["observation_size"] != self.observation_size
+            or state_dict["n_frames"] != self.n_frames
+        ):
+            raise ValueError(
+                f"Observation pipeline state is for {state_dict['n_frames']} frames of "
+                f"size {state_dict['observation_size']}, not {self.n_frames} frames "
+                f"of size {self.observation_size}"
+            )
+
+        self.action_repeat = state_dict["action_repeat"]
+        self.normalize = state_dict["normalize"]
+        self.normalizer.load_state_dict(state_dict["normalizer"])
@@ -1,22 +1,611 @@
-from collections import deque, namedtuple
-import random
+import os
+import math
+import json
+import numpy as np
+import torch as T
+from collections import namedtuple
+from typing import Any, Dict, Optional
 
 
-Transition = namedtuple("Transition", ("state", "action", "next_state", "reward"))
+Transition = namedtuple(
+    "Transition", ("state", "action", "next_state", "reward", "done")
+)
 
-test = Transition("state0", "action0", "next_state0", "reward0")
+
+def save_array(
+    file_path: str, array: np.ndarray, dirty_chunks: np.ndarray, chunk_size: int
+):
+    if os.path.exists(file_path):
+        saved_array = np.load(file_path, mmap_mode="r+")
+    else:
+        saved_array = np.lib.format.open_memmap(
+            file_path, mode="w+", dtype=array.dtype, shape=array.shape
+        )
+
+    for chunk in np.flatnonzero(dirty_chunks):
+        chunk_slice = slice(chunk * chunk_size, (chunk + 1) * chunk_size)
+        saved_array[chunk_slice] = array[chunk_slice]
+
+    saved_array.flush()
+    del saved_array
+
+
+def mark_dirty(
+    dirty_chunks: np.ndarray, start: int, n: int, capacity: int, chunk_size: int
+):
+    """Marks the chunks of the ring buffer indices start, ..., start + n - 1."""
+    end = start + n
+    dirty_chunks[start // chunk_size : (min(end, capacity) - 1) // chunk_size + 1] = True
+
+    if end > capacity:
+        dirty_chunks[: (end - capacity - 1) // chunk_size + 1] = True
+
+
+def load_array(file_path: str) -> T.Tensor:
+    return T.from_numpy(np.load(file_path, mmap_mode="c"))
 
 
 class ReplayMemory(object):
-    def __init__(self, capacity) -> None:
-        self.memory = deque([], maxlen=capacity)
+    def __init__(
+        self,
+        capacity,
+        chunk_size: int = 4096,
+        n_step: int = 1,
+        gamma: float = 0.99,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.n_chunks = (capacity + chunk_size - 1) // chunk_size
+
+        self.storage: Optional[Dict[str, T.Tensor]] = None
+        self.position = 0
+        self.size = 0
+
+        # Batches are sampled from the memory's own stream, saved with it.
+        self.rng = np.random.default_rng(seed)
+
+        # Transitions are stored with the discounted reward of n_step steps and
+        # the state n_step steps later, so targets bootstrap with gamma**n_step.
+        self.n_step = n_step
+        self.gamma = gamma
+
+        # discounts[j, i] = gamma**(i - j) for i >= j, so window_rewards @
+        # discounts.T holds the return from every start in the window.
+        steps = T.arange(n_step)
+        self.discounts = T.where(
+            steps[None] >= steps[:, None],
+            gamma ** (steps[None] - steps[:, None]).double(),
+            0.0,
+        )
+
+        # Last n_step (state, action, reward) of every environment, oldest
+        # first and right aligned, window_counts of them valid.
+        self.window_states: Optional[T.Tensor] = None
+        self.window_actions: Optional[T.Tensor] = None
+        self.window_rewards: Optional[T.Tensor] = None
+        self.window_counts: Optional[T.Tensor] = None
+
+        # Chunks written since the last save to save_dir.
+        self.dirty_chunks = np.zeros(self.n_chunks, dtype=bool)
+        self.save_dir: Optional[str] = None
+
+    def allocate(self, state: T.Tensor):
+        self.storage = {
+            "state": T.zeros((self.capacity, *state.shape), dtype=state.dtype),
+            "action": T.zeros((self.capacity,), dtype=T.long),
+            "next_state": T.zeros((self.capacity, *state.shape), dtype=state.dtype),
+            "reward": T.zeros((self.capacity,), dtype=state.dtype),
+            "done": T.zeros((self.capacity,), dtype=T.bool),
+        }
+
+    def allocate_windows(self, states: T.Tensor):
+        n_envs = states.size(0)
+
+        self.window_states = T.zeros(
+            (n_envs, self.n_step, *states.shape[1:]), dtype=states.dtype
+        )
+        self.window_actions = T.zeros((n_envs, self.n_step), dtype=T.long)
+        self.window_rewards = T.zeros((n_envs, self.n_step), dtype=states.dtype)
+        self.window_counts = T.zeros((n_envs,), dtype=T.long)
+
+        self.discounts = self.discounts.to(states.dtype)
+
+    def push(self, state, action, next_state, reward, done=None):
+        """Save a transition, terminal transitions may pass next_state=None"""
+        if done is None:
+            done = next_state is None
+
+        if next_state is None:
+            next_state = state
+
+        self.push_batch(
+            state[None],
+            T.as_tensor([action]),
+            next_state[None],
+            T.as_tensor(reward, dtype=state.dtype).reshape(1),
+            T.as_tensor([bool(done)]),
+        )
+
+    def push_batch(
+        self,
+        states: T.Tensor,
+        actions: T.Tensor,
+        next_states: T.Tensor,
+        rewards: T.Tensor,
+        dones: T.Tensor,
+    ):
+        """Pushes one step of (n_envs, ...) transitions from parallel
+        environments. Every environment keeps a window of its last n_step
+        steps, the oldest of which is stored once the window is full. When an
+        episode ends its whole window is stored as terminal transitions with
+        the rewards up to the end."""
+        if self.window_states is None:
+            self.allocate_windows(states)
+
+        if states.size(0) != self.window_states.size(0):
+            raise ValueError(
+                f"Replay memory was used with {self.window_states.size(0)} "
+                f"environments, not {states.size(0)}"
+            )
+
+        rewards = rewards.to(self.window_rewards.dtype)
+        dones = dones.to(T.bool)
+
+        self.window_states[:, :-1] = self.window_states[:, 1:].clone()
+        self.window_actions[:, :-1] = self.window_actions[:, 1:].clone()
+        self.window_rewards[:, :-1] = self.window_rewards[:, 1:].clone()
+
+        self.window_states[:, -1] = states
+        self.window_actions[:, -1] = actions
+        self.window_rewards[:, -1] = rewards
+        self.window_counts = T.clamp(self.window_counts + 1, max=self.n_step)
+
+        returns = self.window_rewards @ self.discounts.T
+        valid = T.arange(self.n_step)[None] >= (self.n_step - self.window_counts)[:, None]
+
+        # Terminal environments store every valid start, the others only the
+        # oldest one of a full window.
+        stored = valid & (dones[:, None] | (T.arange(self.n_step) == 0)[None])
+        env_indices, starts = T.nonzero(stored, as_tuple=True)
+
+        if env_indices.numel() > 0:
+            self.write(
+                self.window_states[env_indices, starts],
+                self.window_actions[env_indices, starts],
+                next_states[env_indices],
+                returns[env_indices, starts],
+                dones[env_indices],
+            )
+
+        self.window_counts[dones] = 0
+        self.window_counts[~dones & (self.window_counts == self.n_step)] -= 1
+
+    def truncate(self, env_mask: Optional[T.Tensor] = None):
+        """Drops the windows of episodes that end without a terminal step, so
+        their returns do not run into the next episode."""
+        if self.window_counts is None:
+            return
+
+        if env_mask is None:
+            self.window_counts.zero_()
+        else:
+            self.window_counts[env_mask] = 0
+
+    def reserve(self, n: int) -> T.Tensor:
+        """Returns the storage indices of the next n transitions, marking their
+        chunks dirty and evicting the oldest transitions once full."""
+        indices = T.remainder(self.position + T.arange(n), self.capacity)
+        mark_dirty(self.dirty_chunks, self.position, n, self.capacity, self.chunk_size)
+
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+        return indices
+
+    def write(self, states, actions, next_states, rewards, dones):
+        if self.storage is None:
+            self.allocate(states[0])
+
+        indices = self.reserve(states.size(0))
+
+        self.storage["state"][indices] = states
+        self.storage["action"][indices] = actions
+        self.storage["next_state"][indices] = next_states
+        self.storage["reward"][indices] = rewards
+        self.storage["done"][indices] = dones
+
+    def get_indices(self, offsets) -> T.Tensor:
+        """Maps offsets from the oldest stored transition to storage indices."""
+        return T.remainder(
+            self.position - self.size + T.as_tensor(offsets), self.capacity
+        )
+
+    def sample_indices(self, batch_size) -> T.Tensor:
+        """Storage indices of batch_size distinct transitions."""
+        return self.get_indices(self.rng.choice(self.size, batch_size, replace=False))
+
+    def sample(self, batch_size) -> Transition:
+        indices = self.sample_indices(batch_size)
+
+        return Transition(
+            *(self.storage[field][indices] for field in Transition._fields)
+        )
+
+    def mark_all_dirty(self):
+        self.dirty_chunks[: (self.size + self.chunk_size - 1) // self.chunk_size] = True
+
+    def save_arrays(self, directory: str):
+        for field, values in self.storage.items():
+            save_array(
+                f"{directory}//{field}.npy",
+                values.numpy(),
+                self.dirty_chunks,
+                self.chunk_size,
+            )
+
+    def clear_dirty(self):
+        self.dirty_chunks[:] = False
+
+    def get_meta(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "chunk_size": self.chunk_size,
+            "position": self.position,
+            "size": self.size,
+            "n_step": self.n_step,
+            "gamma": self.gamma,
+            "rng_state": self.rng.bit_generator.state,
+        }
+
+    def save(self, directory: str):
+        """Writes the chunks pushed since the last save into one memory-mapped
+        .npy file per field, so only new data is written on every checkpoint."""
+        if self.storage is None:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+
+        if directory != self.save_dir or not os.path.exists(
+            f"{directory}//meta.json"
+        ):
+            self.mark_all_dirty()
+
+        self.save_arrays(directory)
+
+        # The metadata is replaced last, so an interrupted save keeps the
+        # previous position and size.
+        with open(f"{directory}//meta.json.tmp", "w") as meta_file:
+            json.dump(self.get_meta(), meta_file)
+        os.replace(f"{directory}//meta.json.tmp", f"{directory}//meta.json")
+
+        self.clear_dirty()
+        self.save_dir = directory
+
+    def load_arrays(self, directory: str, meta: Dict[str, Any]):
+        if "observation_dtype" in meta:
+            raise ValueError(
+                f"Replay memory in '{directory}' holds compact "
+                f"{meta['observation_dtype']} observations"
+            )
+
+        self.storage = {
+            field: load_array(f"{directory}//{field}.npy") for field in Transition._fields
+        }
+
+    def load(self, directory: str):
+        """Maps the saved fields copy-on-write, so pages are only read from disk
+        once they are sampled and new pushes never modify the saved files."""
+        with open(f"{directory}//meta.json") as meta_file:
+            meta = json.load(meta_file)
+
+        if meta["capacity"] != self.capacity:
+            raise ValueError(
+                f"Replay memory in '{directory}' has capacity {meta['capacity']}, "
+                f"not {self.capacity}"
+            )
+
+        if (meta.get("n_step", 1), meta.get("gamma", self.gamma)) != (
+            self.n_step,
+            self.gamma,
+        ):
+            raise ValueError(
+                f"Replay memory in '{directory}' holds {meta.get('n_step', 1)}-step "
+                f"returns with gamma {meta.get('gamma')}, not {self.n_step}-step "
+                f"returns with gamma {self.gamma}"
+            )
+
+        self.load_arrays(directory, meta)
+
+        self.chunk_size = meta["chunk_size"]
+        self.n_chunks = (self.capacity + self.chunk_size - 1) // self.chunk_size
+        self.position = meta["position"]
+        self.size = meta["size"]
+
+        if "rng_state" in meta:
+            self.rng.bit_generator.state = meta["rng_state"]
+
+        self.dirty_chunks = np.zeros(self.n_chunks, dtype=bool)
+        self.save_dir = directory
+
+    def __len__(self):
+        return self.size
+
+
+class CompactReplayMemory(ReplayMemory):
+    """Replay memory for large capacities. Observations are quantized to uint8
+    (over [observation_low, observation_high]) or float16 and written to the
+    ring in blocks of one slot per environment per push. Every transition is
+    stored at the slot of its state, with a uint8 flag, a small int action
+    and a float32 reward, and is dequantized when sampled. The next state of a
+    transition is the slot of its environment n_step blocks later, so it needs
+    no index. Terminal transitions sample their state as next state, which
+    targets ignore, and the slot of their next state holds the first state of
+    the next episode instead.
+
+    Pushed states must be the next states of the previous push for the same
+    environment, except after terminal steps or truncate."""
+
+    # Flags of the ring slots.
+    EMPTY = 0
+    TRANSITION = 1
+    TERMINAL = 2
+
+    def __init__(
+        self,
+        capacity,
+        chunk_size: int = 4096,
+        n_step: int = 1,
+        gamma: float = 0.99,
+        observation_dtype: str = "uint8",
+        observation_low: Optional[T.Tensor] = None,
+        observation_high: Optional[T.Tensor] = None,
+        action_dtype: T.dtype = T.uint8,
+        seed: Optional[int] = None,
+    ) -> None:
+        super().__init__(
+            capacity, chunk_size=chunk_size, n_step=n_step, gamma=gamma, seed=seed
+        )
+
+        if observation_dtype not in ("uint8", "float16"):
+            raise ValueError(
+                f"Observation dtype must be uint8 or float16, not {observation_dtype}"
+            )
+        if observation_dtype == "uint8" and (
+            observation_low is None or observation_high is None
+        ):
+            raise ValueError("uint8 observations need observation_low and _high")
+
+        self.observation_dtype = observation_dtype
+        self.observation_low = observation_low
+        self.observation_high = observation_high
+        self.action_dtype = action_dtype
+
+        # Slots hold transitions once their n_step window is complete, so the
+        # size counts slots and n_transitions the flagged ones.
+        self.n_envs: Optional[int] = None
+        self.n_transitions = 0
+
+        self.current_slots: Optional[T.Tensor] = None
+        self.episode_starts: Optional[T.Tensor] = None
+
+    def allocate(self, states: T.Tensor):
+        n_envs = states.size(0)
+
+        # A state slot has to outlive the n_step blocks until its transition
+        # is written.
+        if self.capacity < (self.n_step + 1) * n_envs:
+            raise ValueError(
+                f"A capacity of {self.capacity} cannot hold {self.n_step}-step "
+                f"transitions of {n_envs} environments"
+            )
+
+        self.n_envs = n_envs
+        self.storage = {
+            "observation": T.zeros(
+                (self.capacity, *states.shape[1:]),
+                dtype=getattr(T, self.observation_dtype),
+            ),
+            "flag": T.zeros((self.capacity,), dtype=T.uint8),
+            "action": T.zeros((self.capacity,), dtype=self.action_dtype),
+            "reward": T.zeros((self.capacity,), dtype=T.float32),
+        }
+        self.set_sample_dtype(states.dtype)
+
+    def set_sample_dtype(self, dtype: T.dtype):
+        self.sample_dtype = dtype
+
+        if self.observation_dtype == "uint8":
+            self.observation_low = T.as_tensor(self.observation_low, dtype=dtype)
+            self.observation_scale = (
+                T.as_tensor(self.observation_high, dtype=dtype) - self.observation_low
+            ) / 255
+
+    def allocate_windows(self, state_slots: T.Tensor):
+        n_envs = state_slots.size(0)
+
+        self.window_states = T.zeros((n_envs, self.n_step), dtype=T.long)
+        self.window_actions = T.zeros((n_envs, self.n_step), dtype=T.long)
+        self.window_rewards = T.zeros((n_envs, self.n_step), dtype=T.float32)
+        self.window_counts = T.zeros((n_envs,), dtype=T.long)
+
+        self.discounts = self.discounts.to(T.float32)
+
+    def Quantize(self, observations: T.Tensor) -> T.Tensor:
+        if self.observation_dtype == "float16":
+            return observations.to(T.float16)
+
+        return (
+            T.round((observations - self.observation_low) / self.observation_scale)
+            .clamp_(0, 255)
+            .to(T.uint8)
+        )
+
+    def Dequantize(self, observations: T.Tensor) -> T.Tensor:
+        if self.observation_dtype == "float16":
+            return observations.to(self.sample_dtype)
+
+        return self.observation_low + observations.to(
+            self.sample_dtype
+        ) * self.observation_scale
+
+    def mark_dirty_slots(self, slots: T.Tensor):
+        self.dirty_chunks[(slots // self.chunk_size).numpy()] = True
+
+    def write_block(self, observations: T.Tensor) -> T.Tensor:
+        """Writes one observation per environment to the next block of slots,
+        evicting the transitions stored there."""
+        slots = self.reserve(observations.size(0))
+
+        self.n_transitions -= int(T.count_nonzero(self.storage["flag"][slots]))
+        self.storage["flag"][slots] = self.EMPTY
+        self.storage["observation"][slots] = self.Quantize(observations)
+
+        return slots
+
+    def push_batch(
+        self,
+        states: T.Tensor,
+        actions: T.Tensor,
+        next_states: T.Tensor,
+        rewards: T.Tensor,
+        dones: T.Tensor,
+    ):
+        if self.storage is None:
+            self.allocate(states)
+
+        if states.size(0) != self.n_envs:
+            raise ValueError(
+                f"Replay memory was used with {self.n_envs} environments, not "
+                f"{states.size(0)}"
+            )
+
+        if self.current_slots is None:
+            self.current_slots = self.write_block(states)
+        elif T.any(self.episode_starts):
+            # The next states of terminal transitions are never sampled.
+            slots = self.current_slots[self.episode_starts]
+            self.storage["observation"][slots] = self.Quantize(
+                states[self.episode_starts]
+            )
+            self.mark_dirty_slots(slots)
+
+        state_slots = self.current_slots
+        self.current_slots = self.write_block(next_states)
+        self.episode_starts = dones.to(T.bool).clone()
+
+        super().push_batch(state_slots, actions, next_states, rewards, dones)
+
+    def truncate(self, env_mask: Optional[T.Tensor] = None):
+        """Also drops the last stored transition of the truncated episodes,
+        whose next state slot is reused for the first state of the next one."""
+        super().truncate(env_mask)
+
+        if self.current_slots is None:
+            return
+
+        if env_mask is None:
+            env_mask = T.ones_like(self.episode_starts)
+
+        slots = T.remainder(
+            self.current_slots[env_mask] - self.n_step * self.n_envs, self.capacity
+        )
+        slots = slots[self.storage["flag"][slots] == self.TRANSITION]
+
+        self.n_transitions -= slots.numel()
+        self.storage["flag"][slots] = self.EMPTY
+        self.mark_dirty_slots(slots)
+
+        self.episode_starts[env_mask] = True
+
+    def write(self, state_slots, actions, next_states, rewards, dones):
+        flags = self.storage["flag"]
+
+        self.n_transitions += int(T.sum(flags[state_slots] == self.EMPTY))
+        flags[state_slots] = T.where(
+            dones, self.TERMINAL, self.TRANSITION
+        ).to(T.uint8)
+        self.storage["action"][state_slots] = actions.to(self.action_dtype)
+        self.storage["reward"][state_slots] = rewards.to(T.float32)
+
+        self.mark_dirty_slots(state_slots)
+
+    def sample_indices(self, batch_size) -> T.Tensor:
+        """Storage indices of batch_size distinct transitions. Slots without
+        one, of unfinished windows and truncated episodes, are few, so random
+        slots are drawn until enough of them hold a transition."""
+        n_draws = math.ceil(1.25 * batch_size * self.size / max(len(self), 1))
+
+        while True:
+            n_draws = min(n_draws, self.size)
+            indices = self.get_indices(
+                self.rng.choice(self.size, n_draws, replace=False)
+            )
+            indices = indices[self.storage["flag"][indices] != self.EMPTY]
+
+            if indices.numel() >= batch_size or n_draws == self.size:
+                return indices[:batch_size]
+
+            n_draws *= 2
+
+    def sample(self, batch_size) -> Transition:
+        indices = self.sample_indices(batch_size)
+
+        dones = self.storage["flag"][indices] == self.TERMINAL
+        next_indices = T.where(
+            dones,
+            indices,
+            T.remainder(indices + self.n_step * self.n_envs, self.capacity),
+        )
+        observations = self.storage["observation"]
+
+        return Transition(
+            self.Dequantize(observations[indices]),
+            self.storage["action"][indices].long(),
+            self.Dequantize(observations[next_indices]),
+            self.storage["reward"][indices].to(self.sample_dtype),
+            dones,
+        )
+
+    def get_nbytes(self) -> int:
+        """Bytes held by the ring."""
+        return sum(
+            values.numel() * values.element_size() for values in self.storage.values()
+        )
+
+    def get_meta(self) -> Dict[str, Any]:
+        return {
+            **super().get_meta(),
+            "observation_dtype": self.observation_dtype,
+            "sample_dtype": str(self.sample_dtype).removeprefix("torch."),
+            "n_envs": self.n_envs,
+            "n_transitions": self.n_transitions,
+        }
+
+    def load_arrays(self, directory: str, meta: Dict[str, Any]):
+        if meta.get("observation_dtype") != self.observation_dtype:
+            raise ValueError(
+                f"Replay memory in '{directory}' is not a compact memory with "
+                f"{self.observation_dtype} observations"
+            )
+        if "n_envs" not in meta:
+            raise ValueError(
+                f"Replay memory in '{directory}' has the older compact layout"
+            )
+
+        self.storage = {
+            field: load_array(f"{directory}//{field}.npy")
+            for field in ("observation", "flag", "action", "reward")
+        }
+        self.set_sample_dtype(getattr(T, meta["sample_dtype"]))
 
-    def push(self, *args):
-        """Save a transition"""
-        self.memory.append(Transition(*args))
+        self.n_envs = meta["n_envs"]
+        self.n_transitions = meta["n_transitions"]
 
-    def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        # Windows of unfinished episodes are not saved.
+        self.window_states = None
+        self.current_slots = None
+        self.episode_starts = None
 
     def __len__(self):
-        return len(self.memory)
+        return self.n_transitions
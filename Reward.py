@@ -2,6 +2,7 @@ import torch as T
 
 from Track import Track
 from LinAlg import LinAlg
+from GateTracker import GateTracker
 
 class Reward:
     def __init__(
@@ -16,7 +17,7 @@ class Reward:
 
         self.last_distance = 0
 
-    def __call__(self, car_position : T.Tensor, track : Track, is_crashed : bool, dt : float) -> T.Tensor:
+    def __call__(self, car_position : T.Tensor, track : Track, is_crashed : bool, dt : float, gate_tracker : GateTracker = None) -> T.Tensor:
         nearest_line_index, distance_along_line = LinAlg.get_distance_along_lines(car_position, track.way_point_lines)
         current_distance = T.sum(track.way_point_distances[:nearest_line_index], dim=0) + distance_along_line
         distance_delta = current_distance - self.last_distance
@@ -25,4 +26,25 @@ class Reward:
         if is_crashed:
             self.last_distance = 0
 
-        return self.distance_reward_density * distance_delta - is_crashed * self.crash_penalty - self.time_penalty * dt
\ No newline at end of file
+        return self.distance_reward_density * distance_delta - is_crashed * self.crash_penalty - self.time_penalty * dt
+
+
+class GateReward:
+    """Rewards the gates passed since the last step, read from the environment's
+    gate tracker instead of projecting the car onto every way point line."""
+    def __init__(
+            self,
+            gate_reward : float,
+            time_penalty : float,
+            crash_penalty : float
+    ):
+        self.gate_reward = gate_reward
+        self.time_penalty = time_penalty
+        self.crash_penalty = crash_penalty
+
+    def __call__(self, car_position : T.Tensor, track : Track, is_crashed : bool, dt : float, gate_tracker : GateTracker = None) -> T.Tensor:
+        return T.as_tensor(
+            self.gate_reward * gate_tracker.gates_delta - is_crashed * self.crash_penalty - self.time_penalty * dt,
+            dtype=car_position.dtype,
+            device=car_position.device
+        )
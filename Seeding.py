@@ -0,0 +1,40 @@
+import numpy as np
+import torch as T
+from typing import Optional
+
+
+# Streams of a root seed. Every environment, replay memory and agent draws
+# from its own generator, so runs only depend on the root seed and the
+# index of each environment, not on how environments are batched or split
+# over processes.
+ENVIRONMENT_STREAM = 0
+MEMORY_STREAM = 1
+EXPLORATION_STREAM = 2
+NETWORK_STREAM = 3
+PRETRAIN_STREAM = 4
+
+
+def DeriveSeed(seed: Optional[int], stream: int, index: int = 0) -> Optional[int]:
+    """Seed of generator index of a stream of the root seed, or None for an
+    unseeded root. Seeds are spawned with NumPy's SeedSequence, so they do not
+    depend on the order generators are created in."""
+    if seed is None:
+        return None
+
+    return int(
+        np.random.SeedSequence(seed, spawn_key=(stream, index)).generate_state(
+            1, np.uint64
+        )[0]
+    )
+
+
+def MakeGenerator(seed: Optional[int]) -> T.Generator:
+    """A cpu torch.Generator seeded with seed, or from OS entropy for None."""
+    generator = T.Generator()
+
+    if seed is None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+
+    return generator
@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import traceback
+import statistics
+import multiprocessing as mp
+import torch as T
+
+from Agent import Agent
+from Environment import Environment
+from Config import expand_sweep, load_configs, read_config_file
+from typing import Any, Dict, List, Optional
+
+
+def flatten_sweep(sweep: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """TOML parses unquoted dotted keys (agent.network = [...]) into nested
+    tables, which are flattened back into 'section.name' keys here."""
+    flat_sweep = {}
+
+    for name, value in sweep.items():
+        if isinstance(value, dict) and not is_distribution(value):
+            flat_sweep.update(flatten_sweep(value, f"{prefix}{name}."))
+        else:
+            flat_sweep[f"{prefix}{name}"] = value
+
+    return flat_sweep
+
+
+def is_distribution(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and next(iter(value)) in (
+        "uniform",
+        "log_uniform",
+        "int_uniform",
+    )
+
+
+def sample_value(value: Any, rng: random.Random) -> Any:
+    if isinstance(value, list):
+        return rng.choice(value)
+
+    (distribution, (low, high)), = value.items()
+
+    if distribution == "uniform":
+        return rng.uniform(low, high)
+    if distribution == "log_uniform":
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+
+    return rng.randint(low, high)
+
+
+def expand_random_search(
+    configs: Dict[str, Any], sweep: Dict[str, Any], n_trials: int, seed: int
+) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    trials = []
+
+    for _ in range(n_trials):
+        trials.extend(
+            expand_sweep(
+                configs,
+                {name: [sample_value(value, rng)] for name, value in sweep.items()},
+            )
+        )
+
+    return trials
+
+
+class EarlyStopping:
+    """Median stopping rule: every report_period episodes a trial publishes the
+    mean return of its recent episodes and stops if that is below the median
+    of what the other trials reported at the same point."""
+
+    def __init__(
+        self,
+        curves: Any,
+        trial_id: int,
+        report_period: int,
+        grace_reports: int,
+        min_trials: int,
+        window: int = 20,
+    ):
+        self.curves = curves
+        self.trial_id = trial_id
+        self.report_period = report_period
+        self.grace_reports = grace_reports
+        self.min_trials = min_trials
+        self.window = window
+
+        self.episode_rewards = []
+        self.curve = []
+        self.stopped_early = False
+
+    def __call__(self, agent: Agent, episode_reward: float) -> bool:
+        self.episode_rewards.append(episode_reward)
+
+        if len(self.episode_rewards) % self.report_period != 0:
+            return False
+
+        self.curve.append(statistics.fmean(self.episode_rewards[-self.window :]))
+        self.curves[self.trial_id] = self.curve
+
+        report = len(self.curve) - 1
+
+        if report < self.grace_reports:
+            return False
+
+        other_values = [
+            curve[report]
+            for trial_id, curve in self.curves.items()
+            if trial_id != self.trial_id and len(curve) > report
+        ]
+
+        if len(other_values) < self.min_trials:
+            return False
+
+        self.stopped_early = self.curve[-1] < statistics.median(other_values)
+
+        return self.stopped_early
+
+
+worker_settings = {}
+
+
+def initialize_worker(core_sets: Any, threads_per_trial: int):
+    cores = core_sets.get()
+
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    T.set_num_threads(threads_per_trial)
+    T.set_num_interop_threads(1)
+
+    worker_settings["cores"] = cores
+
+
+def run_trial(arguments: tuple) -> Dict[str, Any]:
+    """Trains one trial and returns its result line. Trials checkpoint into
+    their own trial-<id> subdirectory of checkpoint_dir, so they never resume
+    from each other, and a failing trial returns its error instead of
+    aborting the sweep."""
+    trial_id, trial_configs, curves, early_stopping_settings = arguments
+
+    start_time = time.perf_counter()
+
+    checkpoint_dir = trial_configs["training"].checkpoint_dir
+
+    if checkpoint_dir is not None:
+        trial_configs = {
+            **trial_configs,
+            "training": trial_configs["training"].replace(
+                checkpoint_dir=os.path.join(checkpoint_dir, f"trial-{trial_id}")
+            ),
+        }
+
+    result = {
+        "trial_id": trial_id,
+        "configs": {
+            section: config.to_dict() for section, config in trial_configs.items()
+        },
+        "cores": sorted(worker_settings.get("cores") or []),
+    }
+
+    early_stopping = EarlyStopping(curves, trial_id, **early_stopping_settings)
+
+    try:
+        environment = Environment.FromConfig(trial_configs["environment"])
+        agent = Agent(trial_configs["agent"], trial_configs["training"], environment)
+        agent.train(episode_callback=early_stopping)
+    except Exception as error:
+        return {
+            **result,
+            "failed": True,
+            "error": repr(error),
+            "traceback": traceback.format_exc(),
+            "n_episodes": len(early_stopping.episode_rewards),
+            "wall_time": time.perf_counter() - start_time,
+        }
+
+    episode_rewards = early_stopping.episode_rewards
+
+    return {
+        **result,
+        "failed": False,
+        "n_steps": agent.n_steps,
+        "n_episodes": len(episode_rewards),
+        "final_mean_reward": (
+            statistics.fmean(episode_rewards[-early_stopping.window :])
+            if episode_rewards
+            else None
+        ),
+        "best_mean_reward": max(early_stopping.curve, default=None),
+        "stopped_early": early_stopping.stopped_early,
+        "wall_time": time.perf_counter() - start_time,
+    }
+
+
+def get_core_sets(n_workers: int, threads_per_trial: int) -> List[Optional[set]]:
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * n_workers
+
+    cores = sorted(os.sched_getaffinity(0))
+
+    # More workers than cores wrap around and share cores.
+    return [
+        {
+            cores[(worker * threads_per_trial + thread) % len(cores)]
+            for thread in range(threads_per_trial)
+        }
+        for worker in range(n_workers)
+    ]
+
+
+def run_sweep(
+    trials: List[Dict[str, Any]],
+    results_path: str,
+    threads_per_trial: int = 1,
+    n_workers: Optional[int] = None,
+    report_period: int = 10,
+    grace_reports: int = 3,
+    min_trials: int = 3,
+):
+    """Runs the trials on a process pool with one worker per threads_per_trial
+    cores, each pinned to its own cores, and appends every finished trial as a
+    JSON line to results_path."""
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+    if n_workers is None:
+        n_workers = max(n_cores // threads_per_trial, 1)
+
+    context = mp.get_context("spawn")
+
+    with context.Manager() as manager:
+        core_sets = manager.Queue()
+
+        for core_set in get_core_sets(n_workers, threads_per_trial):
+            core_sets.put(core_set)
+
+        curves = manager.dict()
+        early_stopping_settings = {
+            "report_period": report_period,
+            "grace_reports": grace_reports,
+            "min_trials": min_trials,
+        }
+
+        with context.Pool(
+            n_workers,
+            initializer=initialize_worker,
+            initargs=(core_sets, threads_per_trial),
+        ) as pool, open(results_path, "a") as results_file:
+            for result in pool.imap_unordered(
+                run_trial,
+                [
+                    (trial_id, trial_configs, curves, early_stopping_settings)
+                    for trial_id, trial_configs in enumerate(trials)
+                ],
+            ):
+                results_file.write(json.dumps(result) + "\n")
+                results_file.flush()
+
+                if result["failed"]:
+                    print(
+                        f"Trial {result['trial_id']}: failed with {result['error']}",
+                        file=sys.stderr,
+                    )
+                else:
+                    print(
+                        f"Trial {result['trial_id']}: final mean reward "
+                        f"{result['final_mean_reward']}"
+                        + (" (stopped early)" if result["stopped_early"] else ""),
+                        file=sys.stderr,
+                    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a hyperparameter sweep from a config file with a [sweep] table."
+    )
+    parser.add_argument("config_file")
+    parser.add_argument("overrides", nargs="*")
+    parser.add_argument("--results", default="sweep_results.jsonl")
+    parser.add_argument("--random-trials", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads-per-trial", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--report-period", type=int, default=10)
+    parser.add_argument("--grace-reports", type=int, default=3)
+    parser.add_argument("--min-trials", type=int, default=3)
+    args = parser.parse_args()
+
+    configs = load_configs(args.config_file, args.overrides)
+    sweep = flatten_sweep(read_config_file(args.config_file).get("sweep", {}))
+
+    if args.random_trials is not None:
+        trials = expand_random_search(configs, sweep, args.random_trials, args.seed)
+    else:
+        trials = expand_sweep(configs, sweep)
+
+    run_sweep(
+        trials,
+        args.results,
+        threads_per_trial=args.threads_per_trial,
+        n_workers=args.workers,
+        report_period=args.report_period,
+        grace_reports=args.grace_reports,
+        min_trials=args.min_trials,
+    )
@@ -1,7 +1,7 @@
 import os
 import torch as T
 from LinAlg import LinAlg
-from typing import Tuple
+from typing import List, Tuple
 
 
 class Track:
@@ -36,6 +36,20 @@ class Track:
         self.way_point_distances = T.sqrt(T.sum(self.way_point_lines[..., 1] ** 2, dim=-1))
         self.track_lines = T.concat((left_rail_lines, right_rail_lines), dim=0)
 
+        # Gate i spans the track from left_rails[i] to right_rails[i], gate 0
+        # being the goal line.
+        self.gate_lines = T.concat(
+            (
+                self.left_rails[..., None],
+                (self.right_rails - self.left_rails)[..., None],
+            ),
+            dim=-1,
+        )
+
+    @staticmethod
+    def GetNames() -> List[str]:
+        return sorted(name for name in os.listdir("Tracks") if not name.startswith("."))
+
     @staticmethod
     def Load(
         track_name: str,
@@ -44,10 +58,12 @@ class Track:
         track_color: Tuple[int, int, int] = (35, 30, 30),
         rail_color: Tuple[int, int, int] = (0, 0, 0),
         goal_line_color: Tuple[int, int, int] = (255, 255, 255),
+        processed: bool = False,
     ) -> "Track":
 
         try:
-            track_data = T.load(f"Tracks//{track_name}//data.pt")
+            track_file = "processed.pt" if processed else "data.pt"
+            track_data = T.load(f"Tracks//{track_name}//{track_file}")
 
             return Track(
                 track_data["left_rails"].to(dtype=dtype, device=device),
@@ -60,7 +76,7 @@ class Track:
             )
 
         except FileNotFoundError:
-            track_names = os.listdir("Tracks")
             raise FileNotFoundError(
-                f"Track: '{track_name}' not valid. Choose between: {', '.join(track_names)}"
+                f"Track: '{track_name}' not valid. "
+                f"Choose between: {', '.join(Track.GetNames())}"
             )
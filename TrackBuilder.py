@@ -1,10 +1,14 @@
 import os
 import sys
+import shutil
+import threading
 import torch as T
 import numpy as np
 import pygame as pg
 from math import floor
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+from TrackHistory import PointState, TrackEdit, TrackHistory
 
 
 class TrackBuilder:
@@ -12,7 +16,7 @@ class TrackBuilder:
         self.SetAttributes()
         self.SetScreen()
         self.SetValueBinds()
-        self.ResetTrack()
+        self.ClearTrack()
         self.UpdateEvents()
 
         self.Run()
@@ -27,6 +31,10 @@ class TrackBuilder:
 
         self.screen_pos = (self.screen_x / 2.0, self.screen_y / 2.0)
 
+        self.road_layer = pg.Surface((self.screen_x, self.screen_y)).convert()
+        self.road_layer_key = None
+        self.road_layer_dirty = True
+
     def SetValueBinds(self):
         self.key_value_binds = {}
         self.mouse_value_binds = {}
@@ -58,6 +66,8 @@ class TrackBuilder:
                 "ESCAPE": self.Quit,
                 "s": self.Save,
                 "r": self.ResetTrack,
+                "z": self.Undo,
+                "y": self.Redo,
             }
         }
 
@@ -84,6 +94,10 @@ class TrackBuilder:
         self.cursor_radius = 5.0
         self.way_point_radius = 3.0
         self.rail_handle_radius = 1.5
+        self.min_handle_pixels = 2.0
+
+        self.road_lod_zoom = 3.0
+        self.road_lod_quads = 16
 
         self.background_color = (0, 0, 0)
         self.track_color = (5, 5, 5)
@@ -103,8 +117,17 @@ class TrackBuilder:
 
         self.drag_index = -1
         self.drag_type = -1
+        self.drag_start_state = None
+
+        self.history = TrackHistory()
 
         self.is_saving = False
+        self.save_lock = threading.Lock()
+        self.save_executor = ThreadPoolExecutor(max_workers=1)
+        self.reserved_track_names = set()
+
+        self.preview_resolution = (1024, 1024)
+        self.preview_margin = 0.05
 
         self.dtype = T.float64
         self.device = "cpu"
@@ -162,24 +185,47 @@ class TrackBuilder:
         if self.point_hover_index == 0 and self.n_points >= 3:
             self.is_closed = True
 
+            # Closing into degenerate rails is rejected without any history.
+            if not self.CalculateRails():
+                self.is_closed = False
+                return
+
+            self.history.Record(TrackEdit.Close(False, True))
+
         else:
             self.points.append(self.global_mouse_pos)
             self.edited_rails.append(False)
             self.n_points += 1
 
-        self.CalculateRails()
+            # So is a point giving degenerate rails, which leaves the rails of
+            # the previous points untouched.
+            if not self.CalculateRails():
+                self.points.pop()
+                self.edited_rails.pop()
+                self.n_points -= 1
+                return
+
+            self.history.Record(
+                TrackEdit.Insert(self.n_points - 1, self.GetPointState(-1))
+            )
+
+        self.history.Commit()
 
     def DeletePoint(self):
         if self.is_closed:
             self.background_color = (0, 0, 0)
 
             if self.point_hover_index == -1 and self.point_hover_type == -1:
-                self.is_closed = False
-
-                self.edited_rails[0] = False
-                self.edited_rails[-1] = False
+                self.RecordUnclose()
 
             elif self.point_hover_type == 0:
+                self.history.Record(
+                    TrackEdit.Remove(
+                        self.point_hover_index % self.n_points,
+                        self.GetPointState(self.point_hover_index),
+                    )
+                )
+
                 self.points.pop(self.point_hover_index)
                 self.left_rails.pop(self.point_hover_index)
                 self.right_rails.pop(self.point_hover_index)
@@ -188,33 +234,39 @@ class TrackBuilder:
                 self.n_points -= 1
 
                 if self.n_points == 2:
-                    self.is_closed = False
-
-                    self.edited_rails[0] = False
-                    self.edited_rails[1] = False
+                    self.RecordUnclose()
 
             self.CalculateRails()
+            self.history.Commit()
 
         elif self.n_points > 0 and self.point_hover_type <= 0:
             self.background_color = (0, 0, 0)
 
+            self.history.Record(
+                TrackEdit.Remove(
+                    self.point_hover_index % self.n_points,
+                    self.GetPointState(self.point_hover_index),
+                )
+            )
+
             self.points.pop(self.point_hover_index)
             self.left_rails.pop(self.point_hover_index)
             self.right_rails.pop(self.point_hover_index)
             self.edited_rails.pop(self.point_hover_index)
 
-            if self.point_hover_index == 0:
-                self.edited_rails[0] = False
+            if self.point_hover_index == 0 and self.n_points > 1:
+                self.RecordEditedRail(0, False)
 
             elif self.n_points > 1 and (
                 self.point_hover_index == self.n_points - 1
                 or self.point_hover_index == -1
             ):
-                self.edited_rails[-1] = False
+                self.RecordEditedRail(self.n_points - 2, False)
 
             self.n_points -= 1
 
             self.CalculateRails()
+            self.history.Commit()
 
     def DragPoint(self):
         if self.drag_index >= self.n_points:
@@ -257,6 +309,7 @@ class TrackBuilder:
                 )
 
                 self.edited_rails[self.drag_index] = True
+                self.InvalidateRoadLayer()
 
             elif self.drag_type == 2:
                 self.right_rails[self.drag_index] = self.global_mouse_pos
@@ -268,8 +321,29 @@ class TrackBuilder:
                 )
 
                 self.edited_rails[self.drag_index] = True
+                self.InvalidateRoadLayer()
 
     def ResetTrack(self):
+        if self.n_points > 0:
+            self.history.Record(
+                TrackEdit.Reset(
+                    np.concatenate(
+                        (
+                            np.asarray(self.points, dtype=np.float64),
+                            np.asarray(self.left_rails, dtype=np.float64),
+                            np.asarray(self.right_rails, dtype=np.float64),
+                        ),
+                        axis=-1,
+                    ),
+                    np.asarray(self.edited_rails, dtype=bool),
+                    self.is_closed,
+                )
+            )
+
+        self.ClearTrack()
+        self.history.Commit()
+
+    def ClearTrack(self):
         self.points = []
         self.n_points = 0
 
@@ -280,15 +354,174 @@ class TrackBuilder:
 
         self.edited_rails = []
 
+        self.InvalidateRoadLayer()
+
     def LeftMouseButtonDown(self):
         self.left_mouse_button = True
         self.drag_index = self.point_hover_index
         self.drag_type = self.point_hover_type
 
+        if self.drag_index != -1:
+            self.drag_start_state = self.GetPointState(self.drag_index)
+
     def LeftMouseButtonUp(self):
+        # A whole drag is stored as a single edit, however many frames it spanned.
+        if self.drag_start_state is not None and self.drag_index < self.n_points:
+            drag_end_state = self.GetPointState(self.drag_index)
+
+            if drag_end_state != self.drag_start_state:
+                self.history.Record(
+                    TrackEdit.Set(
+                        self.drag_index % self.n_points,
+                        self.drag_start_state,
+                        drag_end_state,
+                    )
+                )
+                self.history.Commit()
+
         self.left_mouse_button = False
         self.drag_index = -1
         self.drag_type = -1
+        self.drag_start_state = None
+
+    def GetPointState(self, index: int) -> PointState:
+        return (
+            float(self.points[index][0]),
+            float(self.points[index][1]),
+            float(self.left_rails[index][0]),
+            float(self.left_rails[index][1]),
+            float(self.right_rails[index][0]),
+            float(self.right_rails[index][1]),
+            bool(self.edited_rails[index]),
+        )
+
+    def SetPointState(self, index: int, state: PointState):
+        self.points[index] = (state[0], state[1])
+        self.left_rails[index] = (state[2], state[3])
+        self.right_rails[index] = (state[4], state[5])
+        self.edited_rails[index] = state[6]
+
+    def InsertPointState(self, index: int, state: PointState):
+        self.points.insert(index, (state[0], state[1]))
+        self.left_rails.insert(index, (state[2], state[3]))
+        self.right_rails.insert(index, (state[4], state[5]))
+        self.edited_rails.insert(index, state[6])
+
+        self.n_points += 1
+
+    def RemovePointState(self, index: int):
+        self.points.pop(index)
+        self.left_rails.pop(index)
+        self.right_rails.pop(index)
+        self.edited_rails.pop(index)
+
+        self.n_points -= 1
+
+    def RecordEditedRail(self, index: int, edited_rail: bool):
+        old_state = self.GetPointState(index)
+        self.edited_rails[index] = edited_rail
+
+        self.history.Record(
+            TrackEdit.Set(index, old_state, self.GetPointState(index))
+        )
+
+    def RecordUnclose(self):
+        self.RecordEditedRail(0, False)
+        self.RecordEditedRail(self.n_points - 1, False)
+
+        self.is_closed = False
+        self.history.Record(TrackEdit.Close(True, False))
+
+    def ApplyEdit(self, edit: TrackEdit, undo: bool, dirty_indices: set) -> bool:
+        """Applies one edit, shifting ``dirty_indices`` along with any inserted
+        or removed point. Returns True if all rails have to be recalculated."""
+        if edit.kind == TrackEdit.RESET:
+            if undo:
+                coordinates, edited_rails, is_closed = edit.old
+
+                self.points = [tuple(point) for point in coordinates[:, 0:2].tolist()]
+                self.left_rails = [tuple(rail) for rail in coordinates[:, 2:4].tolist()]
+                self.right_rails = [
+                    tuple(rail) for rail in coordinates[:, 4:6].tolist()
+                ]
+                self.edited_rails = edited_rails.tolist()
+                self.n_points = len(self.points)
+                self.is_closed = is_closed
+
+            else:
+                self.ClearTrack()
+
+            return True
+
+        if edit.kind == TrackEdit.CLOSE:
+            self.is_closed = edit.old if undo else edit.new
+            dirty_indices.update((0, self.n_points - 1))
+
+            return False
+
+        inserting = (edit.kind == TrackEdit.INSERT) != undo
+
+        if edit.kind == TrackEdit.SET:
+            self.SetPointState(
+                edit.index, TrackEdit.UnpackState(edit.old if undo else edit.new)
+            )
+            dirty_indices.update((edit.index - 1, edit.index, edit.index + 1))
+
+        elif inserting:
+            shifted = {i + 1 if i >= edit.index else i for i in dirty_indices}
+            dirty_indices.clear()
+            dirty_indices.update(shifted)
+
+            self.InsertPointState(
+                edit.index,
+                TrackEdit.UnpackState(edit.old if undo else edit.new),
+            )
+            dirty_indices.update((edit.index - 1, edit.index, edit.index + 1))
+
+        else:
+            shifted = {i - 1 if i > edit.index else i for i in dirty_indices}
+            dirty_indices.clear()
+            dirty_indices.update(shifted)
+
+            self.RemovePointState(edit.index)
+            dirty_indices.update((edit.index - 1, edit.index))
+
+        return False
+
+    def ApplyEntry(self, entry: Tuple[TrackEdit, ...], undo: bool):
+        self.history.is_replaying = True
+        self.background_color = (0, 0, 0)
+
+        dirty_indices = set()
+        recalculate_all = False
+
+        for edit in reversed(entry) if undo else entry:
+            recalculate_all |= self.ApplyEdit(edit, undo, dirty_indices)
+
+        if recalculate_all:
+            self.CalculateRails()
+        else:
+            self.CalculateLocalRails(dirty_indices)
+
+        self.history.is_replaying = False
+
+    def Undo(self):
+        if self.left_mouse_button:
+            return
+
+        entry = self.history.PopUndo()
+
+        if entry is not None:
+            self.ApplyEntry(entry, undo=True)
+
+    def Redo(self):
+        if self.left_mouse_button:
+            return
+
+        entry = self.history.PopRedo()
+
+        if entry is not None:
+            self.ApplyEntry(entry, undo=False)
 
     def CheckKeyEvents(self, event: pg.event.Event):
         for event_type, key_binds in self.key_value_binds.items():
@@ -404,7 +637,92 @@ class TrackBuilder:
             self.CheckKeyEvents(event)
             self.CheckMouseEvents(event)
 
-    def CalculateRails(self):
+    def GetRailPoints(
+        self, a: np.ndarray, b: np.ndarray, c: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        ab = b - a
+        ab_length = np.sqrt(np.sum(ab**2, axis=-1, keepdims=True))
+        ab_p = (
+            self.track_width
+            * np.concatenate((-ab[:, 1, None], ab[:, 0, None]), axis=-1)
+            / ab_length
+        )
+
+        bc = c - b
+        bc_length = np.sqrt(np.sum(bc**2, axis=-1, keepdims=True))
+        bc_p = (
+            self.track_width
+            * np.concatenate((-bc[:, 1, None], bc[:, 0, None]), axis=-1)
+            / bc_length
+        )
+
+        abc_M = np.concatenate((ab[..., None], bc[..., None]), axis=-1)
+
+        t_left = (np.linalg.inv(abc_M) @ (c + bc_p - (a + ab_p))[..., None])[
+            ..., 0, 0, None
+        ]
+        t_right = (np.linalg.inv(abc_M) @ (c - bc_p - (a - ab_p))[..., None])[
+            ..., 0, 0, None
+        ]
+
+        return a + ab_p + ab * t_left, a - ab_p + ab * t_right
+
+    def CalculateLocalRails(self, indices: Iterable[int]):
+        # Rails only depend on a point and its two neighbours, so after a local
+        # edit only the rails around it have to be recalculated.
+        if self.n_points < 4:
+            self.CalculateRails()
+            return
+
+        self.InvalidateRoadLayer()
+
+        if self.is_closed:
+            indices = sorted({index % self.n_points for index in indices})
+
+        else:
+            indices = sorted(
+                {index for index in indices if 0 <= index < self.n_points}
+            )
+
+            for end_index in (0, self.n_points - 1):
+                if end_index in indices:
+                    indices.remove(end_index)
+
+                    self.left_rails[end_index] = self.points[end_index]
+                    self.right_rails[end_index] = self.points[end_index]
+
+        indices = [index for index in indices if not self.edited_rails[index]]
+
+        if len(indices) == 0:
+            return
+
+        a = np.asarray(
+            [self.points[index - 1] for index in indices], dtype=np.float32
+        )
+        b = np.asarray([self.points[index] for index in indices], dtype=np.float32)
+        c = np.asarray(
+            [self.points[(index + 1) % self.n_points] for index in indices],
+            dtype=np.float32,
+        )
+
+        try:
+            new_left_rails, new_right_rails = self.GetRailPoints(a, b, c)
+
+        except np.linalg.LinAlgError:
+            self.CalculateRails()
+            return
+
+        for index, left_rail, right_rail in zip(
+            indices, new_left_rails.tolist(), new_right_rails.tolist()
+        ):
+            self.left_rails[index] = left_rail
+            self.right_rails[index] = right_rail
+
+    def CalculateRails(self) -> bool:
+        """Recalculates every rail that was not edited by hand. Returns False,
+        leaving the rails as they were, if the points give degenerate rails."""
+        self.InvalidateRoadLayer()
+
         if self.n_points >= 3:
             track_points = np.asarray(self.points, dtype=np.float32)
 
@@ -418,35 +736,11 @@ class TrackBuilder:
                 b = track_points[1:-1]
                 c = track_points[2:]
 
-            ab = b - a
-            ab_length = np.sqrt(np.sum(ab**2, axis=-1, keepdims=True))
-            ab_p = (
-                self.track_width
-                * np.concatenate((-ab[:, 1, None], ab[:, 0, None]), axis=-1)
-                / ab_length
-            )
-
-            bc = c - b
-            bc_length = np.sqrt(np.sum(bc**2, axis=-1, keepdims=True))
-            bc_p = (
-                self.track_width
-                * np.concatenate((-bc[:, 1, None], bc[:, 0, None]), axis=-1)
-                / bc_length
-            )
-
-            abc_M = np.concatenate((ab[..., None], bc[..., None]), axis=-1)
-
             try:
-                t_left = (np.linalg.inv(abc_M) @ (c + bc_p - (a + ab_p))[..., None])[
-                    ..., 0, 0, None
-                ]
-                t_right = (np.linalg.inv(abc_M) @ (c - bc_p - (a - ab_p))[..., None])[
-                    ..., 0, 0, None
-                ]
+                new_left_rails, new_right_rails = self.GetRailPoints(a, b, c)
 
             except np.linalg.LinAlgError:
-                self.DeletePoint()
-                return
+                return False
 
             if not self.is_closed:
                 left_rails = [self.points[0]]
@@ -455,8 +749,8 @@ class TrackBuilder:
                 for i, (edited_rail, left_rail, right_rail) in enumerate(
                     zip(
                         self.edited_rails[1 : self.n_points - 1],
-                        (a + ab_p + ab * t_left).tolist(),
-                        (a - ab_p + ab * t_right).tolist(),
+                        new_left_rails.tolist(),
+                        new_right_rails.tolist(),
                     ),
                     start=1,
                 ):
@@ -481,8 +775,8 @@ class TrackBuilder:
                 for i, (edited_rail, left_rail, right_rail) in enumerate(
                     zip(
                         self.edited_rails,
-                        (a + ab_p + ab * t_left).tolist(),
-                        (a - ab_p + ab * t_right).tolist(),
+                        new_left_rails.tolist(),
+                        new_right_rails.tolist(),
                     )
                 ):
                     if edited_rail:
@@ -499,6 +793,8 @@ class TrackBuilder:
             self.left_rails = self.points.copy()
             self.right_rails = self.points.copy()
 
+        return True
+
     def GlobalPointsToScreenSpace(
         self, points: List[Tuple[float, float]]
     ) -> List[Tuple[float, float]]:
@@ -537,180 +833,182 @@ class TrackBuilder:
     ) -> Tuple[float, float]:
         return self.ScreenPointsToGlobalSpace([point])[0]
 
-    def DrawRoad(self):
-        for i in range(self.n_points - 1):
-            pg.draw.polygon(
-                self.screen,
-                self.track_color,
-                self.GlobalPointsToScreenSpace(
-                    [
-                        self.left_rails[i],
-                        self.left_rails[i + 1],
-                        self.right_rails[i + 1],
-                        self.right_rails[i],
-                    ]
-                ),
-            )
+    def GlobalPointsToScreenArray(self, points: List[Tuple[float, float]]) -> np.ndarray:
+        if len(points) == 0:
+            return np.zeros((0, 2), dtype=np.float64)
 
-        if self.is_closed:
-            pg.draw.polygon(
-                self.screen,
-                self.track_color,
-                self.GlobalPointsToScreenSpace(
-                    [
-                        self.left_rails[0],
-                        self.left_rails[-1],
-                        self.right_rails[-1],
-                        self.right_rails[0],
-                    ]
-                ),
-            )
+        screen_pos = np.asarray(self.screen_pos, dtype=np.float64)
+
+        return (np.asarray(points, dtype=np.float64) - screen_pos) * self.zoom + screen_pos
+
+    def GetVisibleMask(self, screen_points: np.ndarray, margin: float) -> np.ndarray:
+        return (
+            (screen_points[..., 0] >= -margin)
+            & (screen_points[..., 0] <= self.screen_x + margin)
+            & (screen_points[..., 1] >= -margin)
+            & (screen_points[..., 1] <= self.screen_y + margin)
+        )
+
+    def InvalidateRoadLayer(self):
+        self.road_layer_dirty = True
+
+    def GetRoadLayer(self) -> pg.Surface:
+        road_layer_key = (self.zoom, self.screen_pos, self.background_color)
+
+        if self.road_layer_dirty or road_layer_key != self.road_layer_key:
+            self.road_layer.fill(self.background_color)
 
-    def DrawRails(self):
+            if self.n_points > 2:
+                self.DrawRoad(self.road_layer)
+            if self.n_points > 1:
+                self.DrawRails(self.road_layer)
+
+            self.road_layer_key = road_layer_key
+            self.road_layer_dirty = False
+
+        return self.road_layer
+
+    def DrawRoad(self, surface: pg.Surface):
+        n_quads = self.n_points if self.is_closed else self.n_points - 1
+        next_indices = (np.arange(n_quads) + 1) % self.n_points
+
+        left_s = self.GlobalPointsToScreenArray(self.left_rails)
+        right_s = self.GlobalPointsToScreenArray(self.right_rails)
+
+        quads = np.stack(
+            (
+                left_s[:n_quads],
+                left_s[next_indices],
+                right_s[next_indices],
+                right_s[:n_quads],
+            ),
+            axis=1,
+        )
+
+        quads_min = quads.min(axis=1)
+        quads_max = quads.max(axis=1)
+        visible_indices = np.flatnonzero(
+            (quads_max[:, 0] >= 0)
+            & (quads_min[:, 0] <= self.screen_x)
+            & (quads_max[:, 1] >= 0)
+            & (quads_min[:, 1] <= self.screen_y)
+        )
+
+        if visible_indices.size == 0:
+            return
+
+        # At low zoom neighbouring quads are only a few pixels long, so runs of
+        # them are merged into a single strip polygon.
+        quads_per_polygon = (
+            self.road_lod_quads if self.zoom <= self.road_lod_zoom else 1
+        )
+        run_breaks = np.flatnonzero(np.diff(visible_indices) != 1) + 1
+
+        for run in np.split(visible_indices, run_breaks):
+            for start in range(0, run.size, quads_per_polygon):
+                strip = quads[run[start : start + quads_per_polygon]]
+
+                pg.draw.polygon(
+                    surface,
+                    self.track_color,
+                    np.concatenate((strip[:, 0], strip[-1, 1:3], strip[::-1, 3])),
+                )
+
+    def DrawRails(self, surface: pg.Surface):
         pg.draw.lines(
-            self.screen,
+            surface,
             self.rails_color,
             self.is_closed,
-            self.GlobalPointsToScreenSpace(self.left_rails),
+            self.GlobalPointsToScreenArray(self.left_rails),
             width=floor(self.track_width * self.zoom / 4),
         )
         pg.draw.lines(
-            self.screen,
+            surface,
             self.rails_color,
             self.is_closed,
-            self.GlobalPointsToScreenSpace(self.right_rails),
+            self.GlobalPointsToScreenArray(self.right_rails),
             width=floor(self.track_width * self.zoom / 4),
         )
 
-    def DrawRailHandles(self):
-        start_index = 0 if self.is_closed else 1
-        stop_index = self.n_points if self.is_closed else self.n_points - 1
-
-        for i, (l, r) in enumerate(
-            zip(
-                self.left_rails[start_index:stop_index],
-                self.right_rails[start_index:stop_index],
-            ),
-            start=start_index,
-        ):
-            l_s = self.GlobalPointToScreenSpace(l)
-            r_s = self.GlobalPointToScreenSpace(r)
-
-            radius = self.rail_handle_radius * self.zoom
-
-            if i == self.point_hover_index:
-                if self.point_hover_type == 1:
-                    pg.draw.circle(
-                        self.screen, self.rail_handle_hover_color, l_s, radius
-                    )
-                    pg.draw.circle(
-                        self.screen,
-                        self.rail_handle_color,
-                        l_s,
-                        radius,
-                        floor(radius / 3),
-                    )
+    def DrawHandle(
+        self,
+        position: np.ndarray,
+        radius: float,
+        fill_color: Tuple[int, int, int],
+        outline_color: Tuple[int, int, int],
+    ):
+        pg.draw.circle(self.screen, fill_color, position, radius)
+        pg.draw.circle(self.screen, outline_color, position, radius, floor(radius / 3))
 
-                    pg.draw.circle(self.screen, self.track_color, r_s, radius)
-                    pg.draw.circle(
-                        self.screen,
-                        self.rail_handle_color,
-                        r_s,
-                        radius,
-                        floor(radius / 3),
-                    )
+    def DrawRailHandles(self):
+        radius = self.rail_handle_radius * self.zoom
 
-                elif self.point_hover_type == 2:
-                    pg.draw.circle(self.screen, self.track_color, l_s, radius)
-                    pg.draw.circle(
-                        self.screen,
-                        self.rail_handle_color,
-                        l_s,
-                        radius,
-                        floor(radius / 3),
-                    )
+        if radius < self.min_handle_pixels:
+            return
 
-                    pg.draw.circle(
-                        self.screen, self.rail_handle_hover_color, r_s, radius
-                    )
-                    pg.draw.circle(
-                        self.screen,
-                        self.rail_handle_color,
-                        r_s,
-                        radius,
-                        floor(radius / 3),
-                    )
+        start_index = 0 if self.is_closed else 1
+        stop_index = self.n_points if self.is_closed else self.n_points - 1
 
-                else:
-                    pg.draw.circle(self.screen, self.track_color, l_s, radius)
-                    pg.draw.circle(
-                        self.screen,
-                        self.rail_handle_color,
-                        l_s,
-                        radius,
-                        floor(radius / 3),
-                    )
+        left_s = self.GlobalPointsToScreenArray(self.left_rails[start_index:stop_index])
+        right_s = self.GlobalPointsToScreenArray(
+            self.right_rails[start_index:stop_index]
+        )
 
-                    pg.draw.circle(self.screen, self.track_color, r_s, radius)
-                    pg.draw.circle(
-                        self.screen,
-                        self.rail_handle_color,
-                        r_s,
-                        radius,
-                        floor(radius / 3),
-                    )
+        visible_indices = np.flatnonzero(
+            self.GetVisibleMask(left_s, radius) | self.GetVisibleMask(right_s, radius)
+        )
 
-            else:
-                pg.draw.circle(self.screen, self.track_color, l_s, radius)
-                pg.draw.circle(
-                    self.screen, self.rail_handle_color, l_s, radius, floor(radius / 3)
-                )
+        for i in visible_indices.tolist():
+            is_hovered = i + start_index == self.point_hover_index
 
-                pg.draw.circle(self.screen, self.track_color, r_s, radius)
-                pg.draw.circle(
-                    self.screen, self.rail_handle_color, r_s, radius, floor(radius / 3)
-                )
+            self.DrawHandle(
+                left_s[i],
+                radius,
+                (
+                    self.rail_handle_hover_color
+                    if is_hovered and self.point_hover_type == 1
+                    else self.track_color
+                ),
+                self.rail_handle_color,
+            )
+            self.DrawHandle(
+                right_s[i],
+                radius,
+                (
+                    self.rail_handle_hover_color
+                    if is_hovered and self.point_hover_type == 2
+                    else self.track_color
+                ),
+                self.rail_handle_color,
+            )
 
     def DrawWayPoints(self):
-        for i, point in enumerate(self.points):
-            point_s = self.GlobalPointToScreenSpace(point)
-            point_r = self.way_point_radius * self.zoom
+        point_r = self.way_point_radius * self.zoom
 
-            if self.point_hover_type == 0 and i == self.point_hover_index:
-                pg.draw.circle(
-                    self.screen, self.way_point_hover_color, point_s, point_r
-                )
-            else:
-                pg.draw.circle(self.screen, self.track_color, point_s, point_r)
+        if point_r < self.min_handle_pixels:
+            return
 
-            pg.draw.circle(
-                self.screen, self.way_point_color, point_s, point_r, floor(point_r / 3)
+        points_s = self.GlobalPointsToScreenArray(self.points)
+
+        for i in np.flatnonzero(self.GetVisibleMask(points_s, point_r)).tolist():
+            self.DrawHandle(
+                points_s[i],
+                point_r,
+                (
+                    self.way_point_hover_color
+                    if self.point_hover_type == 0 and i == self.point_hover_index
+                    else self.track_color
+                ),
+                self.way_point_color,
             )
 
     def DrawTrack(self):
-        if self.n_points > 2:
-            self.DrawRoad()
-        if self.n_points > 1:
-            self.DrawRails()
+        self.screen.blit(self.GetRoadLayer(), (0, 0))
 
         self.DrawWayPoints()
         self.DrawRailHandles()
 
-    def DrawStartLine(self):
-        if self.is_closed:
-            left_side = self.GlobalPointToScreenSpace(self.left_rails[0])
-            right_side = self.GlobalPointToScreenSpace(self.right_rails[0])
-
-            pg.draw.line(
-                self.screen,
-                self.start_line_color,
-                left_side,
-                right_side,
-                width=floor(self.track_width * self.zoom / 5),
-            )
-
     def Draw(self):
-        self.screen.fill(self.background_color)
         self.DrawTrack()
         pg.draw.circle(
             self.screen, self.cursor_color, self.screen_mouse_pos, self.cursor_radius
@@ -725,58 +1023,142 @@ class TrackBuilder:
             pg.display.flip()
 
     def Quit(self):
-        if not self.is_saving:
-            pg.quit()
-            sys.exit()
+        if self.is_saving:
+            print("Waiting for track saves to finish...")
+
+        self.save_executor.shutdown(wait=True)
+
+        pg.quit()
+        sys.exit()
 
     def GetTrackName(self) -> str | None:
-        current_track_names = os.listdir(self.save_dir)
-        current_track_numbers = [
-            int(name.split("-")[1]) for name in current_track_names if "-" in name
-        ]
+        current_track_numbers = set()
+
+        for name in os.listdir(self.save_dir) + list(self.reserved_track_names):
+            prefix, _, number = name.partition("-")
+
+            if prefix == "Track" and number.isdigit():
+                current_track_numbers.add(int(number))
+
         new_track_numbers = list(range(1, len(current_track_numbers) + 2))
 
         for new_track_number in new_track_numbers:
             if new_track_number not in current_track_numbers:
                 return f"Track-{new_track_number}"
 
-    def Save(self):
-        if not self.is_closed or self.background_color == (5, 5, 5):
-            return
-
-        self.is_saving = True
+    def RenderPreview(
+        self,
+        left_rails: np.ndarray,
+        right_rails: np.ndarray,
+        background_color: Tuple[int, int, int],
+    ) -> pg.Surface:
+        preview = pg.Surface(self.preview_resolution)
+        preview.fill(background_color)
+
+        preview_size = np.asarray(self.preview_resolution, dtype=np.float64)
+        rails = np.concatenate((left_rails, right_rails), axis=0)
+        rails_min = rails.min(axis=0)
+        rails_size = np.maximum(rails.max(axis=0) - rails_min, 1e-6)
+
+        scale = np.min((1 - 2 * self.preview_margin) * preview_size / rails_size)
+        offset = (preview_size - scale * rails_size) / 2 - scale * rails_min
+
+        left_s = left_rails * scale + offset
+        right_s = right_rails * scale + offset
+        next_left_s = np.roll(left_s, -1, axis=0)
+        next_right_s = np.roll(right_s, -1, axis=0)
+
+        for quad in np.stack((left_s, next_left_s, next_right_s, right_s), axis=1):
+            pg.draw.polygon(preview, self.track_color, quad)
+
+        pg.draw.line(
+            preview,
+            self.start_line_color,
+            left_s[0],
+            right_s[0],
+            width=max(floor(self.track_width * scale / 5), 1),
+        )
 
-        left_rails = T.as_tensor(self.left_rails, dtype=T.float32)
-        right_rails = T.as_tensor(self.right_rails, dtype=T.float32)
-        points = T.as_tensor(self.points, dtype=T.float32)
+        rail_width = max(floor(self.track_width * scale / 4), 1)
+        pg.draw.lines(preview, self.rails_color, True, left_s, width=rail_width)
+        pg.draw.lines(preview, self.rails_color, True, right_s, width=rail_width)
+
+        return preview
+
+    def WriteTrack(
+        self,
+        track_name: str,
+        points: List[Tuple[float, float]],
+        left_rails: List[Tuple[float, float]],
+        right_rails: List[Tuple[float, float]],
+        background_color: Tuple[int, int, int],
+    ):
+        # The track is written to a hidden directory which is renamed into place
+        # once complete, so trainers never load a partially written track.
+        track_save_dir = f"{self.save_dir}//{track_name}"
+        temp_save_dir = f"{self.save_dir}//.{track_name}.tmp"
+
+        try:
+            left_rails = np.asarray(left_rails, dtype=np.float32)
+            right_rails = np.asarray(right_rails, dtype=np.float32)
+            points = np.asarray(points, dtype=np.float32)
+
+            left_rails -= points[0]
+            right_rails -= points[0]
+            points -= points[0]
+
+            shutil.rmtree(temp_save_dir, ignore_errors=True)
+            os.makedirs(temp_save_dir)
+
+            T.save(
+                {
+                    "left_rails": T.from_numpy(left_rails),
+                    "right_rails": T.from_numpy(right_rails),
+                    "points": T.from_numpy(points),
+                },
+                f"{temp_save_dir}//data.pt",
+            )
 
-        left_rails -= points[0]
-        right_rails -= points[0]
-        points = points - points[0]
+            with open(f"{temp_save_dir}//preview.png", "wb") as preview_file:
+                pg.image.save(
+                    self.RenderPreview(left_rails, right_rails, background_color),
+                    preview_file,
+                    "preview.png",
+                )
 
-        os.makedirs(self.save_dir, exist_ok=True)
+            os.replace(temp_save_dir, track_save_dir)
 
-        track_name = self.GetTrackName()
-        track_save_dir = f"{self.save_dir}//{track_name}"
+        except Exception as exception:
+            shutil.rmtree(temp_save_dir, ignore_errors=True)
+            print(f"Saving '{track_name}' failed: {exception}")
 
-        os.makedirs(track_save_dir, exist_ok=True)
+        finally:
+            with self.save_lock:
+                self.reserved_track_names.discard(track_name)
+                self.is_saving = len(self.reserved_track_names) > 0
 
-        T.save(
-            {"left_rails": left_rails, "right_rails": right_rails, "points": points},
-            f"{track_save_dir}//data.pt",
-        )
+    def Save(self):
+        if not self.is_closed or self.background_color == (5, 5, 5):
+            return
 
-        self.screen.fill(self.background_color)
-        self.DrawRoad()
-        self.DrawStartLine()
-        self.DrawRails()
+        os.makedirs(self.save_dir, exist_ok=True)
 
-        pg.image.save(self.screen, f"{track_save_dir}//preview.png")
+        with self.save_lock:
+            track_name = self.GetTrackName()
+            self.reserved_track_names.add(track_name)
+            self.is_saving = True
+
+        self.save_executor.submit(
+            self.WriteTrack,
+            track_name,
+            list(self.points),
+            list(self.left_rails),
+            list(self.right_rails),
+            self.background_color,
+        )
 
         self.background_color = (5, 5, 5)
 
-        self.is_saving = False
-
 
 if __name__ == "__main__":
     builder = TrackBuilder()
@@ -0,0 +1,143 @@
+import struct
+import numpy as np
+from collections import deque
+from typing import Optional, Tuple
+
+
+# (x, y, left_x, left_y, right_x, right_y, edited_rail)
+PointState = Tuple[float, float, float, float, float, float, bool]
+
+POINT_STATE_STRUCT = struct.Struct("<6d?")
+
+
+class TrackEdit:
+    INSERT = 0
+    REMOVE = 1
+    SET = 2
+    CLOSE = 3
+    RESET = 4
+
+    # Rough per-edit bookkeeping cost on top of the packed payload.
+    OVERHEAD_BYTES = 64
+
+    __slots__ = ("kind", "index", "old", "new")
+
+    def __init__(self, kind: int, index: int = -1, old=None, new=None):
+        self.kind = kind
+        self.index = index
+        self.old = old
+        self.new = new
+
+    @staticmethod
+    def PackState(state: PointState) -> bytes:
+        return POINT_STATE_STRUCT.pack(*state)
+
+    @staticmethod
+    def UnpackState(packed_state: bytes) -> PointState:
+        return POINT_STATE_STRUCT.unpack(packed_state)
+
+    @staticmethod
+    def Insert(index: int, state: PointState) -> "TrackEdit":
+        return TrackEdit(TrackEdit.INSERT, index, new=TrackEdit.PackState(state))
+
+    @staticmethod
+    def Remove(index: int, state: PointState) -> "TrackEdit":
+        return TrackEdit(TrackEdit.REMOVE, index, old=TrackEdit.PackState(state))
+
+    @staticmethod
+    def Set(index: int, old_state: PointState, new_state: PointState) -> "TrackEdit":
+        return TrackEdit(
+            TrackEdit.SET,
+            index,
+            old=TrackEdit.PackState(old_state),
+            new=TrackEdit.PackState(new_state),
+        )
+
+    @staticmethod
+    def Close(old_is_closed: bool, new_is_closed: bool) -> "TrackEdit":
+        return TrackEdit(TrackEdit.CLOSE, old=old_is_closed, new=new_is_closed)
+
+    @staticmethod
+    def Reset(
+        coordinates: np.ndarray, edited_rails: np.ndarray, is_closed: bool
+    ) -> "TrackEdit":
+        return TrackEdit(TrackEdit.RESET, old=(coordinates, edited_rails, is_closed))
+
+    def NBytes(self) -> int:
+        if self.kind == TrackEdit.RESET:
+            coordinates, edited_rails, _ = self.old
+            return coordinates.nbytes + edited_rails.nbytes + TrackEdit.OVERHEAD_BYTES
+
+        n_bytes = TrackEdit.OVERHEAD_BYTES
+
+        for state in (self.old, self.new):
+            if isinstance(state, bytes):
+                n_bytes += len(state)
+
+        return n_bytes
+
+
+class TrackHistory:
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.undo_entries = deque()
+        self.redo_entries = []
+        self.pending_edits = []
+
+        self.n_bytes = 0
+        self.is_replaying = False
+
+    @staticmethod
+    def EntryNBytes(entry: Tuple[TrackEdit, ...]) -> int:
+        return sum(edit.NBytes() for edit in entry)
+
+    def Record(self, edit: TrackEdit):
+        if not self.is_replaying:
+            self.pending_edits.append(edit)
+
+    def Commit(self):
+        if self.is_replaying or len(self.pending_edits) == 0:
+            return
+
+        self.PushUndo(tuple(self.pending_edits))
+        self.pending_edits = []
+
+        for entry in self.redo_entries:
+            self.n_bytes -= self.EntryNBytes(entry)
+
+        self.redo_entries = []
+
+    def PushUndo(self, entry: Tuple[TrackEdit, ...]):
+        self.undo_entries.append(entry)
+        self.n_bytes += self.EntryNBytes(entry)
+
+        while len(self.undo_entries) > 1 and (
+            len(self.undo_entries) > self.max_entries or self.n_bytes > self.max_bytes
+        ):
+            self.n_bytes -= self.EntryNBytes(self.undo_entries.popleft())
+
+    def PopUndo(self) -> Optional[Tuple[TrackEdit, ...]]:
+        if len(self.undo_entries) == 0:
+            return None
+
+        entry = self.undo_entries.pop()
+        self.redo_entries.append(entry)
+
+        return entry
+
+    def PopRedo(self) -> Optional[Tuple[TrackEdit, ...]]:
+        if len(self.redo_entries) == 0:
+            return None
+
+        entry = self.redo_entries.pop()
+        self.undo_entries.append(entry)
+
+        return entry
+
+    def Clear(self):
+        self.undo_entries.clear()
+        self.redo_entries = []
+        self.pending_edits = []
+        self.n_bytes = 0
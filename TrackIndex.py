@@ -0,0 +1,127 @@
+import torch as T
+
+from Track import Track
+from LinAlg import LinAlg
+from typing import Dict, Tuple
+
+
+class TrackIndex:
+    """Uniform grid over the track lines for ray casting. Every cell lists the
+    lines that come within half a cell of it, and rays only test the lines of
+    the cells under points sampled at most one cell apart along their own
+    range. Any line a ray hits is within half a sample spacing of a sample, so
+    the depths equal those against all lines, at a cost that depends on the
+    ray count and ranges instead of the track size."""
+
+    # Indices built by Load, shared by every environment on the same track.
+    cache: Dict[Tuple, "TrackIndex"] = {}
+
+    def __init__(self, track_lines: T.Tensor, cell_size: float = 10.0):
+        self.track_lines = track_lines
+        self.cell_size = cell_size
+
+        dtype, device = track_lines.dtype, track_lines.device
+        points = T.cat((track_lines[..., 0], track_lines[..., 0] + track_lines[..., 1]))
+
+        # One cell of margin, so points off the grid are over half a cell from
+        # every line.
+        self.origin = T.min(points, dim=0)[0] - cell_size
+        self.shape = (
+            T.ceil((T.max(points, dim=0)[0] + cell_size - self.origin) / cell_size)
+            .long()
+            .tolist()
+        )
+        n_x, n_y = self.shape
+
+        centers = self.origin + cell_size * (
+            T.stack(
+                T.meshgrid(
+                    T.arange(n_x, dtype=dtype, device=device),
+                    T.arange(n_y, dtype=dtype, device=device),
+                    indexing="ij",
+                ),
+                dim=-1,
+            ).reshape(-1, 2)
+            + 0.5
+        )
+
+        # A cell is within half a cell of a line when its center is within
+        # half a cell plus half its diagonal, 1.21 cells, rounded up for slack.
+        # Cells are tested in chunks to bound the memory on large tracks.
+        a = track_lines[..., 0]
+        ab = track_lines[..., 1]
+        ab_square = T.sum(ab**2, dim=-1)
+        near_cells, near_lines = [], []
+
+        for chunk in T.split(centers, 1024):
+            offsets = chunk[:, None] - a[None]
+            ts = T.clamp(T.sum(offsets * ab[None], dim=-1) / ab_square[None], 0.0, 1.0)
+            distances = T.sqrt(T.sum((offsets - ts[..., None] * ab[None]) ** 2, dim=-1))
+
+            cells, lines = T.nonzero(distances <= 1.25 * cell_size, as_tuple=True)
+            near_cells.append(cells + len(near_cells) * 1024)
+            near_lines.append(lines)
+
+        cells = T.cat(near_cells)
+        lines = T.cat(near_lines)
+
+        # Cells list their lines padded with -1, in line order.
+        counts = T.bincount(cells, minlength=n_x * n_y)
+        self.max_lines = max(int(T.max(counts)), 1)
+        self.cell_lines = T.full(
+            (n_x * n_y, self.max_lines), -1, dtype=T.long, device=device
+        )
+
+        starts = T.cumsum(counts, 0) - counts
+        ranks = T.arange(cells.numel(), device=device) - starts[cells]
+        self.cell_lines[cells, ranks] = lines
+
+        self.min_cell = T.zeros((2,), dtype=T.long, device=device)
+        self.max_cell = T.as_tensor([n_x - 1, n_y - 1], device=device)
+        self.cell_strides = T.as_tensor([n_y, 1], device=device)
+
+    @staticmethod
+    def Load(track: Track, cell_size: float = 10.0) -> "TrackIndex":
+        key = (
+            track.track_name,
+            tuple(track.track_lines.shape),
+            float(T.sum(track.track_lines)),
+            cell_size,
+            track.track_lines.dtype,
+            str(track.track_lines.device),
+        )
+
+        if key not in TrackIndex.cache:
+            TrackIndex.cache[key] = TrackIndex(track.track_lines, cell_size)
+
+        return TrackIndex.cache[key]
+
+    def GetSampleFractions(self, ray_ranges: T.Tensor) -> T.Tensor:
+        """Fractions along every ray to sample cells at, at most a cell apart,
+        padded with the ray end for rays shorter than the longest."""
+        n_samples = T.ceil(ray_ranges / self.cell_size).long() + 1
+        max_samples = int(T.max(n_samples))
+
+        steps = T.arange(max_samples, dtype=ray_ranges.dtype, device=ray_ranges.device)
+
+        return T.clamp(steps[None] / (n_samples[:, None] - 1), max=1.0)
+
+    def GetCells(self, points: T.Tensor) -> T.Tensor:
+        # Points off the grid are clamped onto its border cells, which only
+        # adds candidates.
+        cells = T.floor((points - self.origin) / self.cell_size).long()
+        cells = T.clamp(cells, min=self.min_cell, max=self.max_cell)
+
+        return T.sum(cells * self.cell_strides, dim=-1)
+
+    def GetDepths(self, ray_lines: T.Tensor, sample_fractions: T.Tensor) -> T.Tensor:
+        """Same as LinAlg.get_truncated_depth(ray_lines, track_lines)."""
+        samples = (
+            ray_lines[:, None, :, 0]
+            + sample_fractions[..., None] * ray_lines[:, None, :, 1]
+        )
+        candidates = self.cell_lines[self.GetCells(samples)].flatten(1)
+
+        return LinAlg.get_truncated_depth_candidates(
+            ray_lines, self.track_lines[candidates.clamp(min=0)], candidates >= 0
+        )
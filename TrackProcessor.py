@@ -0,0 +1,234 @@
+import os
+import sys
+import argparse
+import torch as T
+
+from Track import Track
+from typing import Dict, Optional, Tuple
+
+
+class TrackProcessor:
+
+    @staticmethod
+    def get_segment_weights(points: T.Tensor, curvature_factor: float) -> T.Tensor:
+        segments = T.roll(points, -1, 0) - points
+        segment_lengths = T.sqrt(T.sum(segments**2, dim=-1))
+
+        if curvature_factor <= 0.0:
+            return segment_lengths
+
+        segment_angles = T.atan2(segments[:, 1], segments[:, 0])
+        turn_angles = T.remainder(
+            segment_angles - T.roll(segment_angles, 1, 0) + T.pi, 2 * T.pi
+        ) - T.pi
+
+        # Sharp corners get a larger share of the samples than straights of the
+        # same length.
+        return segment_lengths + curvature_factor * T.abs(turn_angles)
+
+    @staticmethod
+    def resample(
+        points: T.Tensor,
+        left_rails: T.Tensor,
+        right_rails: T.Tensor,
+        spacing: float,
+        curvature_factor: float = 0.0,
+    ) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        segment_weights = TrackProcessor.get_segment_weights(points, curvature_factor)
+        cumulative_weights = T.concat(
+            (T.zeros_like(segment_weights[:1]), T.cumsum(segment_weights, dim=0))
+        )
+
+        track_length = T.sum(
+            T.sqrt(T.sum((T.roll(points, -1, 0) - points) ** 2, dim=-1))
+        )
+        n_samples = max(3, round(track_length.item() / spacing))
+
+        sample_weights = T.linspace(
+            0.0,
+            cumulative_weights[-1].item(),
+            n_samples + 1,
+            dtype=points.dtype,
+            device=points.device,
+        )[:-1]
+
+        segment_indices = T.clamp(
+            T.searchsorted(cumulative_weights, sample_weights, right=True) - 1,
+            0,
+            points.size(0) - 1,
+        )
+        segment_fractions = (
+            (sample_weights - cumulative_weights[segment_indices])
+            / T.clamp(segment_weights[segment_indices], min=T.finfo(points.dtype).eps)
+        )[:, None]
+        next_indices = (segment_indices + 1) % points.size(0)
+
+        def interpolate(positions: T.Tensor) -> T.Tensor:
+            return positions[segment_indices] + segment_fractions * (
+                positions[next_indices] - positions[segment_indices]
+            )
+
+        return interpolate(points), interpolate(left_rails), interpolate(right_rails)
+
+    @staticmethod
+    def get_distances_to_segment(
+        positions: T.Tensor, a: T.Tensor, b: T.Tensor
+    ) -> T.Tensor:
+        ab = b - a
+        ab_square = T.clamp(T.sum(ab**2), min=T.finfo(positions.dtype).tiny)
+
+        ts = T.clamp(T.sum((positions - a[None]) * ab[None], dim=-1) / ab_square, 0, 1)
+
+        return T.sqrt(T.sum((positions - a[None] - ts[:, None] * ab[None]) ** 2, dim=-1))
+
+    @staticmethod
+    def simplify(
+        points: T.Tensor,
+        left_rails: T.Tensor,
+        right_rails: T.Tensor,
+        tolerance: float,
+    ) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        """Douglas-Peucker on the closed centerline and both rails at once: a
+        point is only dropped if all three polylines stay within tolerance."""
+        polylines = [
+            T.concat((positions, positions[:1]), dim=0)
+            for positions in (points, left_rails, right_rails)
+        ]
+        n_points = points.size(0)
+
+        keep_mask = T.zeros(n_points + 1, dtype=T.bool, device=points.device)
+        keep_mask[0] = True
+        keep_mask[n_points] = True
+
+        ranges = [(0, n_points)]
+
+        while len(ranges) > 0:
+            start, stop = ranges.pop()
+
+            if stop - start < 2:
+                continue
+
+            distances = T.stack(
+                [
+                    TrackProcessor.get_distances_to_segment(
+                        polyline[start + 1 : stop], polyline[start], polyline[stop]
+                    )
+                    for polyline in polylines
+                ]
+            ).amax(dim=0)
+
+            max_distance, max_index = T.max(distances, dim=0)
+            max_index = start + 1 + max_index.item()
+
+            # The closing range starts and ends in the same point, so it always
+            # needs to be split for the track to keep its shape.
+            if max_distance > tolerance or (start == 0 and stop == n_points):
+                keep_mask[max_index] = True
+                ranges.append((start, max_index))
+                ranges.append((max_index, stop))
+
+        keep_indices = T.nonzero(keep_mask[:n_points])[:, 0]
+
+        if keep_indices.size(0) < 3:
+            return points, left_rails, right_rails
+
+        return points[keep_indices], left_rails[keep_indices], right_rails[keep_indices]
+
+    @staticmethod
+    def process(
+        track_name: str,
+        spacing: Optional[float] = None,
+        tolerance: float = 0.05,
+        curvature_factor: float = 0.0,
+        save_dir: str = "Tracks",
+    ) -> Dict[str, float]:
+        """Resamples the track every spacing units, if given, and simplifies it
+        within tolerance. Resampling sparse tracks finer than their points adds
+        segments, so by default only the original points are simplified.
+        Reductions are relative to the original segment count."""
+        track_save_dir = f"{save_dir}//{track_name}"
+        track_data = T.load(f"{track_save_dir}//data.pt")
+
+        points = track_data["points"].to(dtype=T.float64)
+        left_rails = track_data["left_rails"].to(dtype=T.float64)
+        right_rails = track_data["right_rails"].to(dtype=T.float64)
+
+        n_original_segments = points.size(0)
+
+        if spacing is not None:
+            points, left_rails, right_rails = TrackProcessor.resample(
+                points, left_rails, right_rails, spacing, curvature_factor
+            )
+
+        n_resampled_segments = points.size(0)
+
+        if tolerance > 0.0:
+            points, left_rails, right_rails = TrackProcessor.simplify(
+                points, left_rails, right_rails, tolerance
+            )
+
+        n_processed_segments = points.size(0)
+
+        if n_processed_segments > n_original_segments:
+            print(
+                f"Warning: {track_name} has {n_processed_segments} segments after "
+                f"processing, more than its original {n_original_segments}. Use a "
+                f"larger spacing or a larger tolerance.",
+                file=sys.stderr,
+            )
+
+        processed_path = f"{track_save_dir}//processed.pt"
+        temp_path = f"{track_save_dir}//.processed.pt.tmp"
+
+        T.save(
+            {
+                "left_rails": left_rails.to(dtype=T.float32),
+                "right_rails": right_rails.to(dtype=T.float32),
+                "points": points.to(dtype=T.float32),
+                "spacing": spacing,
+                "tolerance": tolerance,
+                "curvature_factor": curvature_factor,
+            },
+            temp_path,
+        )
+        os.replace(temp_path, processed_path)
+
+        return {
+            "original_segments": n_original_segments,
+            "resampled_segments": n_resampled_segments,
+            "processed_segments": n_processed_segments,
+            "reduction": 1.0 - n_processed_segments / n_original_segments,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resample and simplify tracks, storing them as processed.pt."
+    )
+    parser.add_argument("track_names", nargs="*")
+    parser.add_argument(
+        "--spacing",
+        type=float,
+        default=None,
+        help="resample the track at this spacing before simplifying it",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--curvature-factor", type=float, default=0.0)
+    args = parser.parse_args()
+
+    track_names = args.track_names or Track.GetNames()
+
+    for track_name in track_names:
+        stats = TrackProcessor.process(
+            track_name, args.spacing, args.tolerance, args.curvature_factor
+        )
+        print(
+            f"{track_name}: {stats['original_segments']} -> "
+            + (
+                f"{stats['resampled_segments']} (resampled) -> "
+                if args.spacing is not None
+                else ""
+            )
+            + f"{stats['processed_segments']} segments "
+            f"({100 * stats['reduction']:+.1f}% reduction from the original)"
+        )
@@ -0,0 +1,214 @@
+import math
+import torch as T
+
+from Track import Track
+from TrackIndex import TrackIndex
+from typing import Dict, List, Tuple
+
+
+class TrackSDF:
+    """Signed distance to the nearest rail sampled on a grid of resolution
+    spacing, positive on the track and negative off it, and interpolated
+    bilinearly. Distances are truncated at half a cell of a TrackIndex, which
+    only has to list the lines near every grid point.
+
+    The signed distance is 1-Lipschitz, so bilinear interpolation is off by
+    at most error_bound, half the grid diagonal, and points with an
+    interpolated absolute value above it are certainly clear of the rails.
+
+    Samples index the flattened grid directly, and IsClear interpolates its
+    few points in Python on a NumPy copy of the grid, which skips the per op
+    overhead of small tensors."""
+
+    # Fields built by Load, shared by every environment on the same track.
+    cache: Dict[Tuple, "TrackSDF"] = {}
+
+    def __init__(self, track: Track, resolution: float = 0.5, cell_size: float = 10.0):
+        self.resolution = resolution
+        self.error_bound = resolution / math.sqrt(2)
+
+        track_lines = track.track_lines
+        dtype, device = track_lines.dtype, track_lines.device
+        track_index = TrackIndex(track_lines, cell_size)
+
+        self.origin = track_index.origin
+        n_x, n_y = (
+            T.ceil(T.as_tensor(track_index.shape) * cell_size / resolution).long() + 1
+        ).tolist()
+
+        # Grid points, x major, and their distance to the lines of their cell.
+        xs = self.origin[0] + resolution * T.arange(n_x, dtype=dtype, device=device)
+        ys = self.origin[1] + resolution * T.arange(n_y, dtype=dtype, device=device)
+        points = T.stack(T.meshgrid(xs, ys, indexing="ij"), dim=-1).reshape(-1, 2)
+
+        distances = []
+
+        for chunk in T.split(points, 65536):
+            candidates = track_index.cell_lines[track_index.GetCells(chunk)]
+            lines = track_lines[candidates.clamp(min=0)]
+
+            a = lines[..., 0]
+            ab = lines[..., 1]
+            offsets = chunk[:, None] - a
+            ts = T.clamp(
+                T.sum(offsets * ab, dim=-1) / T.sum(ab**2, dim=-1), 0.0, 1.0
+            )
+            chunk_distances = T.sqrt(
+                T.sum((offsets - ts[..., None] * ab) ** 2, dim=-1)
+            )
+            chunk_distances[candidates < 0] = cell_size / 2
+
+            distances.append(
+                T.clamp(T.min(chunk_distances, dim=1)[0], max=cell_size / 2)
+            )
+
+        # The track lies inside exactly one of the rail loops.
+        on_track = TrackSDF.IsInside(xs, ys, track.left_rails) ^ TrackSDF.IsInside(
+            xs, ys, track.right_rails
+        )
+        distances = T.cat(distances).reshape(n_x, n_y)
+        field = T.where(on_track, distances, -distances)
+
+        # Flattened x major, with the offsets of the 4 grid points of a cell.
+        self.values = field.flatten()
+        self.corner_offsets = T.as_tensor([0, 1, n_y, n_y + 1], device=device)
+        self.strides = T.as_tensor([n_y, 1], device=device)
+        self.max_grid = T.as_tensor([n_x - 1, n_y - 1], dtype=dtype, device=device)
+        self.max_cell = T.as_tensor([n_x - 2, n_y - 2], device=device)
+
+        self.grid = field.cpu().numpy()
+        self.origin_x, self.origin_y = self.origin.tolist()
+        self.n_x, self.n_y = n_x, n_y
+
+    @staticmethod
+    def Load(
+        track: Track, resolution: float = 0.5, cell_size: float = 10.0
+    ) -> "TrackSDF":
+        key = (
+            track.track_name,
+            tuple(track.track_lines.shape),
+            float(T.sum(track.track_lines)),
+            resolution,
+            cell_size,
+            track.track_lines.dtype,
+            str(track.track_lines.device),
+        )
+
+        if key not in TrackSDF.cache:
+            TrackSDF.cache[key] = TrackSDF(track, resolution, cell_size)
+
+        return TrackSDF.cache[key]
+
+    @staticmethod
+    def IsInside(xs: T.Tensor, ys: T.Tensor, polygon: T.Tensor) -> T.Tensor:
+        """Even-odd test of the (len(xs), len(ys)) grid of points against a
+        closed polygon, counting the edge crossings right of every point on
+        the sorted crossings of its row."""
+        a = polygon
+        b = T.roll(polygon, -1, 0)
+
+        y = ys[:, None]
+        straddles = (a[:, 1] > y) != (b[:, 1] > y)
+        crossings_x = a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / (
+            b[:, 1] - a[:, 1]
+        )
+        crossings_x = T.sort(T.where(straddles, crossings_x, -math.inf), dim=1)[0]
+
+        n_right = polygon.size(0) - T.searchsorted(
+            crossings_x, xs.expand(ys.numel(), -1).contiguous(), right=True
+        )
+
+        return (n_right % 2 == 1).T
+
+    def Sample(self, points: T.Tensor) -> T.Tensor:
+        """Interpolated signed distances of (..., 2) points, clamped to the
+        border of the grid."""
+        grid = T.minimum(
+            T.clamp((points - self.origin) / self.resolution, min=0.0), self.max_grid
+        )
+        cells = T.minimum(grid.long(), self.max_cell)
+        fractions = grid - cells
+
+        # Values of the (x, y), (x, y + 1), (x + 1, y) and (x + 1, y + 1) points.
+        values = self.values[
+            T.sum(cells * self.strides, dim=-1, keepdim=True) + self.corner_offsets
+        ]
+        values = values[..., :2] + fractions[..., :1] * (
+            values[..., 2:] - values[..., :2]
+        )
+
+        return values[..., 0] + fractions[..., 1] * (values[..., 1] - values[..., 0])
+
+    def SamplePoint(self, x: float, y: float) -> float:
+        """Sample of a single point, in Python floats."""
+        grid_x = min(max((x - self.origin_x) / self.resolution, 0.0), self.n_x - 1)
+        grid_y = min(max((y - self.origin_y) / self.resolution, 0.0), self.n_y - 1)
+        cell_x = min(int(grid_x), self.n_x - 2)
+        cell_y = min(int(grid_y), self.n_y - 2)
+        fraction_x = grid_x - cell_x
+        fraction_y = grid_y - cell_y
+
+        value_0, value_1 = self.grid[cell_x, cell_y : cell_y + 2]
+        value_2, value_3 = self.grid[cell_x + 1, cell_y : cell_y + 2]
+        value_0 += fraction_x * (value_2 - value_0)
+        value_1 += fraction_x * (value_3 - value_1)
+
+        return float(value_0 + fraction_y * (value_1 - value_0))
+
+    def IsClear(self, corners: T.Tensor, edge_lengths: List[float]) -> bool:
+        """Whether the closed polygon of (n, 2) corners is clear of the rails,
+        from its corners only. An edge touching a rail has corner distances
+        summing to at most its length, so larger lower bounds rule it out."""
+        bounds = [
+            abs(self.SamplePoint(x, y)) - self.error_bound for x, y in corners.tolist()
+        ]
+
+        return all(
+            bounds[index] + bounds[index - 1] > edge_lengths[index - 1]
+            for index in range(len(bounds))
+        )
+
+    def TraceRays(
+        self, ray_lines: T.Tensor, ray_ranges: T.Tensor, max_steps: int = 64
+    ) -> T.Tensor:
+        """Sphere traces the rays through the field and returns the depth where
+        they leave the track as a fraction of their range, or 1. Rays step by
+        the distance bound while clear of the rails and by half a grid step
+        near them, and the crossing is placed by interpolating the field."""
+        min_step = self.resolution / 2
+
+        origins = ray_lines[..., 0]
+        directions = ray_lines[..., 1] / ray_ranges[:, None]
+
+        distances = T.zeros_like(ray_ranges)
+        previous_distances = distances
+        previous_values = self.Sample(origins)
+        depths = T.ones_like(ray_ranges)
+        active = T.ones_like(ray_ranges, dtype=T.bool)
+
+        values = previous_values
+
+        for _ in range(max_steps):
+            steps = T.clamp(T.abs(values) - self.error_bound, min=min_step)
+            distances = T.where(active, distances + steps, distances)
+
+            values = self.Sample(origins + distances[:, None] * directions)
+
+            crossed = active & (values <= 0.0) & (distances < ray_ranges)
+            crossings = previous_distances + (distances - previous_distances) * (
+                previous_values / (previous_values - values)
+            )
+            depths = T.where(crossed, crossings / ray_ranges, depths)
+
+            active = active & ~crossed & (distances < ray_ranges)
+
+            if not T.any(active):
+                break
+
+            previous_distances = distances
+            previous_values = values
+
+        # Rays still marching after max_steps report how far they got.
+        depths = T.where(active, distances / ray_ranges, depths)
+
+        return T.clamp(depths, max=1.0)
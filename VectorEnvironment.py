@@ -0,0 +1,331 @@
+import os
+import torch as T
+import torch.multiprocessing as mp
+
+from Config import EnvironmentConfig
+from Environment import Environment
+from Seeding import ENVIRONMENT_STREAM, DeriveSeed
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class VectorEnvironment:
+    def __init__(self, environments: List[Environment], auto_reset: bool = True):
+        self.environments = environments
+        self.n_envs = len(environments)
+        self.auto_reset = auto_reset
+
+        self.dtype = environments[0].dtype
+        self.device = environments[0].device
+        self.observation_size = environments[0].car.n_rays + 1
+
+        self.observations = T.zeros(
+            (self.n_envs, self.observation_size), dtype=self.dtype, device=self.device
+        )
+        self.rewards = T.zeros((self.n_envs,), dtype=self.dtype, device=self.device)
+        self.crashed = T.zeros((self.n_envs,), dtype=T.bool, device=self.device)
+        self.truncated = T.zeros((self.n_envs,), dtype=T.bool, device=self.device)
+        self.final_observations = T.zeros_like(self.observations)
+
+    @staticmethod
+    def FromConfig(
+        config: EnvironmentConfig,
+        n_envs: Optional[int] = None,
+        auto_reset: bool = True,
+    ) -> "VectorEnvironment":
+        if n_envs is None:
+            n_envs = config.n_actors
+
+        return VectorEnvironment(
+            [
+                Environment.FromConfig(config, env_index)
+                for env_index in range(n_envs)
+            ],
+            auto_reset=auto_reset,
+        )
+
+    def GetEnvIndices(self, env_mask: Optional[T.Tensor]) -> List[int]:
+        if env_mask is None:
+            return list(range(self.n_envs))
+
+        return T.nonzero(env_mask)[:, 0].tolist()
+
+    def Reset(
+        self,
+        start_indices: Optional[Sequence[Optional[int]]] = None,
+        env_mask: Optional[T.Tensor] = None,
+        seed: Optional[int] = None,
+    ) -> Tuple[T.Tensor, T.Tensor]:
+        """Resets the environments in env_mask, restarting their spawn streams
+        from the root seed if one is given, as Environment.FromConfig does."""
+        for env_index in self.GetEnvIndices(env_mask):
+            if seed is not None:
+                self.environments[env_index].Seed(
+                    DeriveSeed(seed, ENVIRONMENT_STREAM, env_index)
+                )
+
+            observation, crashed = self.environments[env_index].Reset(
+                None if start_indices is None else start_indices[env_index]
+            )
+
+            self.observations[env_index] = observation
+            self.crashed[env_index] = crashed
+            self.truncated[env_index] = False
+
+        return self.observations, self.crashed
+
+    def Step(
+        self,
+        wheel_angles: T.Tensor,
+        accelerations: T.Tensor,
+        env_mask: Optional[T.Tensor] = None,
+    ) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        """Steps the environments in env_mask (all by default) and returns the
+        batched observations, rewards and crashes in reused buffers, clone them
+        to keep them. Masked out environments get a reward of 0. truncated
+        flags environments that ran into their time limit without crashing.
+        With auto_reset ended environments are reset and return their first
+        observation, and their last one is kept in final_observations."""
+        self.rewards.zero_()
+
+        for env_index in self.GetEnvIndices(env_mask):
+            environment = self.environments[env_index]
+
+            observation, reward, crashed = environment.Step(
+                wheel_angles[env_index], accelerations[env_index]
+            )
+            truncated = environment.IsTruncated() and not crashed
+
+            if (crashed or truncated) and self.auto_reset:
+                self.final_observations[env_index] = observation
+                observation, _ = environment.Reset()
+
+            self.observations[env_index] = observation
+            self.rewards[env_index] = reward
+            self.crashed[env_index] = crashed
+            self.truncated[env_index] = truncated
+
+        return self.observations, self.rewards, self.crashed
+
+
+# Commands the learner writes for every environment before waking the workers.
+NOOP, STEP, RESET, CLOSE = range(4)
+
+
+def RunWorker(
+    config: EnvironmentConfig,
+    env_indices: range,
+    buffers: Dict[str, T.Tensor],
+    auto_reset: bool,
+    step_semaphore: Any,
+    done_semaphore: Any,
+):
+    T.set_num_threads(1)
+
+    environments = {
+        env_index: Environment.FromConfig(config, env_index)
+        for env_index in env_indices
+    }
+    done_semaphore.release()
+
+    commands = buffers["commands"]
+    actions = buffers["actions"]
+    start_indices = buffers["start_indices"]
+    seed = buffers["seed"]
+
+    while True:
+        step_semaphore.acquire()
+
+        worker_commands = commands[env_indices.start : env_indices.stop].tolist()
+
+        if CLOSE in worker_commands:
+            done_semaphore.release()
+            return
+
+        buffers["rewards"][env_indices.start : env_indices.stop] = 0.0
+
+        for env_index, command in zip(env_indices, worker_commands):
+            environment = environments[env_index]
+
+            if command == STEP:
+                observation, reward, crashed = environment.Step(
+                    actions[env_index, 0], actions[env_index, 1]
+                )
+                truncated = environment.IsTruncated() and not crashed
+
+                if (crashed or truncated) and auto_reset:
+                    buffers["final_observations"][env_index] = observation
+                    observation, _ = environment.Reset()
+
+                buffers["rewards"][env_index] = reward
+
+            elif command == RESET:
+                if seed >= 0:
+                    environment.Seed(
+                        DeriveSeed(int(seed), ENVIRONMENT_STREAM, env_index)
+                    )
+
+                start_index = int(start_indices[env_index])
+                observation, crashed = environment.Reset(
+                    start_index if start_index >= 0 else None
+                )
+                truncated = False
+
+            else:
+                continue
+
+            buffers["observations"][env_index] = observation
+            buffers["crashed"][env_index] = crashed
+            buffers["truncated"][env_index] = truncated
+
+        done_semaphore.release()
+
+
+class SubprocessVectorEnvironment:
+    """VectorEnvironment with the environments split over worker processes.
+    Actions, observations, rewards and crashes are exchanged through shared
+    memory tensors and every step costs one semaphore release and acquire per
+    worker, so nothing is pickled after the workers have started."""
+
+    def __init__(
+        self,
+        config: EnvironmentConfig,
+        n_envs: Optional[int] = None,
+        n_workers: Optional[int] = None,
+        auto_reset: bool = True,
+    ):
+        if n_envs is None:
+            n_envs = config.n_actors
+        if n_workers is None:
+            n_workers = os.cpu_count()
+
+        n_workers = min(n_workers, n_envs)
+
+        self.n_envs = n_envs
+        self.n_workers = n_workers
+        self.auto_reset = auto_reset
+
+        # Shared memory lives on the cpu, whatever device the workers simulate on.
+        self.dtype = config.torch_dtype
+        self.device = "cpu"
+        self.observation_size = config.n_rays + 1
+
+        self.buffers = {
+            "commands": T.zeros((n_envs,), dtype=T.uint8),
+            "actions": T.zeros((n_envs, 2), dtype=self.dtype),
+            "start_indices": T.zeros((n_envs,), dtype=T.long),
+            "seed": T.zeros((), dtype=T.long),
+            "observations": T.zeros((n_envs, self.observation_size), dtype=self.dtype),
+            "final_observations": T.zeros(
+                (n_envs, self.observation_size), dtype=self.dtype
+            ),
+            "rewards": T.zeros((n_envs,), dtype=self.dtype),
+            "crashed": T.zeros((n_envs,), dtype=T.bool),
+            "truncated": T.zeros((n_envs,), dtype=T.bool),
+        }
+
+        for buffer in self.buffers.values():
+            buffer.share_memory_()
+
+        self.observations = self.buffers["observations"]
+        self.rewards = self.buffers["rewards"]
+        self.crashed = self.buffers["crashed"]
+        self.truncated = self.buffers["truncated"]
+        self.final_observations = self.buffers["final_observations"]
+
+        context = mp.get_context("spawn")
+        self.done_semaphore = context.Semaphore(0)
+        self.step_semaphores = []
+        self.workers = []
+
+        for worker in range(n_workers):
+            step_semaphore = context.Semaphore(0)
+            process = context.Process(
+                target=RunWorker,
+                args=(
+                    config.replace(render=False),
+                    range(
+                        worker * n_envs // n_workers, (worker + 1) * n_envs // n_workers
+                    ),
+                    self.buffers,
+                    auto_reset,
+                    step_semaphore,
+                    self.done_semaphore,
+                ),
+                daemon=True,
+            )
+            process.start()
+
+            self.step_semaphores.append(step_semaphore)
+            self.workers.append(process)
+
+        self.WaitForWorkers()
+
+    def WaitForWorkers(self):
+        for _ in range(self.n_workers):
+            while not self.done_semaphore.acquire(timeout=1.0):
+                if not all(process.is_alive() for process in self.workers):
+                    raise RuntimeError("An environment worker process died")
+
+    def Run(self, command: int, env_mask: Optional[T.Tensor]):
+        if env_mask is None:
+            self.buffers["commands"].fill_(command)
+        else:
+            T.where(
+                env_mask,
+                T.as_tensor(command, dtype=T.uint8),
+                T.as_tensor(NOOP, dtype=T.uint8),
+                out=self.buffers["commands"],
+            )
+
+        for step_semaphore in self.step_semaphores:
+            step_semaphore.release()
+
+        self.WaitForWorkers()
+
+    def Reset(
+        self,
+        start_indices: Optional[Sequence[Optional[int]]] = None,
+        env_mask: Optional[T.Tensor] = None,
+        seed: Optional[int] = None,
+    ) -> Tuple[T.Tensor, T.Tensor]:
+        # Root seeds are non-negative, -1 keeps the spawn streams going.
+        self.buffers["seed"].fill_(-1 if seed is None else seed)
+
+        if start_indices is None:
+            self.buffers["start_indices"].fill_(-1)
+        else:
+            self.buffers["start_indices"].copy_(
+                T.as_tensor(
+                    [-1 if index is None else index for index in start_indices]
+                )
+            )
+
+        self.Run(RESET, env_mask)
+
+        return self.observations, self.crashed
+
+    def Step(
+        self,
+        wheel_angles: T.Tensor,
+        accelerations: T.Tensor,
+        env_mask: Optional[T.Tensor] = None,
+    ) -> Tuple[T.Tensor, T.Tensor, T.Tensor]:
+        """Same as VectorEnvironment.Step, the returned tensors are the shared
+        buffers and are overwritten by the next step."""
+        self.buffers["actions"][:, 0] = wheel_angles
+        self.buffers["actions"][:, 1] = accelerations
+
+        self.Run(STEP, env_mask)
+
+        return self.observations, self.rewards, self.crashed
+
+    def Close(self):
+        self.buffers["commands"].fill_(CLOSE)
+
+        for step_semaphore in self.step_semaphores:
+            step_semaphore.release()
+
+        for process in self.workers:
+            process.join()
+
+        self.workers = []
@@ -1,45 +1,88 @@
-import torch as T
+import argparse
+import numpy as np
 
-from Reward import Reward
-from Cars.RaceCar import RaceCar
+from Config import EnvironmentConfig
 from Environment import Environment
 from CarController import CarController
+from Demonstrations import DemonstrationRecorder
 
-device = "cpu"
-dtype = T.float64
-
-track_name = "Track-2"
-
-dt = 1 / 60
-
-render = True
-random_spawn = False
-visualize_vision = True
-
-car = RaceCar(dtype, device)
-car_controller = CarController(dtype, device)
-reward_function = Reward(1, 10, 100)
-env = Environment(
-    car,
-    track_name,
-    dtype,
-    device,
-    reward_function,
-    render=render,
-    random_spawn=random_spawn,
-    visualize_vision=visualize_vision,
+parser = argparse.ArgumentParser(description="Drive a car with w, a, s and d.")
+parser.add_argument(
+    "arguments", nargs="*", help="[environment_config.toml|.json] [name=value ...]"
 )
+parser.add_argument("--record-inputs", default=None, help="save the key states to .npz")
+parser.add_argument("--replay-inputs", default=None, help="replay a .npz of key states")
+parser.add_argument(
+    "--record-demonstrations", default=None, help="save the episodes to a directory"
+)
+args = parser.parse_args()
+
+arguments = args.arguments
+
+if len(arguments) > 0 and arguments[0].endswith((".toml", ".json")):
+    config = EnvironmentConfig.load(arguments.pop(0))
+else:
+    config = EnvironmentConfig(render=True, visualize_vision=True)
+
+config = config.override(arguments)
+
+# Replays need the recorded spawns as well as the key states.
+replay_start_indices = []
+replay = None
+
+if args.replay_inputs is not None:
+    recording = np.load(args.replay_inputs)
+    replay = recording["key_states"]
+    replay_start_indices = recording["start_indices"].tolist()
+
+car_controller = CarController(
+    config.torch_dtype,
+    config.device,
+    record=args.record_inputs is not None,
+    replay=replay,
+)
+env = Environment.FromConfig(config)
+start_indices = []
+recorder = None
+
+if args.record_demonstrations is not None:
+    recorder = DemonstrationRecorder(args.record_demonstrations, config)
 
-vision, crashed = env.Reset()
+
+def Reset():
+    start_index = env.GetStartIndex(
+        replay_start_indices.pop(0) if replay_start_indices else None
+    )
+    start_indices.append(start_index)
+    vision, crashed = env.Reset(start_index)
+
+    if recorder is not None:
+        recorder.Reset(vision)
+
+    return vision, crashed
+
+
+vision, crashed = Reset()
 
 while True:
     if crashed:
-        vision, crashed = env.Reset()
+        vision, crashed = Reset()
         continue
 
     wheel_angle, acceleration, terminate = car_controller.GetActions()
 
     if terminate:
+        if args.record_inputs is not None:
+            car_controller.SaveRecording(
+                args.record_inputs, start_indices=np.asarray(start_indices)
+            )
+
+        if recorder is not None:
+            recorder.Close()
+
         env.Quit()
 
-    observation, reward, crashed = env.Step(wheel_angle, acceleration, dt)
+    observation, reward, crashed = env.Step(wheel_angle, acceleration)
+
+    if recorder is not None:
+        recorder.Step(wheel_angle, acceleration, observation, reward, crashed)